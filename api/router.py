@@ -1,7 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
 from typing import Optional
-from database import SessionLocal
 from models.api_models import (
     CreateMarketResearchRequest,
     CreateSearchTaskRequest,
@@ -10,6 +9,7 @@ from models.api_models import (
     ChatUpdateRequest
 )
 from services.research_service import MarketResearchService
+from services.container import container
 from models.research_models import MarketResearch, State
 from repositories.research_repository import (
     MarketResearchRepository,
@@ -21,30 +21,16 @@ from repositories.research_repository import (
 from utils.logger import logger, extension_logger
 from typing import List
 import json
-from fastapi import BackgroundTasks 
 
 router = APIRouter()
 
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    """Сессия на время запроса"""
+    yield from container.get_db()
 
 def create_service_with_session(db: Session) -> MarketResearchService:
     """Создание экземпляра сервиса с переданной сессией"""
-    service = MarketResearchService()
-    # Заменяем сессию в сервисе на переданную
-    service.db = db
-    service.mr_repo = MarketResearchRepository(db)
-    service.task_repo = SearchTaskRepository(db)
-    service.schema_repo = SchemaRepository(db)
-    service.raw_lot_repo = RawLotRepository(db)
-    service.analyzed_lot_repo = AnalyzedLotRepository(db)
-    # Обновляем репозиторий в чат-сервисе
-    service.chat_service.mr_repo = service.mr_repo
-    return service
+    return container.market_research_service(db)
 
 @router.post("/market_research", response_model=MarketResearch)
 async def create_market_research(request: CreateMarketResearchRequest, db: Session = Depends(get_db)):
@@ -126,7 +112,6 @@ async def get_task(db: Session = Depends(get_db)):
 @router.post("/submit_results")
 async def submit_results(
     request: SubmitResultsRequest, 
-    background_tasks: BackgroundTasks, 
     db: Session = Depends(get_db)):
     """Отправка результатов на сервер (от браузерного расширения)"""
     extension_logger.info(f"Получены результаты для задачи {request.task_id}")
@@ -146,10 +131,8 @@ async def submit_results(
             market_research = service.handle_quick_search_results(request.task_id, request.items)
             return {"status": "success"} 
         elif task.mode == "deep":
-            service.task_repo.update_status(request.task_id, "processing")
-            # Обработка результатов глубокого поиска
-            background_tasks.add_task(service.deep_search_service.handle_deep_search_results, request.task_id, request.items)
-            # market_research = service.handle_deep_search_results(request.task_id, request.items)
+            # Обработка результатов глубокого поиска - в воркере (run_worker.py), API только ставит задание
+            service.enqueue_deep_search_results(request.task_id, request.items)
             return {"status": "processing_started"}
         else:
             extension_logger.error(f"Неизвестный режим задачи: {task.mode}")
@@ -214,4 +197,10 @@ async def delete_market_research(mr_id: int, db: Session = Depends(get_db)):
     success = repo.delete(mr_id)
     if not success:
         raise HTTPException(status_code=404, detail="Research not found")
-    return {"status": "deleted"}
\ No newline at end of file
+    return {"status": "deleted"}
+
+
+@router.get("/llm/stats")
+async def get_llm_stats():
+    """Загрузка и адаптивные лимиты LLM-серверов (в процессе API, у воркеров - свои)"""
+    return container.llm_stats()
@@ -10,9 +10,124 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./avito_agent.db")
 LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://localhost:8080/v1")
 LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "not-needed")
 LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "Qwen3-Vl-4B-Instruct")
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "8192"))  # размер контекста модели (-c у llama.cpp)
+
+# Пул HTTP-соединений к LLM-серверу (один на процесс, keep-alive между запросами)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))  # секунд на ответ (генерация на локальной модели долгая)
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "8"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# Несколько OpenAI-совместимых серверов: "url|N,url|N", N - сколько запросов к серверу одновременно
+# (обычно число слотов -np у llama.cpp). По умолчанию - один LOCAL_LLM_URL
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", LOCAL_LLM_URL)
+LLM_ENDPOINT_CONCURRENCY = int(os.getenv("LLM_ENDPOINT_CONCURRENCY", "1"))  # N для адресов без "|N"
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "10"))  # секунд между проверками серверов
+LLM_EJECT_AFTER_FAILURES = int(os.getenv("LLM_EJECT_AFTER_FAILURES", "3"))  # ошибок подряд до исключения сервера
+LLM_EJECT_SECONDS = float(os.getenv("LLM_EJECT_SECONDS", "15"))  # минимум вне ротации, удваивается при повторах
+# Адаптивный лимит: N сервера - начальное значение, дальше лимит растет, пока не растет задержка
+# (в пересчете на токен), и уменьшается при росте задержки, таймаутах и 5xx.
+# Выключен по умолчанию: однопоточный llama.cpp сервер (--parallel 1) от лишних запросов только копит очередь
+LLM_ADAPTIVE_CONCURRENCY = os.getenv("LLM_ADAPTIVE_CONCURRENCY", "false").lower() == "true"
+LLM_ADAPTIVE_MAX_CONCURRENCY = int(os.getenv("LLM_ADAPTIVE_MAX_CONCURRENCY", "4"))  # потолок лимита на сервер
+# Одинаковые запросы (модель, сообщения, параметры), выполняющиеся одновременно, ждут один ответ
+LLM_SINGLE_FLIGHT_ENABLED = os.getenv("LLM_SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# Модель по этапам: мелкая быстрая модель для массовых этапов, сильная - где важно качество.
+# Для этапа можно задать LLM_<ЭТАП>_MODEL, LLM_<ЭТАП>_ENDPOINTS (формат как у LLM_ENDPOINTS),
+# LLM_<ЭТАП>_TIMEOUT и LLM_<ЭТАП>_CONCURRENCY (запросов этапа одновременно, 0 - сколько позволяют серверы).
+# Не задано - общие LOCAL_LLM_MODEL, LLM_ENDPOINTS, LLM_TIMEOUT. Этапы с одинаковой строкой серверов делят их лимиты
+LLM_STAGES = ["chat", "quick_report", "extraction", "caption", "rank_group", "summary"]
+LLM_STAGE_SETTINGS = {
+    stage: {
+        "model": os.getenv(f"LLM_{stage.upper()}_MODEL", LOCAL_LLM_MODEL),
+        "endpoints": os.getenv(f"LLM_{stage.upper()}_ENDPOINTS", LLM_ENDPOINTS),
+        "timeout": float(os.getenv(f"LLM_{stage.upper()}_TIMEOUT", str(LLM_TIMEOUT))),
+        "concurrency": int(os.getenv(f"LLM_{stage.upper()}_CONCURRENCY", "0")),
+    }
+    for stage in LLM_STAGES
+}
 
 # Image storage configuration
 IMAGE_STORAGE_PATH = os.getenv("IMAGE_STORAGE_PATH", "./data/images")
 
 # Token limits
-MAX_CHAT_HISTORY_TOKENS = int(os.getenv("MAX_CHAT_HISTORY_TOKENS", "4000"))
\ No newline at end of file
+MAX_CHAT_HISTORY_TOKENS = int(os.getenv("MAX_CHAT_HISTORY_TOKENS", "4000"))
+# Доля бюджета истории, которая остается свежим сообщениям после сворачивания старых
+CHAT_RECENT_RATIO = float(os.getenv("CHAT_RECENT_RATIO", "0.5"))
+# Минимальная доля бюджета под историю, даже если системный промпт и результаты поиска заняли весь бюджет
+CHAT_MIN_HISTORY_RATIO = float(os.getenv("CHAT_MIN_HISTORY_RATIO", "0.25"))
+
+# Дедупликация лотов по перцептивному хешу фото
+IMAGE_DEDUP_ENABLED = os.getenv("IMAGE_DEDUP_ENABLED", "true").lower() == "true"
+IMAGE_DEDUP_MAX_DISTANCE = int(os.getenv("IMAGE_DEDUP_MAX_DISTANCE", "4"))  # расстояние Хэмминга (из 64 бит)
+
+# Дедупликация лотов по тексту (MinHash/LSH по заголовку и описанию)
+# "off" - выключено, "skip_tournament" - анализируем все, но в турнире только представитель,
+# "skip_extraction" - анализируем только представителя и копируем результат на дубликаты
+TEXT_DEDUP_POLICY = os.getenv("TEXT_DEDUP_POLICY", "skip_tournament")
+TEXT_DEDUP_THRESHOLD = float(os.getenv("TEXT_DEDUP_THRESHOLD", "0.85"))
+TEXT_DEDUP_NUM_PERM = int(os.getenv("TEXT_DEDUP_NUM_PERM", "64"))
+TEXT_DEDUP_BANDS = int(os.getenv("TEXT_DEDUP_BANDS", "16"))
+
+# Турнирный реранкинг
+# "classic" - одинаковое число сравнений для всех лотов, "swiss" - швейцарка с отсевом слабых лотов
+TOURNAMENT_MODE = os.getenv("TOURNAMENT_MODE", "classic")
+TOURNAMENT_TOP_K = int(os.getenv("TOURNAMENT_TOP_K", "10"))  # сколько лидеров нужно точно (резюме берет топ-10)
+TOURNAMENT_KEEP_RATIO = float(os.getenv("TOURNAMENT_KEEP_RATIO", "0.5"))  # доля лотов, проходящих в следующий раунд
+TOURNAMENT_MAX_ROUNDS = int(os.getenv("TOURNAMENT_MAX_ROUNDS", "4"))
+# Агрегация результатов групп: "borda" - средние очки за место, "bradley_terry" - вероятностная модель с неопределенностью
+TOURNAMENT_AGGREGATION = os.getenv("TOURNAMENT_AGGREGATION", "borda")
+# Ранняя остановка (только для bradley_terry): уверенность в составе и порядке топ-K (0..1, см. top_k_stability). Пусто - выключено
+TOURNAMENT_CONFIDENCE = float(os.getenv("TOURNAMENT_CONFIDENCE")) if os.getenv("TOURNAMENT_CONFIDENCE") else None
+TOURNAMENT_MIN_ROUNDS = int(os.getenv("TOURNAMENT_MIN_ROUNDS", "2"))
+# Составление групп в классическом турнире: "balanced" - минимум повторных встреч, "random" - перемешивание
+TOURNAMENT_SCHEDULING = os.getenv("TOURNAMENT_SCHEDULING", "balanced")
+# Максимальный размер группы. Фактический размер подбирается под LLM_CONTEXT_TOKENS (0 - всегда TOURNAMENT_GROUP_SIZE)
+TOURNAMENT_GROUP_SIZE = int(os.getenv("TOURNAMENT_GROUP_SIZE", "8"))
+TOURNAMENT_RESPONSE_TOKENS = int(os.getenv("TOURNAMENT_RESPONSE_TOKENS", "1500"))  # резерв под рассуждение и RANKING
+# Новые лоты в уже отранжированной задаче играют только установочные группы против якорей из рейтинга
+TOURNAMENT_INCREMENTAL = os.getenv("TOURNAMENT_INCREMENTAL", "true").lower() == "true"
+TOURNAMENT_PLACEMENT_ROUNDS = int(os.getenv("TOURNAMENT_PLACEMENT_ROUNDS", "2"))
+
+# Лексический префильтр (BM25) лотов глубокого поиска перед анализом LLM
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_CUTOFF = float(os.getenv("PREFILTER_CUTOFF", "0.15"))  # доля от оценки лучшего лота
+PREFILTER_TOP_N = int(os.getenv("PREFILTER_TOP_N", "0"))  # оставить не больше N лучших (0 - без ограничения)
+
+# Извлечение типовых характеристик (память, год, диагональ, новый/б/у) правилами до вызова LLM
+RULE_EXTRACTION_ENABLED = os.getenv("RULE_EXTRACTION_ENABLED", "true").lower() == "true"
+
+# Ограничение ответа извлечения JSON-схемой задачи (грамматика llama.cpp)
+EXTRACTION_GRAMMAR_ENABLED = os.getenv("EXTRACTION_GRAMMAR_ENABLED", "true").lower() == "true"
+EXTRACTION_REASK_ENABLED = os.getenv("EXTRACTION_REASK_ENABLED", "true").lower() == "true"  # переспросить пропущенные поля
+
+# Описание фото отдельным этапом (кэш по хешу изображения), извлечение получает текст вместо картинки
+IMAGE_CAPTIONING_ENABLED = os.getenv("IMAGE_CAPTIONING_ENABLED", "true").lower() == "true"
+
+# Двухпроходное извлечение: сначала только текст, фото - лишь при needs_visual для незаполненных визуальных полей
+VISUAL_GATING_ENABLED = os.getenv("VISUAL_GATING_ENABLED", "true").lower() == "true"
+
+# При правке схемы в том же исследовании заново извлекаются только добавленные и измененные поля
+SCHEMA_INCREMENTAL_ENABLED = os.getenv("SCHEMA_INCREMENTAL_ENABLED", "true").lower() == "true"
+
+# Очередь заданий (обработка глубокого поиска в отдельных процессах run_worker.py)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY = int(os.getenv("JOB_RETRY_BASE_DELAY", "30"))  # секунд, удваивается с каждой попыткой
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "600"))  # секунд без продления - задание брошено
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "1"))  # заданий параллельно в одном процессе воркера
+
+# Конвейер глубокого поиска: подготовка фото и ранний раунд турнира идут параллельно с извлечением
+PIPELINE_ENABLED = os.getenv("PIPELINE_ENABLED", "true").lower() == "true"
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))  # на сколько лотов стадия может опережать следующую
+
+# Планировщик глубокого поиска с бюджетом времени/токенов (time_budget_min, token_budget задачи).
+# Начальные оценки - до первых замеров в задании; задержка групп турнира берется из истории tournament_matches
+PLANNER_EXTRACT_SECONDS = float(os.getenv("PLANNER_EXTRACT_SECONDS", "20"))  # извлечение одного лота
+PLANNER_EXTRACT_TOKENS = int(os.getenv("PLANNER_EXTRACT_TOKENS", "2500"))
+PLANNER_ECONOMY_RATIO = float(os.getenv("PLANNER_ECONOMY_RATIO", "0.6"))  # доля стоимости лота в экономном режиме
+PLANNER_RANK_SECONDS = float(os.getenv("PLANNER_RANK_SECONDS", "60"))  # группа турнира, пока нет истории
+PLANNER_MAX_GROUP_SIZE = int(os.getenv("PLANNER_MAX_GROUP_SIZE", "12"))  # до скольких лотов можно укрупнить группы
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Float
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -9,7 +9,8 @@ os.makedirs("./data", exist_ok=True)
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./data/avito_agent.db"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# timeout: воркеры в отдельных процессах ждут снятия блокировки SQLite, а не падают с "database is locked"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -77,5 +78,82 @@ class DBSearchTask(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class DBTaskBudget(Base):
+    __tablename__ = "task_budgets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    search_task_id = Column(Integer, ForeignKey("search_tasks.id"), unique=True, index=True)
+    time_budget_min = Column(Float, nullable=True)  # сколько минут пользователь готов ждать анализ
+    token_budget = Column(Integer, nullable=True)  # лимит токенов LLM на анализ
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DBImageHash(Base):
+    __tablename__ = "image_hashes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_path = Column(String, unique=True, index=True)
+    phash = Column(String, index=True)  # 64-битный dHash в hex
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DBTournamentMatch(Base):
+    __tablename__ = "tournament_matches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    search_task_id = Column(Integer, ForeignKey("search_tasks.id"), index=True)
+    round_num = Column(Integer)
+    group_idx = Column(Integer)
+    member_ids = Column(Text)  # JSON: id лотов в группе в порядке подачи в промпт
+    ranked_ids = Column(Text, nullable=True)  # JSON: порядок от лучшего к худшему, NULL - группа еще не сыграна
+    latency_ms = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DBImageCaption(Base):
+    __tablename__ = "image_captions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_hash = Column(String, unique=True, index=True)  # md5 содержимого файла
+    caption = Column(Text)  # описание фото, не зависящее от схемы задачи
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DBChatSummary(Base):
+    __tablename__ = "chat_summaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    market_research_id = Column(Integer, ForeignKey("market_research.id"), unique=True, index=True)
+    summary = Column(Text)  # краткое содержание старой части диалога
+    covered_messages = Column(Integer, default=0)  # сколько первых сообщений истории свернуто
+    covered_hash = Column(String, nullable=True)  # отпечаток свернутых сообщений: если история переписана, summary сбрасывается
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DBJob(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True)  # тип задания, например "deep_search"
+    payload = Column(Text, nullable=True)  # JSON с аргументами обработчика, очищается после завершения
+    dedupe_key = Column(String, nullable=True)  # не больше одного активного задания с этим ключом
+    status = Column(String, index=True, default="queued")  # "queued", "running", "done", "failed"
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    available_at = Column(DateTime, default=datetime.utcnow)  # не раньше этого времени (backoff после ошибки)
+    locked_by = Column(String, nullable=True)  # id воркера, взявшего задание
+    locked_until = Column(DateTime, nullable=True)  # после этого времени задание считается брошенным
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Частичный уникальный индекс: повторная постановка того же задания, пока оно
+    # в очереди или выполняется, отклоняется самой БД, без гонки между проверкой и вставкой
+    __table_args__ = (
+        Index("ix_jobs_active_dedupe_key", "dedupe_key", unique=True,
+              sqlite_where=status.in_(["queued", "running"])),
+    )
+
+
 # Создаем таблицы
 Base.metadata.create_all(bind=engine)
\ No newline at end of file
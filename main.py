@@ -5,8 +5,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager
 import os
 from api.router import router
+from services.container import container
 import uvicorn
 
 class NoCacheStaticFiles(StaticFiles):
@@ -20,7 +22,13 @@ class NoCacheStaticFiles(StaticFiles):
         response.headers["Expires"] = "0"
         return response
 
-app = FastAPI(title="Avito Agent")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Явно закрываем пулы соединений (LLM и БД) при остановке сервера
+    container.shutdown()
+
+app = FastAPI(title="Avito Agent", lifespan=lifespan)
 
 # Настройка CORS
 app.add_middleware(
@@ -49,6 +49,37 @@ class AnalyzedLot(BaseModel):
     tournament_score: float = 0.0
     created_at: datetime = datetime.now()
 
+class TournamentMatch(BaseModel):
+    id: Optional[int] = None
+    search_task_id: int
+    round_num: int
+    group_idx: int
+    member_ids: List[str]
+    ranked_ids: Optional[List[str]] = None  # None - группа запланирована, но еще не сыграна
+    latency_ms: Optional[float] = None
+    created_at: datetime = datetime.now()
+
+class ChatSummary(BaseModel):
+    id: Optional[int] = None
+    market_research_id: int
+    summary: str
+    covered_messages: int  # сколько первых сообщений истории свернуто в summary
+    covered_hash: Optional[str] = None  # отпечаток свернутых сообщений
+    updated_at: datetime = datetime.now()
+
+class Job(BaseModel):
+    id: Optional[int] = None
+    kind: str
+    payload: dict
+    status: str = "queued"  # "queued", "running", "done", "failed"
+    attempts: int = 0
+    max_attempts: int = 3
+    available_at: Optional[datetime] = None
+    locked_by: Optional[str] = None
+    locked_until: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime = datetime.now()
+
 class SearchTask(BaseModel):
     id: Optional[int] = None
     market_research_id: int
@@ -58,6 +89,8 @@ class SearchTask(BaseModel):
     schema_id: Optional[int] = None  # For deep research
     needs_visual: bool = False
     limit: int = 10  # Количество товаров для поиска
+    time_budget_min: Optional[float] = None  # Сколько минут готовы ждать анализ (deep)
+    token_budget: Optional[int] = None  # Лимит токенов LLM на анализ (deep)
     status: str = "pending"  # "pending", "in_progress", "completed", "failed"
     results: Optional[List[dict]] = []
     created_at: datetime = datetime.now()
@@ -4,7 +4,13 @@ from database import (
     DBSchema, 
     DBRawLot, 
     DBAnalyzedLot, 
-    DBSearchTask
+    DBSearchTask,
+    DBImageHash,
+    DBTournamentMatch,
+    DBImageCaption,
+    DBChatSummary,
+    DBJob,
+    DBTaskBudget
 )
 from models.research_models import (
     MarketResearch,
@@ -13,11 +19,16 @@ from models.research_models import (
     AnalyzedLot,
     SearchTask,
     State,
-    ChatMessage
+    ChatMessage,
+    TournamentMatch,
+    ChatSummary,
+    Job
 )
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
 from utils.logger import logger
 
 
@@ -175,11 +186,14 @@ class MarketResearchRepository:
         tasks = self.db.query(DBSearchTask).filter(DBSearchTask.market_research_id == mr_id).all()
         task_ids = [t.id for t in tasks]
 
-        # 2. Удаляем результаты анализа, связанные с этими задачами
+        # 2. Удаляем результаты анализа и турнира, связанные с этими задачами
         if task_ids:
             self.db.query(DBAnalyzedLot).filter(DBAnalyzedLot.search_task_id.in_(task_ids)).delete(synchronize_session=False)
+            self.db.query(DBTournamentMatch).filter(DBTournamentMatch.search_task_id.in_(task_ids)).delete(synchronize_session=False)
+            self.db.query(DBTaskBudget).filter(DBTaskBudget.search_task_id.in_(task_ids)).delete(synchronize_session=False)
 
-        # 3. Удаляем задачи
+        # 3. Удаляем задачи и свернутую историю чата
+        self.db.query(DBChatSummary).filter(DBChatSummary.market_research_id == mr_id).delete(synchronize_session=False)
         self.db.query(DBSearchTask).filter(DBSearchTask.market_research_id == mr_id).delete(synchronize_session=False)
 
         # 4. Удаляем само исследование
@@ -270,6 +284,50 @@ class RawLotRepository:
         )
 
 
+class ImageHashRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_by_path(self, image_path: str) -> Optional[str]:
+        db_hash = self.db.query(DBImageHash).filter(DBImageHash.image_path == image_path).first()
+        if not db_hash:
+            return None
+        return db_hash.phash
+
+    def create(self, image_path: str, phash: str) -> str:
+        db_hash = DBImageHash(image_path=image_path, phash=phash)
+        self.db.add(db_hash)
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # Тот же файл одновременно захешировал другой воркер или поток - берем его запись
+            self.db.rollback()
+            return self.get_by_path(image_path) or phash
+        return phash
+
+
+class ImageCaptionRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_by_hash(self, image_hash: str) -> Optional[str]:
+        db_caption = self.db.query(DBImageCaption).filter(DBImageCaption.image_hash == image_hash).first()
+        if not db_caption:
+            return None
+        return db_caption.caption
+
+    def create(self, image_hash: str, caption: str) -> str:
+        db_caption = DBImageCaption(image_hash=image_hash, caption=caption)
+        self.db.add(db_caption)
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # Описание того же фото одновременно сохранил другой воркер или поток - берем его
+            self.db.rollback()
+            return self.get_by_hash(image_hash) or caption
+        return caption
+
+
 class AnalyzedLotRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -326,6 +384,31 @@ class AnalyzedLotRepository:
                 created_at=db_lot.created_at
             ))
         return results
+
+    def get_by_research_id(self, mr_id: int, exclude_task_id: int = None) -> List[AnalyzedLot]:
+        """Анализы лотов из всех задач исследования (от старых к новым)"""
+        query = (
+            self.db.query(DBAnalyzedLot)
+            .join(DBSearchTask, DBAnalyzedLot.search_task_id == DBSearchTask.id)
+            .filter(DBSearchTask.market_research_id == mr_id)
+        )
+        if exclude_task_id is not None:
+            query = query.filter(DBAnalyzedLot.search_task_id != exclude_task_id)
+
+        results = []
+        for db_lot in query.order_by(DBAnalyzedLot.id).all():
+            results.append(AnalyzedLot(
+                id=db_lot.id,
+                raw_lot_id=db_lot.raw_lot_id,
+                search_task_id=db_lot.search_task_id,
+                schema_id=db_lot.schema_id,
+                structured_data=json.loads(db_lot.structured_data),
+                relevance_note=db_lot.relevance_note,
+                image_description_and_notes=db_lot.image_description_and_notes,
+                tournament_score=db_lot.tournament_score or 0.0,
+                created_at=db_lot.created_at
+            ))
+        return results
     
 
     def update_score(self, lot_id: int, score: float):
@@ -360,6 +443,14 @@ class SearchTaskRepository:
         self.db.commit()
         self.db.refresh(db_task)
 
+        if search_task.time_budget_min or search_task.token_budget:
+            self.db.add(DBTaskBudget(
+                search_task_id=db_task.id,
+                time_budget_min=search_task.time_budget_min,
+                token_budget=search_task.token_budget
+            ))
+            self.db.commit()
+
         search_task.id = db_task.id
         return search_task
 
@@ -368,6 +459,8 @@ class SearchTaskRepository:
         if not db_task:
             return None
 
+        budget = self.db.query(DBTaskBudget).filter(DBTaskBudget.search_task_id == task_id).first()
+
         return SearchTask(
             id=db_task.id,
             market_research_id=db_task.market_research_id,
@@ -377,6 +470,8 @@ class SearchTaskRepository:
             schema_id=db_task.schema_id,
             needs_visual=db_task.needs_visual,
             limit=db_task.limit,
+            time_budget_min=budget.time_budget_min if budget else None,
+            token_budget=budget.token_budget if budget else None,
             status=db_task.status,
             results=json.loads(db_task.results) if db_task.results else [],
             created_at=db_task.created_at
@@ -402,4 +497,243 @@ class SearchTaskRepository:
         self.db.commit()
         self.db.refresh(db_task)
         
-        return self.get_by_id(task_id)
\ No newline at end of file
+        return self.get_by_id(task_id)
+
+
+class TournamentMatchRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _to_model(self, db_match: DBTournamentMatch) -> TournamentMatch:
+        return TournamentMatch(
+            id=db_match.id,
+            search_task_id=db_match.search_task_id,
+            round_num=db_match.round_num,
+            group_idx=db_match.group_idx,
+            member_ids=json.loads(db_match.member_ids),
+            ranked_ids=json.loads(db_match.ranked_ids) if db_match.ranked_ids else None,
+            latency_ms=db_match.latency_ms,
+            created_at=db_match.created_at
+        )
+
+    def create_round(self, task_id: int, round_num: int, groups: List[List[str]], first_group_idx: int = 0) -> List[TournamentMatch]:
+        """Сохраняет запланированные группы раунда (еще не сыгранные)"""
+        db_matches = []
+        for group_idx, member_ids in enumerate(groups, start=first_group_idx):
+            db_match = DBTournamentMatch(
+                search_task_id=task_id,
+                round_num=round_num,
+                group_idx=group_idx,
+                member_ids=json.dumps(member_ids)
+            )
+            self.db.add(db_match)
+            db_matches.append(db_match)
+        self.db.commit()
+        return [self._to_model(db_match) for db_match in db_matches]
+
+    def complete(self, match_id: int, ranked_ids: List[str], latency_ms: float):
+        db_match = self.db.query(DBTournamentMatch).filter(DBTournamentMatch.id == match_id).first()
+        db_match.ranked_ids = json.dumps(ranked_ids)
+        db_match.latency_ms = latency_ms
+        self.db.commit()
+
+    def get_by_task_id(self, task_id: int) -> List[TournamentMatch]:
+        db_matches = self.db.query(DBTournamentMatch).filter(
+            DBTournamentMatch.search_task_id == task_id
+        ).order_by(DBTournamentMatch.round_num, DBTournamentMatch.group_idx).all()
+        return [self._to_model(db_match) for db_match in db_matches]
+
+    def latency_samples(self, limit: int = 200) -> List[Tuple[int, float]]:
+        """Последние сыгранные группы всех задач: (размер группы, задержка в мс)"""
+        db_matches = self.db.query(DBTournamentMatch).filter(
+            DBTournamentMatch.latency_ms.isnot(None)
+        ).order_by(DBTournamentMatch.id.desc()).limit(limit).all()
+        return [(len(json.loads(db_match.member_ids)), db_match.latency_ms) for db_match in db_matches]
+
+
+class ChatSummaryRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_by_research_id(self, mr_id: int) -> Optional[ChatSummary]:
+        db_summary = self.db.query(DBChatSummary).filter(DBChatSummary.market_research_id == mr_id).first()
+        if not db_summary:
+            return None
+        return ChatSummary(
+            id=db_summary.id,
+            market_research_id=db_summary.market_research_id,
+            summary=db_summary.summary,
+            covered_messages=db_summary.covered_messages,
+            covered_hash=db_summary.covered_hash,
+            updated_at=db_summary.updated_at
+        )
+
+    def save(self, mr_id: int, summary: str, covered_messages: int, covered_hash: Optional[str] = None) -> ChatSummary:
+        db_summary = self.db.query(DBChatSummary).filter(DBChatSummary.market_research_id == mr_id).first()
+        if not db_summary:
+            db_summary = DBChatSummary(market_research_id=mr_id)
+            self.db.add(db_summary)
+        db_summary.summary = summary
+        db_summary.covered_messages = covered_messages
+        db_summary.covered_hash = covered_hash
+        self.db.commit()
+        return self.get_by_research_id(mr_id)
+
+
+class JobRepository:
+    """
+    Очередь заданий в SQLite. Задание забирается атомарным UPDATE с проверкой
+    прежнего состояния, поэтому несколько процессов-воркеров не возьмут одно
+    задание дважды. Взятое задание "невидимо" до locked_until: если воркер
+    умер, задание снова становится доступным после таймаута.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _to_model(self, db_job: DBJob) -> Job:
+        return Job(
+            id=db_job.id,
+            kind=db_job.kind,
+            payload=json.loads(db_job.payload) if db_job.payload else {},
+            status=db_job.status,
+            attempts=db_job.attempts,
+            max_attempts=db_job.max_attempts,
+            available_at=db_job.available_at,
+            locked_by=db_job.locked_by,
+            locked_until=db_job.locked_until,
+            last_error=db_job.last_error,
+            created_at=db_job.created_at
+        )
+
+    def enqueue(self, kind: str, payload: dict, max_attempts: int, dedupe_key: Optional[str] = None) -> Job:
+        """
+        Ставит задание в очередь. Если активное задание с тем же dedupe_key уже
+        есть (в очереди или выполняется), новое не создается - возвращается существующее
+        """
+        db_job = DBJob(
+            kind=kind,
+            payload=json.dumps(payload),
+            dedupe_key=dedupe_key,
+            status="queued",
+            max_attempts=max_attempts,
+            available_at=datetime.utcnow()
+        )
+        self.db.add(db_job)
+        try:
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            if dedupe_key is None:
+                raise
+            active = self.get_active(dedupe_key)
+            if active:
+                logger.warning(f"Задание {dedupe_key} уже в работе ({active.id}, {active.status}), повтор отклонен")
+                return active
+            # Активное задание успело завершиться между вставкой и проверкой - ставим заново
+            return self.enqueue(kind, payload, max_attempts, dedupe_key)
+        self.db.refresh(db_job)
+        logger.info(f"Задание {db_job.id} ({kind}) поставлено в очередь")
+        return self._to_model(db_job)
+
+    def get_active(self, dedupe_key: str) -> Optional[Job]:
+        """Задание с этим ключом, которое в очереди или выполняется"""
+        db_job = (
+            self.db.query(DBJob)
+            .filter(DBJob.dedupe_key == dedupe_key, DBJob.status.in_(["queued", "running"]))
+            .first()
+        )
+        return self._to_model(db_job) if db_job else None
+
+    def claim(self, worker_id: str, visibility_timeout: int) -> Optional[Job]:
+        """Забирает первое доступное задание: из очереди или брошенное другим воркером"""
+        while True:
+            now = datetime.utcnow()
+            ready = or_(
+                and_(DBJob.status == "queued", DBJob.available_at <= now),
+                and_(DBJob.status == "running", DBJob.locked_until < now)
+            )
+            candidate = (
+                self.db.query(DBJob.id, DBJob.status, DBJob.attempts)
+                .filter(ready, DBJob.attempts < DBJob.max_attempts)
+                .order_by(DBJob.id)
+                .first()
+            )
+            if not candidate:
+                return None
+
+            # Условный UPDATE (attempts растет при каждом захвате и служит версией):
+            # если другой воркер успел первым, rowcount будет 0
+            claimed = (
+                self.db.query(DBJob)
+                .filter(DBJob.id == candidate.id, DBJob.status == candidate.status, DBJob.attempts == candidate.attempts)
+                .update({
+                    DBJob.status: "running",
+                    DBJob.locked_by: worker_id,
+                    DBJob.locked_until: now + timedelta(seconds=visibility_timeout),
+                    DBJob.attempts: DBJob.attempts + 1
+                }, synchronize_session=False)
+            )
+            self.db.commit()
+            if claimed:
+                db_job = self.db.query(DBJob).filter(DBJob.id == candidate.id).populate_existing().first()
+                return self._to_model(db_job)
+
+    def extend_lock(self, job_id: int, worker_id: str, visibility_timeout: int) -> bool:
+        """Продлевает невидимость задания, пока воркер над ним работает"""
+        updated = (
+            self.db.query(DBJob)
+            .filter(DBJob.id == job_id, DBJob.locked_by == worker_id, DBJob.status == "running")
+            .update({DBJob.locked_until: datetime.utcnow() + timedelta(seconds=visibility_timeout)}, synchronize_session=False)
+        )
+        self.db.commit()
+        return bool(updated)
+
+    def complete(self, job_id: int):
+        self.db.query(DBJob).filter(DBJob.id == job_id).update({
+            DBJob.status: "done",
+            DBJob.payload: None,  # лоты с фото в base64 больше не нужны
+            DBJob.locked_by: None,
+            DBJob.locked_until: None
+        }, synchronize_session=False)
+        self.db.commit()
+
+    def fail(self, job_id: int, error: str, retry_base_delay: int) -> Job:
+        """
+        Ошибка обработки: задание возвращается в очередь с экспоненциальной задержкой
+        или помечается failed, если попытки исчерпаны
+        """
+        db_job = self.db.query(DBJob).filter(DBJob.id == job_id).first()
+        db_job.last_error = error
+        db_job.locked_by = None
+        db_job.locked_until = None
+        if db_job.attempts >= db_job.max_attempts:
+            db_job.status = "failed"
+        else:
+            db_job.status = "queued"
+            db_job.available_at = datetime.utcnow() + timedelta(seconds=retry_base_delay * 2 ** (db_job.attempts - 1))
+        # Модель берем до очистки: обработчику on_failure нужен payload
+        job = self._to_model(db_job)
+        if db_job.status == "failed":
+            db_job.payload = None
+        self.db.commit()
+        return job
+
+    def expire_abandoned(self) -> List[Job]:
+        """Брошенные задания, у которых не осталось попыток, помечаются failed"""
+        now = datetime.utcnow()
+        db_jobs = (
+            self.db.query(DBJob)
+            .filter(DBJob.status == "running", DBJob.locked_until < now, DBJob.attempts >= DBJob.max_attempts)
+            .all()
+        )
+        for db_job in db_jobs:
+            db_job.status = "failed"
+            db_job.last_error = "Превышено время обработки (воркер не отвечает)"
+            db_job.locked_by = None
+            db_job.locked_until = None
+        jobs = [self._to_model(db_job) for db_job in db_jobs]
+        for db_job in db_jobs:
+            db_job.payload = None
+        self.db.commit()
+        return jobs
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""
+Скрипт для запуска воркера очереди заданий Avito Agent.
+Воркеров можно запустить несколько (в отдельных процессах) независимо от веб-сервера.
+"""
+import signal
+from pathlib import Path
+
+
+def main():
+    # Создаем директории, если они не существуют
+    Path("./data").mkdir(exist_ok=True)
+    Path("./logs").mkdir(exist_ok=True)
+    Path("./data/images").mkdir(exist_ok=True)
+
+    from services.job_worker import JobWorker
+    from services.container import container
+
+    worker = JobWorker()
+
+    # Текущее задание дорабатывается, новые не берутся
+    signal.signal(signal.SIGINT, lambda sig, frame: worker.stop())
+    signal.signal(signal.SIGTERM, lambda sig, frame: worker.stop())
+
+    print(f"Запуск воркера {worker.worker_id}...")
+    print("Убедитесь, что локальная LLM модель запущена на http://localhost:8080/v1")
+
+    try:
+        worker.run_forever()
+    finally:
+        container.shutdown()
+
+
+if __name__ == "__main__":
+    main()
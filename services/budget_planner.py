@@ -0,0 +1,212 @@
+import math
+import time
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from utils.metrics import JobMetrics
+from utils.group_scheduler import pack_sequential
+from utils.logger import logger
+from config import (
+    PLANNER_EXTRACT_SECONDS,
+    PLANNER_EXTRACT_TOKENS,
+    PLANNER_ECONOMY_RATIO,
+    PLANNER_RANK_SECONDS,
+    PLANNER_MAX_GROUP_SIZE,
+    TOURNAMENT_GROUP_SIZE,
+    TOURNAMENT_MAX_ROUNDS,
+    TOURNAMENT_RESPONSE_TOKENS
+)
+
+
+# Примерный размер описания лота в промпте турнира (токены)
+RANK_LOT_TOKENS = 250
+# Вес нового замера в скользящей оценке стоимости
+EWMA_ALPHA = 0.3
+
+
+def fit_rank_latency(samples: List[Tuple[int, float]]) -> Tuple[float, float]:
+    """
+    Модель задержки группы турнира: a + b * размер группы (секунды)
+    :param samples: (размер группы, задержка в мс) сыгранных групп
+    """
+    if not samples:
+        return PLANNER_RANK_SECONDS, 0.0
+    sizes = np.array([size for size, _ in samples], dtype=float)
+    seconds = np.array([latency_ms / 1000 for _, latency_ms in samples])
+    if len(set(sizes)) < 2:
+        return float(seconds.mean()), 0.0
+    b, a = np.polyfit(sizes, seconds, 1)
+    b = max(0.0, float(b))
+    a = max(0.0, float(seconds.mean() - b * sizes.mean()))
+    return a, b
+
+
+class BudgetPlanner:
+    """
+    Подгонка глубокого поиска под бюджет времени и/или токенов.
+
+    Стоимость извлечения лота измеряется по ходу задания, задержка группы
+    турнира - по истории сыгранных групп. По ним выбирается:
+    - режим извлечения: полный (фото, переспрос полей) или экономный (только текст);
+    - число раундов турнира и размер групп (крупнее группы - меньше вызовов на раунд).
+    Если задание отстает, оставшиеся раунды турнира отбрасываются.
+    Время отсчитывается от начала обработки результатов.
+    """
+
+    def __init__(
+        self,
+        metrics: JobMetrics,
+        time_budget_s: Optional[float] = None,
+        token_budget: Optional[int] = None,
+        rank_latency: Tuple[float, float] = (PLANNER_RANK_SECONDS, 0.0),
+        group_size: int = TOURNAMENT_GROUP_SIZE,
+        max_group_size: int = PLANNER_MAX_GROUP_SIZE,
+        max_rounds: int = TOURNAMENT_MAX_ROUNDS
+    ):
+        self.metrics = metrics
+        self.time_budget_s = time_budget_s
+        self.token_budget = token_budget
+        self.rank_latency = rank_latency
+        self.group_size = group_size
+        self.max_group_size = max(group_size, max_group_size)
+        self.max_rounds = max_rounds
+        self.started = time.monotonic()
+        self.tokens_at_start = self.tokens_spent()
+        # Режим -> (секунды, токены) на один лот
+        self.extract_cost = {
+            "full": (PLANNER_EXTRACT_SECONDS, PLANNER_EXTRACT_TOKENS),
+            "economy": (PLANNER_EXTRACT_SECONDS * PLANNER_ECONOMY_RATIO, PLANNER_EXTRACT_TOKENS * PLANNER_ECONOMY_RATIO),
+        }
+        self.mode = "full"
+        self._round_mark: Optional[Tuple[float, int]] = None
+        # Стоимость извлечения обновляют параллельные потоки конвейера
+        self._lock = threading.Lock()
+        logger.info(f"Бюджет задания: {time_budget_s or '-'} с, {token_budget or '-'} токенов. "
+                    f"Модель задержки группы: {rank_latency[0]:.1f} + {rank_latency[1]:.2f} * размер с")
+
+    def tokens_spent(self) -> int:
+        summary = self.metrics.summary()
+        return summary["prompt_tokens"] + summary["completion_tokens"]
+
+    def remaining(self) -> Tuple[float, float]:
+        """Остаток бюджета (секунды, токены); без ограничения - бесконечность"""
+        seconds = self.time_budget_s - (time.monotonic() - self.started) if self.time_budget_s else math.inf
+        tokens = self.token_budget - (self.tokens_spent() - self.tokens_at_start) if self.token_budget else math.inf
+        return seconds, tokens
+
+    def _fits(self, seconds: float, tokens: float) -> bool:
+        left_seconds, left_tokens = self.remaining()
+        return seconds <= left_seconds and tokens <= left_tokens
+
+    def _group_cost(self, size: int, lot_tokens: Optional[int] = None) -> Tuple[float, float]:
+        a, b = self.rank_latency
+        return a + b * size, TOURNAMENT_RESPONSE_TOKENS + (lot_tokens if lot_tokens is not None else RANK_LOT_TOKENS * size)
+
+    def _round_cost(self, n_lots: int, size: int, item_tokens: Optional[List[int]] = None, token_budget: Optional[int] = None) -> Tuple[float, float]:
+        """
+        Стоимость раунда по группам, которые составит турнир: сбалансированные
+        размеры, а с бюджетом токенов на группу - упаковка по токенам лотов
+        """
+        seconds, tokens = 0.0, 0.0
+        for group in pack_sequential(list(range(n_lots)), size, item_tokens, token_budget if item_tokens else None):
+            group_seconds, group_tokens = self._group_cost(len(group), sum(item_tokens[i] for i in group) if item_tokens else None)
+            seconds += group_seconds
+            tokens += group_tokens
+        return seconds, tokens
+
+    def _times(self, left: float, cost: float) -> int:
+        """Сколько раз cost помещается в остаток (не больше max_rounds)"""
+        if math.isinf(left) or cost <= 0:
+            return self.max_rounds
+        return max(0, math.floor(left / cost))
+
+    def _summary_cost(self) -> Tuple[float, float]:
+        # Резюме - один вызов, по стоимости как группа турнира
+        return self._group_cost(5)
+
+    def record_extraction(self, mode: str, seconds: float, tokens: float):
+        with self._lock:
+            old_seconds, old_tokens = self.extract_cost[mode]
+            self.extract_cost[mode] = (
+                (1 - EWMA_ALPHA) * old_seconds + EWMA_ALPHA * seconds,
+                (1 - EWMA_ALPHA) * old_tokens + EWMA_ALPHA * tokens
+            )
+
+    def extraction_mode(self, lots_left: int, n_contenders: int) -> str:
+        """
+        Полный режим, пока после извлечения остается время хотя бы на один раунд
+        турнира и резюме. Переход в экономный режим необратим.
+        """
+        if self.mode == "full":
+            seconds, tokens = self.extract_cost["full"]
+            round_seconds, round_tokens = self._round_cost(n_contenders, self.max_group_size) if n_contenders > 5 else (0, 0)
+            summary_seconds, summary_tokens = self._summary_cost()
+            if not self._fits(lots_left * seconds + round_seconds + summary_seconds, lots_left * tokens + round_tokens + summary_tokens):
+                logger.warning(f"Бюджет: не успеваем извлечь {lots_left} лотов полностью, переходим в экономный режим (без фото и переспроса)")
+                self.mode = "economy"
+        return self.mode
+
+    def tournament_plan(self, n_lots: int, item_tokens: Optional[List[int]] = None, token_budget: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Число раундов и размер групп, помещающиеся в остаток бюджета.
+        Больше раундов важнее; при равном числе раундов берется меньший размер группы.
+        :param item_tokens: оценка токенов каждого лота в промпте турнира
+        :param token_budget: сколько токенов лотов помещается в одну группу (None - без ограничения)
+        """
+        summary_seconds, summary_tokens = self._summary_cost()
+        left_seconds, left_tokens = self.remaining()
+        left_seconds -= summary_seconds
+        left_tokens -= summary_tokens
+
+        best_rounds, best_size = self._best_plan(n_lots, left_seconds, left_tokens, item_tokens, token_budget)
+        logger.info(f"Бюджет: турнир {best_rounds} раундов, группы до {best_size} лотов (осталось {left_seconds:.0f} с, {left_tokens} токенов)")
+        self._round_mark = (time.monotonic(), self.tokens_spent())
+        return best_rounds, best_size
+
+    def early_group_size(self, n_lots: int, lots_left: int) -> int:
+        """
+        Размер групп раннего раунда (играется во время извлечения): тот, который
+        выберет tournament_plan, если извлечение оставшихся lots_left лотов
+        пройдет по текущей оценке стоимости
+        """
+        extract_seconds, extract_tokens = self.extract_cost[self.mode]
+        summary_seconds, summary_tokens = self._summary_cost()
+        left_seconds, left_tokens = self.remaining()
+        left_seconds -= summary_seconds + lots_left * extract_seconds
+        left_tokens -= summary_tokens + lots_left * extract_tokens
+        _, size = self._best_plan(n_lots, left_seconds, left_tokens)
+        logger.info(f"Бюджет: ранний раунд группами до {size} лотов")
+        return size
+
+    def _best_plan(
+        self,
+        n_lots: int,
+        left_seconds: float,
+        left_tokens: float,
+        item_tokens: Optional[List[int]] = None,
+        token_budget: Optional[int] = None
+    ) -> Tuple[int, int]:
+        best_rounds, best_size = 0, self.group_size
+        for size in range(self.group_size, self.max_group_size + 1):
+            round_seconds, round_tokens = self._round_cost(n_lots, size, item_tokens, token_budget)
+            rounds = min(self.max_rounds, self._times(left_seconds, round_seconds), self._times(left_tokens, round_tokens))
+            if rounds > best_rounds:
+                best_rounds, best_size = rounds, size
+            if best_rounds == self.max_rounds:
+                break
+        return best_rounds, best_size
+
+    def should_stop(self, round_num: int) -> bool:
+        """Перед очередным раундом: хватит ли бюджета еще на раунд такой же стоимости, как предыдущий"""
+        now, tokens = time.monotonic(), self.tokens_spent()
+        if self._round_mark is None:
+            self._round_mark = (now, tokens)
+            return False
+        last_seconds, last_tokens = now - self._round_mark[0], tokens - self._round_mark[1]
+        self._round_mark = (now, tokens)
+
+        summary_seconds, summary_tokens = self._summary_cost()
+        if self._fits(last_seconds + summary_seconds, last_tokens + summary_tokens):
+            return False
+        logger.warning(f"Бюджет: раунд {round_num + 1} не успевает (прошлый раунд {last_seconds:.0f} с, {last_tokens} токенов), отбрасываем оставшиеся раунды")
+        return True
@@ -0,0 +1,125 @@
+import hashlib
+from typing import Dict, List, Optional
+from models.research_models import MarketResearch, ChatMessage
+from repositories.research_repository import ChatSummaryRepository
+from utils.token_counter import estimate_tokens, estimate_messages_tokens
+from utils.logger import logger
+from utils.llm_client import get_completion
+from config import MAX_CHAT_HISTORY_TOKENS, CHAT_RECENT_RATIO, CHAT_MIN_HISTORY_RATIO
+
+
+SUMMARY_PROMPT = """Ты ведешь краткое содержание диалога пользователя с агентом поиска товаров на Avito.
+Обнови краткое содержание, добавив в него новые сообщения.
+
+Сохрани то, что понадобится для продолжения диалога:
+- что ищет пользователь, бюджет, обязательные и желательные характеристики;
+- какие поиски уже выполнялись (быстрые и глубокие) и их ключевые выводы: модели, цены, лучшие варианты;
+- решения и отказы пользователя, открытые вопросы.
+
+Пиши фактами, не более 15 предложений, без приветствий и пояснений."""
+
+
+class ChatContextManager:
+    """
+    Сборка истории чата для LLM в пределах бюджета токенов.
+
+    Системный промпт и последние сообщения идут как есть, старая часть диалога
+    заменяется кратким содержанием. Содержание хранится вместе с исследованием
+    и дополняется инкрементально: сворачиваются только новые вытесненные
+    сообщения. Чтобы не вызывать суммаризацию на каждом ходу, при переполнении
+    сворачивается больше, чем нужно, - свежей части оставляется CHAT_RECENT_RATIO бюджета.
+    Вместе с содержанием хранится отпечаток свернутых сообщений: если история
+    была переписана или укорочена, содержание строится заново.
+    """
+
+    def __init__(self, summary_repo: ChatSummaryRepository, max_tokens: int = MAX_CHAT_HISTORY_TOKENS):
+        self.summary_repo = summary_repo
+        self.max_tokens = max_tokens
+
+    def build_messages(self, market_research: MarketResearch, system_prompt: str, extra_messages: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        :param market_research: исследование с полной историей чата
+        :param system_prompt: системный промпт вызова
+        :param extra_messages: сообщения после истории, которые не сохраняются в ней (например, результаты поиска)
+        :return: сообщения для get_completion
+        """
+        extra_messages = extra_messages or []
+        history = market_research.chat_history
+        history_budget = self.max_tokens - estimate_tokens(system_prompt) - estimate_messages_tokens(extra_messages)
+        min_budget = int(self.max_tokens * CHAT_MIN_HISTORY_RATIO)
+        if history_budget < min_budget:
+            # Иначе бюджет уходит в минус и на каждом ходу сворачивается вся история, кроме последнего сообщения
+            logger.warning(f"Системный промпт и доп. сообщения занимают почти весь бюджет чата, "
+                           f"под историю оставляем {min_budget} токенов вместо {history_budget}")
+            history_budget = min_budget
+
+        cached = self.summary_repo.get_by_research_id(market_research.id)
+        summary, covered = "", 0
+        if cached and cached.covered_messages <= len(history) \
+                and cached.covered_hash == self._fingerprint(history[:cached.covered_messages]):
+            summary, covered = cached.summary, cached.covered_messages
+        elif cached and cached.covered_messages:
+            logger.info(f"История чата {market_research.id} изменилась, краткое содержание строится заново")
+
+        split = self._split_index(history, history_budget - estimate_tokens(summary))
+        if split > covered:
+            # Свежая часть перестала помещаться: сворачиваем с запасом
+            target = max(split, self._split_index(history, int(history_budget * CHAT_RECENT_RATIO)))
+            summary = self._extend_summary(summary, history[covered:target])
+            covered = target
+            self.summary_repo.save(market_research.id, summary, covered, self._fingerprint(history[:covered]))
+
+        if summary:
+            system_prompt += f"\n\n### КРАТКОЕ СОДЕРЖАНИЕ ПРЕДЫДУЩЕГО ДИАЛОГА\n{summary}"
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(self._to_llm(history[covered:]))
+        messages.extend(extra_messages)
+
+        logger.info(f"Контекст чата {market_research.id}: {len(history) - covered} сообщений как есть, "
+                    f"{covered} свернуто, ~{estimate_messages_tokens(messages)} токенов")
+        return messages
+
+    @staticmethod
+    def _to_llm(history: List[ChatMessage]) -> List[Dict]:
+        return [{"role": msg.role, "content": msg.content} for msg in history]
+
+    @staticmethod
+    def _fingerprint(history: List[ChatMessage]) -> str:
+        """Хэш ролей и текстов сообщений"""
+        digest = hashlib.sha256()
+        for msg in history:
+            digest.update(f"{msg.role}\0{msg.content}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _split_index(self, history: List[ChatMessage], budget: int) -> int:
+        """Индекс, начиная с которого хвост истории помещается в budget (последнее сообщение - всегда)"""
+        used = 0
+        for i in range(len(history) - 1, -1, -1):
+            used += estimate_messages_tokens(self._to_llm([history[i]]))
+            if used > budget:
+                return min(i + 1, len(history) - 1)
+        return 0
+
+    def _extend_summary(self, summary: str, new_messages: List[ChatMessage]) -> str:
+        """Дополняет краткое содержание порциями, каждая из которых помещается в бюджет"""
+        chunk, used = [], 0
+        for msg in new_messages:
+            msg_tokens = estimate_messages_tokens(self._to_llm([msg]))
+            if chunk and used + msg_tokens > self.max_tokens:
+                summary = self._summarize(summary, chunk)
+                chunk, used = [], 0
+            chunk.append(msg)
+            used += msg_tokens
+        if chunk:
+            summary = self._summarize(summary, chunk)
+        return summary
+
+    def _summarize(self, summary: str, messages: List[ChatMessage]) -> str:
+        logger.info(f"Сворачиваем {len(messages)} сообщений чата в краткое содержание")
+        dialog = "\n\n".join(f"{msg.role}: {msg.content}" for msg in messages)
+        llm_messages = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Текущее краткое содержание:\n{summary or '(пусто)'}\n\nНовые сообщения:\n{dialog}"}
+        ]
+        response = get_completion(llm_messages, stage="chat")
+        return (response.content or summary).strip()
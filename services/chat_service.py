@@ -3,15 +3,16 @@ import json
 import uuid
 from typing import List, Tuple
 from models.research_models import MarketResearch, ChatMessage, State
-from repositories.research_repository import MarketResearchRepository
+from repositories.research_repository import MarketResearchRepository, ChatSummaryRepository
+from services.chat_context_service import ChatContextManager
 from utils.llm_client import get_completion
 from utils.logger import logger
-from config import MAX_CHAT_HISTORY_TOKENS
 
 
 class ChatService:
-    def __init__(self, mr_repo: MarketResearchRepository):
+    def __init__(self, mr_repo: MarketResearchRepository, chat_summary_repo: ChatSummaryRepository):
         self.mr_repo = mr_repo
+        self.context_manager = ChatContextManager(chat_summary_repo)
 
     def process_user_message(self, mr_id: int, message: str, images: List[str] = []) -> Tuple[MarketResearch, bool]:
         """Обработка сообщения от пользователя с использованием единого вызова LLM с инструментами"""
@@ -30,11 +31,6 @@ class ChatService:
         logger.info(f"Добавлено сообщение пользователя к истории. ID: {user_msg.id}, Новая длина: {len(market_research.chat_history)}")
         logger.info(f"Содержимое истории после добавления сообщения пользователя: {[msg.content for msg in market_research.chat_history]}")
 
-        # Подготовим историю чата для LLM
-        llm_messages = []
-        for msg in market_research.chat_history:
-            llm_messages.append({"role": msg.role, "content": msg.content})
-
         # Добавим системный промпт с описанием инструментов
         system_prompt = """Ты — поисковый агент авито.
 Твоя цель — помочь пользователю найти лучший товар, ведя с ним естественный диалог.
@@ -84,7 +80,9 @@ class ChatService:
             "context_summary": "краткий пересказ чата (зачем ищем)", 
             "schema": "JSON-схема (какие поля извлекать из объявления, формат см. ниже в правилах)", 
             "limit": "сколько объявлений просмотреть (по умолчанию 50)", 
-            "needs_visual": bool (нужно ли изучать изображение или достаточно прочитать только текст объявления)
+            "needs_visual": bool (нужно ли изучать изображение или достаточно прочитать только текст объявления),
+            "time_budget_min": "необязательно: сколько минут пользователь готов ждать анализ (анализ упростится, чтобы уложиться)",
+            "token_budget": "необязательно: лимит токенов LLM на анализ"
         }
     }, 
     {
@@ -96,7 +94,9 @@ class ChatService:
         "context_summary": "...", 
         "schema": "JSON-схема", 
         "limit": "...", 
-        "needs_visual": bool 
+        "needs_visual": bool,
+        "time_budget_min": "...",
+        "token_budget": "..."
         }
     }
 ]
@@ -137,10 +137,11 @@ class ChatService:
 "Хорошо, я поищу варианты. <tool_call>{"name": "start_quick_search", "query": "название", "needs_visual": false}</tool_call>"
 """
 
-        llm_messages.insert(0, {"role": "system", "content": system_prompt})
+        # История чата для LLM: свежие сообщения как есть, старые - кратким содержанием в пределах бюджета
+        llm_messages = self.context_manager.build_messages(market_research, system_prompt)
 
         # Выполняем единый вызов LLM
-        response = get_completion(llm_messages)
+        response = get_completion(llm_messages, stage="chat")
         response_content = response.content
         logger.info(f"Ответ LLM: {response_content}")
 
@@ -0,0 +1,40 @@
+from typing import Iterator
+from sqlalchemy.orm import Session
+from database import SessionLocal, engine
+from services.research_service import MarketResearchService
+from utils import llm_client
+from utils.logger import logger
+
+
+class ServiceContainer:
+    """
+    Управление временем жизни зависимостей.
+
+    Сессия БД и сервисы создаются на один запрос (get_db закрывает сессию после ответа),
+    LLM-клиенты с пулами HTTP-соединений и пул соединений БД живут все время работы
+    приложения и освобождаются в shutdown().
+    """
+
+    def get_db(self) -> Iterator[Session]:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def market_research_service(self, db: Session) -> MarketResearchService:
+        return MarketResearchService(db)
+
+    def llm_stats(self):
+        """Состояние LLM-серверов этого процесса: загрузка, текущие лимиты, задержки, ошибки"""
+        return {spec: llm_router.stats() for spec, llm_router in llm_client.routers.items()}
+
+    def shutdown(self):
+        for llm_router in llm_client.routers.values():
+            logger.info(f"Закрываем LLM-клиенты. Серверы: {llm_router.stats()}")
+            llm_router.close()
+        logger.info("Закрываем пул соединений БД")
+        engine.dispose()
+
+
+container = ServiceContainer()
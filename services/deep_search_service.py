@@ -1,16 +1,78 @@
 import uuid
+import time
+import threading
+import queue
 from typing import List
-from models.research_models import MarketResearch, State, ChatMessage, RawLot, AnalyzedLot, Schema
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models.research_models import MarketResearch, State, ChatMessage, RawLot, AnalyzedLot, Schema, SearchTask
 from repositories.research_repository import (
     MarketResearchRepository,
     SearchTaskRepository,
     SchemaRepository,
     RawLotRepository,
-    AnalyzedLotRepository
+    AnalyzedLotRepository,
+    ImageHashRepository,
+    TournamentMatchRepository,
+    ImageCaptionRepository
 )
-from services.tournament_service import tournament_ranking
+from services.tournament_service import (
+    classic_tournament_ranking,
+    swiss_tournament_ranking,
+    incremental_tournament_ranking,
+    TournamentCheckpoint,
+    EarlyRound,
+    group_token_budget,
+    item_token_estimates
+)
+from services.image_caption_service import ImageCaptionService
+from services.job_context import JobContext
+from services.budget_planner import BudgetPlanner, fit_rank_latency
 from utils.image_handler import save_image_from_base64
+from utils.image_hash import compute_dhash, ImageHashIndex
+from utils.text_dedup import MinHashLSH
+from utils.clustering import union_find_clusters
+from utils.bm25 import BM25, tokenize, weighted_query
+from utils.rule_extractors import extract_known_fields
+from utils.schema_compiler import compile_extraction_schema, response_format_for, is_visual_field, as_optional, changed_fields
+from utils.json_repair import parse_json_lenient, validate_fields
+from utils.pipeline import Stage, DONE, bounded_queue, drain
+from utils.llm_client import current_metrics, parallel_capacity
+from utils.metrics import JobMetrics
 from utils.logger import logger
+from config import (
+    IMAGE_DEDUP_ENABLED,
+    IMAGE_DEDUP_MAX_DISTANCE,
+    TEXT_DEDUP_POLICY,
+    TEXT_DEDUP_THRESHOLD,
+    TEXT_DEDUP_NUM_PERM,
+    TEXT_DEDUP_BANDS,
+    TOURNAMENT_MODE,
+    TOURNAMENT_TOP_K,
+    TOURNAMENT_KEEP_RATIO,
+    TOURNAMENT_MAX_ROUNDS,
+    TOURNAMENT_MIN_ROUNDS,
+    TOURNAMENT_AGGREGATION,
+    TOURNAMENT_CONFIDENCE,
+    TOURNAMENT_SCHEDULING,
+    TOURNAMENT_GROUP_SIZE,
+    TOURNAMENT_RESPONSE_TOKENS,
+    LLM_CONTEXT_TOKENS,
+    TOURNAMENT_INCREMENTAL,
+    TOURNAMENT_PLACEMENT_ROUNDS,
+    PREFILTER_ENABLED,
+    PREFILTER_CUTOFF,
+    PREFILTER_TOP_N,
+    RULE_EXTRACTION_ENABLED,
+    EXTRACTION_GRAMMAR_ENABLED,
+    EXTRACTION_REASK_ENABLED,
+    IMAGE_CAPTIONING_ENABLED,
+    VISUAL_GATING_ENABLED,
+    SCHEMA_INCREMENTAL_ENABLED,
+    PIPELINE_ENABLED,
+    PIPELINE_QUEUE_SIZE
+)
+from typing import Callable, Dict, Optional, Tuple
 import json
 import copy
 import base64
@@ -24,26 +86,48 @@ class DeepSearchService:
         schema_repo: SchemaRepository,
         raw_lot_repo: RawLotRepository,
         analyzed_lot_repo: AnalyzedLotRepository,
+        image_hash_repo: ImageHashRepository,
+        tournament_match_repo: TournamentMatchRepository,
+        image_caption_repo: ImageCaptionRepository,
     ):
         self.mr_repo = mr_repo
         self.task_repo = task_repo
         self.schema_repo = schema_repo
         self.raw_lot_repo = raw_lot_repo
         self.analyzed_lot_repo = analyzed_lot_repo
+        self.image_hash_repo = image_hash_repo
+        self.tournament_match_repo = tournament_match_repo
+        self.image_caption_repo = image_caption_repo
+        self.caption_service = ImageCaptionService(image_caption_repo)
+        # Потоки конвейера работают со своими сессиями БД
+        self._local = threading.local()
+
+    @classmethod
+    def from_context(cls, ctx: JobContext) -> "DeepSearchService":
+        """Сервис на репозиториях задания (своя сессия БД)"""
+        return cls(
+            ctx.mr_repo,
+            ctx.task_repo,
+            ctx.schema_repo,
+            ctx.raw_lot_repo,
+            ctx.analyzed_lot_repo,
+            ctx.image_hash_repo,
+            ctx.tournament_match_repo,
+            ctx.image_caption_repo,
+        )
+
+    @classmethod
+    def run_job(cls, task_id: int, raw_results: List[dict]):
+        """Обработка результатов в изолированном контексте: параллельные задания не делят сессию и репозитории"""
+        with JobContext(f"deep_search:{task_id}") as ctx:
+            cls.from_context(ctx)._process_results(task_id, raw_results)
 
     def handle_deep_search_results(self, task_id: int, raw_results: List[dict]) -> MarketResearch:
-            # ВАЖНО: Так как это BackgroundTask, нам нужна своя сессия БД
-            from database import SessionLocal
-            db = SessionLocal()
-            
-            try:
-                # Обновляем репозитории для использования новой сессии
-                self.task_repo.db = db
-                self.raw_lot_repo.db = db
-                self.analyzed_lot_repo.db = db
-                self.mr_repo.db = db
-                self.schema_repo.db = db
+        # Репозитории этого экземпляра принадлежат веб-запросу, поэтому работаем в своем контексте
+        self.run_job(task_id, raw_results)
 
+    def _process_results(self, task_id: int, raw_results: List[dict]):
+            try:
                 logger.info(f"Фон: Обрабатываем результаты глубокого поиска для задачи {task_id}")
 
                 # 1. Сохраняем "сырые" лоты (RawLot)
@@ -69,26 +153,85 @@ class DeepSearchService:
 
                 task = self.task_repo.get_by_id(task_id)
                 schema = self.schema_repo.get_by_id(task.schema_id)
+
+                # Бюджет времени/токенов отсчитывается от начала обработки
+                planner = self._budget_planner(task)
                 
                 analyzed_lots = list(existing_analyses) 
 
+                # Лексический префильтр: явно нерелевантные лоты (аксессуары, другая категория) не доходят до LLM
+                if PREFILTER_ENABLED and schema:
+                    raw_lots = self._prefilter_by_relevance(raw_lots, task, schema)
+
+                # Дубликаты: по фото анализируем только представителя кластера,
+                # по тексту - в зависимости от TEXT_DEDUP_POLICY
+                image_pairs = self._find_image_duplicates(raw_lots) if IMAGE_DEDUP_ENABLED else []
+                text_pairs = self._find_text_duplicates(raw_lots) if TEXT_DEDUP_POLICY != "off" else []
+                raw_ids = [raw_lot.id for raw_lot in raw_lots]
+
+                extraction_pairs = image_pairs + (text_pairs if TEXT_DEDUP_POLICY == "skip_extraction" else [])
+                duplicate_of = self._pick_representatives(union_find_clusters(raw_ids, extraction_pairs), processed_ids)
+                ranking_duplicate_of = self._pick_representatives(union_find_clusters(raw_ids, image_pairs + text_pairs), processed_ids)
+
+                # Анализы этих же лотов по прошлым схемам исследования: после правки плана
+                # заново извлекаются только добавленные и измененные поля
+                previous_analyses = self._previous_analyses(task, schema) if SCHEMA_INCREMENTAL_ENABLED and schema else {}
+
                 # 3. Основной цикл LLM
                 if schema:
-                    for i, raw_lot in enumerate(raw_lots):
+                    to_extract = []
+                    for raw_lot in raw_lots:
                         if raw_lot.id in processed_ids:
                             logger.info(f"Скип лота {raw_lot.id}")
-                            continue
-
-                        logger.info(f"LLM лот {i+1}/{len(raw_lots)}")
-                        analyzed_lot = self._analyze_lot_with_schema(raw_lot, schema, task_id)
+                        elif raw_lot.id in duplicate_of:
+                            logger.info(f"Скип лота {raw_lot.id}: дубликат лота {duplicate_of[raw_lot.id]}")
+                        else:
+                            to_extract.append(raw_lot)
+
+                    expected_contenders = len(processed_ids | set(raw_ids)) - len(ranking_duplicate_of)
+
+                    # С несколькими LLM-серверами лоты извлекаются параллельно (только в конвейере)
+                    workers = parallel_capacity("extraction") if PIPELINE_ENABLED else 1
+
+                    def analyze(i: int, raw_lot: RawLot) -> Tuple[RawLot, AnalyzedLot]:
+                        logger.info(f"LLM лот {i+1}/{len(to_extract)}")
+                        mode = planner.extraction_mode(len(to_extract) - i, expected_contenders) if planner else "full"
+                        started, tokens = time.monotonic(), planner.tokens_spent() if planner else 0
+                        if raw_lot.id in previous_analyses:
+                            analyzed_lot = self._reextract_changed_fields(raw_lot, previous_analyses[raw_lot.id], schema, task, economy=mode == "economy")
+                        else:
+                            analyzed_lot = self._analyze_lot_with_schema(raw_lot, schema, task_id, task.needs_visual, economy=mode == "economy")
+                        if planner:
+                            # При параллельном извлечении на лот приходится доля времени и токенов за период
+                            # (делим на текущий лимит серверов: потоков может быть больше, чем запросов в работе)
+                            share = min(workers, parallel_capacity("extraction", current=True)) if workers > 1 else 1
+                            planner.record_extraction(mode, (time.monotonic() - started) / share, (planner.tokens_spent() - tokens) / share)
+                        return raw_lot, analyzed_lot
+
+                    def save(raw_lot: RawLot, analyzed_lot: AnalyzedLot) -> AnalyzedLot:
                         saved_analyzed_lot = self.analyzed_lot_repo.create(analyzed_lot)
                         analyzed_lots.append(saved_analyzed_lot)
+                        processed_ids.add(raw_lot.id)
+                        return saved_analyzed_lot
+
+                    if PIPELINE_ENABLED:
+                        self._extract_pipelined(to_extract, analyze, save, workers, analyzed_lots, ranking_duplicate_of, expected_contenders, schema, task, planner)
+                    else:
+                        for i, raw_lot in enumerate(to_extract):
+                            save(*analyze(i, raw_lot))
+
+                    analyzed_lots.extend(self._fan_out_duplicates(duplicate_of, analyzed_lots, processed_ids))
+
+                    # В турнире участвуют только представители кластеров
+                    contenders = [lot for lot in analyzed_lots if lot.raw_lot_id not in ranking_duplicate_of]
 
                     # 4. Ранжирование и финализация
-                    if len(analyzed_lots) > 5:
-                        ranked_lots = self._apply_tournament_ranking(analyzed_lots, schema)
+                    if len(contenders) > 5:
+                        ranked_lots = self._apply_tournament_ranking(contenders, schema, task_id, planner=planner)
                     else:
-                        ranked_lots = analyzed_lots
+                        ranked_lots = contenders
+
+                    self._copy_scores_to_duplicates(ranking_duplicate_of, analyzed_lots)
 
                     result_message = self._generate_analytical_summary(ranked_lots[:10], schema, task.topic)
                     
@@ -115,31 +258,420 @@ class DeepSearchService:
                 logger.info(f"Фоновая задача {task_id} полностью завершена")
 
             except Exception as e:
+                # Статус failed ставит очередь заданий, когда попытки исчерпаны; повтор продолжит с места остановки
                 logger.error(f"Ошибка в фоне: {e}")
-                self.task_repo.update_status(task_id, "failed")
-            finally:
-                db.close() # Всегда закрываем сессию
+                raise
 
-    def _analyze_lot_with_schema(self, raw_lot: RawLot, schema: Schema, task_id: int) -> AnalyzedLot:
-        """Анализ лота с использованием схемы и LLM"""
+    def _extract_pipelined(
+        self,
+        to_extract: List[RawLot],
+        analyze: Callable[[int, RawLot], Tuple[RawLot, AnalyzedLot]],
+        save: Callable[[RawLot, AnalyzedLot], AnalyzedLot],
+        workers: int,
+        analyzed_lots: List[AnalyzedLot],
+        ranking_duplicate_of: Dict[int, int],
+        expected_contenders: int,
+        schema: Schema,
+        task: SearchTask,
+        planner: Optional[BudgetPlanner] = None
+    ):
+        """
+        Извлечение конвейером: подготовка фото -> извлечение -> ранний раунд турнира.
+
+        Стадии - потоки с ограниченными очередями между ними. Описания фото
+        считаются на PIPELINE_QUEUE_SIZE лотов вперед, извлечение идет в workers
+        потоков (по числу слотов LLM-серверов), а группы первого раунда турнира
+        уходят в LLM, как только извлечено достаточно лотов (и сразу пишутся в
+        чекпоинт турнира). У потоков свои сессии БД, запись результатов - в
+        текущем потоке. Префильтр и дедупликация - барьер перед конвейером: им нужна вся выдача.
+        """
+        prep_db = SessionLocal()
+        caption_service = ImageCaptionService(ImageCaptionRepository(prep_db))
+        # Заранее описываем фото, только если оно идет в первый проход каждого лота. С визуальным
+        # гейтингом фото нужно лишь лотам, у которых текст не закрыл визуальные поля, - их описание
+        # считается по требованию во втором проходе
+        need_captions = IMAGE_CAPTIONING_ENABLED and not VISUAL_GATING_ENABLED
+
+        def prepare(item: Tuple[int, RawLot]) -> Tuple[int, RawLot]:
+            raw_lot = item[1]
+            # В экономном режиме бюджета фото не используются
+            if need_captions and raw_lot.image_path and (planner is None or planner.mode == "full"):
+                try:
+                    caption_service.get_caption(raw_lot.image_path)
+                except Exception as e:
+                    # Извлечение попробует еще раз и при ошибке приложит само фото
+                    logger.warning(f"Не удалось заранее описать фото лота {raw_lot.id}: {e}")
+            return item
+
+        worker_sessions = []
+
+        def extract(item: Tuple[int, RawLot]) -> Tuple[RawLot, AnalyzedLot]:
+            if not hasattr(self._local, "caption_service"):
+                db = SessionLocal()
+                worker_sessions.append(db)
+                self._local.caption_service = ImageCaptionService(ImageCaptionRepository(db))
+            return analyze(*item)
+
+        # Вход первой стадии - уже сохраненные лоты, его ограничивать не нужно
+        prep_in = queue.Queue()
+        for item in enumerate(to_extract):
+            prep_in.put(item)
+        prep_in.put(DONE)
+        prepared = bounded_queue(PIPELINE_QUEUE_SIZE)
+        extracted = bounded_queue(PIPELINE_QUEUE_SIZE)
+        prep = Stage("image_prep", prepare, prep_in, prepared).start()
+        extractor = Stage("extract", extract, prepared, extracted, workers=workers).start()
+
+        rank_db = SessionLocal()
+        early_round = self._new_early_round(rank_db, schema, task.id, analyzed_lots, expected_contenders, len(to_extract), planner)
+        ranker = None
+        if early_round:
+            rank_in = bounded_queue(PIPELINE_QUEUE_SIZE)
+            ranker = Stage("early_round", early_round.add, rank_in, on_done=early_round.finish).start()
+            # Лоты, извлеченные в прошлой попытке, тоже играют в первом раунде
+            for lot in analyzed_lots:
+                if lot.raw_lot_id not in ranking_duplicate_of:
+                    rank_in.put(self._tournament_item(lot))
+
+        logger.info(f"Конвейер: {len(to_extract)} лотов на извлечение в {workers} потоков, подготовка фото: {need_captions}, ранний раунд: {early_round is not None}")
+        failed = True
+        try:
+            for raw_lot, analyzed_lot in drain(extracted):
+                analyzed_lot = save(raw_lot, analyzed_lot)
+                if ranker and analyzed_lot.raw_lot_id not in ranking_duplicate_of:
+                    rank_in.put(self._tournament_item(analyzed_lot))
+            failed = False
+        finally:
+            if failed:
+                # Останавливаем стадии и дочитываем очередь, чтобы потоки не зависли на put
+                prep.cancel()
+                extractor.cancel()
+                for _ in drain(extracted):
+                    pass
+                if ranker:
+                    ranker.cancel()
+            if ranker:
+                rank_in.put(DONE)
+            prep.join(raise_error=False)
+            extractor.join(raise_error=False)
+            if ranker:
+                ranker.join(raise_error=False)
+            prep_db.close()
+            rank_db.close()
+            for db in worker_sessions:
+                db.close()
+
+        prep.join()
+        extractor.join()
+        if ranker:
+            ranker.join()
+
+    def _captions(self) -> ImageCaptionService:
+        """Сервис описаний фото текущего потока"""
+        return getattr(self._local, "caption_service", None) or self.caption_service
+
+    def _budget_planner(self, task: SearchTask) -> Optional[BudgetPlanner]:
+        """Планировщик, если у задачи задан бюджет времени или токенов"""
+        if not task.time_budget_min and not task.token_budget:
+            return None
+        metrics = current_metrics()
+        if metrics is None:
+            logger.warning(f"Задача {task.id}: нет метрик задания, бюджет токенов не отслеживается")
+            metrics = JobMetrics(f"deep_search:{task.id}")
+        return BudgetPlanner(
+            metrics,
+            time_budget_s=task.time_budget_min * 60 if task.time_budget_min else None,
+            token_budget=task.token_budget,
+            rank_latency=fit_rank_latency(self.tournament_match_repo.latency_samples())
+        )
+
+    def _new_early_round(
+        self,
+        db: Session,
+        schema: Schema,
+        task_id: int,
+        analyzed_lots: List[AnalyzedLot],
+        expected_contenders: int,
+        lots_left: int,
+        planner: Optional[BudgetPlanner] = None
+    ) -> Optional[EarlyRound]:
+        """
+        Ранний раунд возможен, только если турнир задачи еще не начинался (или
+        прошлая попытка успела сыграть лишь ранний раунд) и он вообще будет.
+        Чекпоинт раннего раунда работает в сессии db: группы пишутся из потока стадии
+        """
+        if expected_contenders <= 5:
+            # Турнира не будет (см. _process_results)
+            return None
+        if planner and planner.mode != "full":
+            return None
+        checkpoint = TournamentCheckpoint(TournamentMatchRepository(db), task_id)
+        if checkpoint.round_numbers() not in ([], [0]):
+            return None
+        if any(lot.tournament_score > 0 for lot in analyzed_lots):
+            # Будет инкрементальный турнир: новые лоты расставляются относительно старых
+            return None
+        # Размер групп - как у турнира после извлечения, чтобы первый раунд стоил столько, сколько заложено в план
+        group_size = planner.early_group_size(expected_contenders, lots_left) if planner else TOURNAMENT_GROUP_SIZE
+        return EarlyRound(
+            self._tournament_criteria(schema),
+            checkpoint,
+            schema.description,
+            group_size=group_size,
+            context_tokens=LLM_CONTEXT_TOKENS or None,
+            response_tokens=TOURNAMENT_RESPONSE_TOKENS,
+            # Экономный режим бюджета означает, что на турнир после извлечения времени не хватает
+            allow=(lambda: planner.mode == "full") if planner else None
+        )
+
+    def _prefilter_by_relevance(self, raw_lots: List[RawLot], task: SearchTask, schema: Schema) -> List[RawLot]:
+        """Отсев лотов по BM25 относительно запроса, темы и описания задачи (context_summary)"""
+        # Заголовок повторяем дважды: он информативнее описания
+        bm25 = BM25([tokenize(f"{lot.title} {lot.title} {lot.description}") for lot in raw_lots])
+        query = weighted_query([(task.query, 1.0), (task.topic, 0.5), (schema.description, 0.25)])
+        scores = bm25.scores(query)
+
+        best = max(scores, default=0.0)
+        if best == 0:
+            logger.warning(f"Префильтр: ни один лот не содержит слов запроса '{task.query}', фильтрация пропущена")
+            return raw_lots
+
+        ranked = sorted(zip(raw_lots, scores), key=lambda pair: pair[1], reverse=True)
+        kept = [lot for lot, score in ranked if score >= PREFILTER_CUTOFF * best]
+        if PREFILTER_TOP_N:
+            kept = kept[:PREFILTER_TOP_N]
+
+        kept_ids = {lot.id for lot in kept}
+        for lot, score in ranked:
+            if lot.id not in kept_ids:
+                logger.info(f"Префильтр: лот {lot.id} отброшен (BM25 {score:.2f} из {best:.2f}): {lot.title}")
+        logger.info(f"Префильтр: оставлено {len(kept)} из {len(raw_lots)} лотов")
+
+        # Сохраняем исходный порядок выдачи
+        return [lot for lot in raw_lots if lot.id in kept_ids]
+
+    def _find_image_duplicates(self, raw_lots: List[RawLot]) -> List[Tuple[int, int]]:
+        """Пары лотов с почти одинаковыми фото (перепосты перекупов)"""
+        index = ImageHashIndex(IMAGE_DEDUP_MAX_DISTANCE)
+        for raw_lot in raw_lots:
+            if not raw_lot.image_path:
+                continue
+            phash = self.image_hash_repo.get_by_path(raw_lot.image_path)
+            if not phash:
+                phash = compute_dhash(raw_lot.image_path)
+                if not phash:
+                    continue
+                self.image_hash_repo.create(raw_lot.image_path, phash)
+            index.add(raw_lot.id, phash)
+
+        pairs = index.pairs()
+        logger.info(f"Найдено {len(pairs)} пар дубликатов по фото среди {len(raw_lots)} лотов")
+        return pairs
+
+    def _find_text_duplicates(self, raw_lots: List[RawLot]) -> List[Tuple[int, int]]:
+        """Пары лотов с почти одинаковым заголовком и описанием (шаблоны продавцов, перепосты)"""
+        index = MinHashLSH(TEXT_DEDUP_THRESHOLD, num_perm=TEXT_DEDUP_NUM_PERM, bands=TEXT_DEDUP_BANDS)
+        for raw_lot in raw_lots:
+            index.add(raw_lot.id, f"{raw_lot.title}\n{raw_lot.description}")
+
+        pairs = index.pairs()
+        logger.info(f"Найдено {len(pairs)} пар дубликатов по тексту среди {len(raw_lots)} лотов")
+        return pairs
+
+    def _pick_representatives(self, clusters: List[List[int]], processed_ids: set) -> Dict[int, int]:
+        """
+        Выбирает представителя в каждом кластере дубликатов.
+        :return: словарь raw_lot_id дубликата -> raw_lot_id представителя кластера
+        """
+        duplicate_of = {}
+        for cluster in clusters:
+            if len(cluster) < 2:
+                continue
+            # Представителем берем уже проанализированный лот, чтобы не тратить лишний вызов LLM
+            analyzed_members = [lot_id for lot_id in cluster if lot_id in processed_ids]
+            representative = min(analyzed_members) if analyzed_members else min(cluster)
+            for lot_id in cluster:
+                if lot_id != representative:
+                    duplicate_of[lot_id] = representative
+        return duplicate_of
+
+    def _fan_out_duplicates(self, duplicate_of: Dict[int, int], analyzed_lots: List[AnalyzedLot], processed_ids: set) -> List[AnalyzedLot]:
+        """Копирует результат анализа представителя на его дубликаты"""
+        by_raw_id = {lot.raw_lot_id: lot for lot in analyzed_lots}
+        fanned_out = []
+        for dup_id, rep_id in duplicate_of.items():
+            if dup_id in processed_ids:
+                continue
+            rep = by_raw_id[rep_id]
+            copy_lot = AnalyzedLot(
+                raw_lot_id=dup_id,
+                search_task_id=rep.search_task_id,
+                schema_id=rep.schema_id,
+                structured_data=copy.deepcopy(rep.structured_data),
+                relevance_note=rep.relevance_note,
+                image_description_and_notes=rep.image_description_and_notes
+            )
+            fanned_out.append(self.analyzed_lot_repo.create(copy_lot))
+            processed_ids.add(dup_id)
+
+        logger.info(f"Результаты анализа скопированы на {len(fanned_out)} дубликатов")
+        return fanned_out
+
+    def _copy_scores_to_duplicates(self, duplicate_of: Dict[int, int], analyzed_lots: List[AnalyzedLot]):
+        """Дубликаты получают турнирный рейтинг своего представителя"""
+        by_raw_id = {lot.raw_lot_id: lot for lot in analyzed_lots}
+        for dup_id, rep_id in duplicate_of.items():
+            lot = by_raw_id[dup_id]
+            lot.tournament_score = by_raw_id[rep_id].tournament_score
+            self.analyzed_lot_repo.update_score(lot.id, lot.tournament_score)
+
+    def _analyze_lot_with_schema(self, raw_lot: RawLot, schema: Schema, task_id: int, needs_visual: bool = False, known: Optional[Dict] = None, economy: bool = False) -> AnalyzedLot:
+        """
+        Анализ лота с использованием схемы и LLM.
+        В двухпроходном режиме первый запрос - только текст; фото (описание или картинка)
+        отправляется вторым запросом, только если задаче нужен визуал и визуальные поля
+        не удалось заполнить по тексту.
+        :param known: уже известные значения полей (перенесены из анализа по прошлой схеме)
+        :param economy: экономный режим бюджета - один текстовый запрос, без фото и переспроса
+        """
         logger.info(f"Анализируем лот {raw_lot.id} с использованием схемы {schema.id}")
 
         from utils.llm_client import get_completion
 
+        # Однозначные характеристики берем правилами. Если все поля закрыты правилами, LLM не вызываем;
+        # иначе LLM извлекает и их, а правило только подставляет значение, которое LLM не дал
+        known = dict(known or {})
+        rule_data = {}
+        if RULE_EXTRACTION_ENABLED:
+            pending = {k: v for k, v in schema.json_schema.items() if k not in known}
+            rule_data = extract_known_fields(pending, f"{raw_lot.title}\n{raw_lot.description}")
+
+        if all(k in known or k in rule_data for k in schema.json_schema):
+            logger.info(f"Все поля лота {raw_lot.id} извлечены правилами, LLM не вызываем")
+            return AnalyzedLot(
+                raw_lot_id=raw_lot.id,
+                search_task_id=task_id,
+                schema_id=schema.id,
+                structured_data={**rule_data, **known},
+                relevance_note="Характеристики извлечены из текста объявления автоматически",
+                image_description_and_notes="N/A"
+            )
+        remaining_fields = {k: v for k, v in schema.json_schema.items() if k not in known}
+
+        if economy:
+            needs_visual = False
+        if VISUAL_GATING_ENABLED or economy:
+            # Визуальные поля в текстовом проходе необязательны: null - "по тексту не понять"
+            visual_names = [k for k, v in remaining_fields.items() if is_visual_field(k, v)]
+            text_fields = {k: as_optional(v) if k in visual_names else v for k, v in remaining_fields.items()}
+            notes = ["relevance_note"]
+            photo_parts = [{"type": "text", "text": "(Фото на этом шаге не анализируется)"}]
+        else:
+            visual_names = []
+            text_fields = remaining_fields
+            notes = ["relevance_note", "image_description_and_notes"]
+            photo_parts = self._photo_content(raw_lot)
+
+        messages = self._build_extraction_messages(raw_lot, text_fields, known, photo_parts, notes)
+
+        # Схема ответа компилируется из оставшихся полей: ответ всегда парсится и не содержит лишнего
+        response_format = None
+        if EXTRACTION_GRAMMAR_ENABLED:
+            response_format = response_format_for(compile_extraction_schema(text_fields, notes))
+        response = get_completion(messages, response_format=response_format, stage="extraction")
+
+        # Парсим ответ от LLM: ограждения и текст вокруг отбрасываются, оборванный объект дозакрывается
+        parsed = parse_json_lenient(response.content)
+        if parsed is None:
+            logger.error(f"LLM вернул некорректный JSON для лота {raw_lot.id}")
+            parsed = {}
+
+        structured_data, problems = validate_fields(parsed, text_fields)
+        # Поля, найденные правилами, не переспрашиваем
+        problems = [k for k in problems if k not in rule_data]
+        if problems and EXTRACTION_REASK_ENABLED and not economy:
+            structured_data.update(self._reask_fields(raw_lot, {k: text_fields[k] for k in problems}))
+
+        relevance_note = parsed.get("relevance_note") or "No note"
+        image_description_and_notes = parsed.get("image_description_and_notes") or ("N/A" if VISUAL_GATING_ENABLED else "No visual info")
+
+        # Второй проход: фото только для визуальных полей, которые текст не закрыл
+        unresolved = {k: remaining_fields[k] for k in visual_names if structured_data.get(k) is None}
+        if unresolved and needs_visual and raw_lot.image_path:
+            visual_data, image_description_and_notes = self._extract_visual_fields(raw_lot, unresolved)
+            structured_data.update(visual_data)
+        elif visual_names:
+            logger.info(f"Лот {raw_lot.id}: фото не отправляем (needs_visual={needs_visual}, не заполнено по тексту: {list(unresolved.keys())})")
+
+        for name, value in rule_data.items():
+            if structured_data.get(name) is None:
+                structured_data[name] = value
+            elif structured_data[name] != value:
+                logger.info(f"Лот {raw_lot.id}: поле {name} - правило дало {value!r}, LLM {structured_data[name]!r}, оставляем ответ LLM")
+        structured_data.update(known)
 
-        # Формируем читаемые инструкции безопасно
-        fields_list = []
-        for k, v in schema.json_schema.items():
-            if isinstance(v, dict):
-                # Если это словарь, берем значения через .get() с дефолтами
-                desc = v.get('description', 'Нет описания')
-                field_type = v.get('type', 'string')
-                fields_list.append(f"- {k}: {desc} (тип: {field_type})")
-            else:
-                # На случай, если LLM прислала просто "field": "string"
-                fields_list.append(f"- {k}: (тип: {v})")
+        analyzed_lot = AnalyzedLot(
+            raw_lot_id=raw_lot.id,
+            search_task_id=task_id,  
+            schema_id=schema.id,
+            structured_data=structured_data,
+            relevance_note=relevance_note,
+            image_description_and_notes=image_description_and_notes
+        )
+
+        return analyzed_lot
+
+    def _previous_analyses(self, task: SearchTask, schema: Schema) -> Dict[int, Tuple[AnalyzedLot, List[str]]]:
+        """
+        Последний анализ каждого лота в других задачах того же исследования
+        :return: raw_lot_id -> (анализ, поля новой схемы, которые изменились относительно его схемы)
+        """
+        changed_by_schema = {}
+        result = {}
+        for analysis in self.analyzed_lot_repo.get_by_research_id(task.market_research_id, exclude_task_id=task.id):
+            if analysis.schema_id not in changed_by_schema:
+                old_schema = self.schema_repo.get_by_id(analysis.schema_id)
+                changed_by_schema[analysis.schema_id] = changed_fields(old_schema.json_schema, schema.json_schema) if old_schema else None
+            if changed_by_schema[analysis.schema_id] is not None:
+                result[analysis.raw_lot_id] = (analysis, changed_by_schema[analysis.schema_id])
+
+        if result:
+            logger.info(f"Найдено {len(result)} лотов, проанализированных по прошлым схемам, изменения полей: {changed_by_schema}")
+        return result
+
+    def _reextract_changed_fields(self, raw_lot: RawLot, previous: Tuple[AnalyzedLot, List[str]], schema: Schema, task: SearchTask, economy: bool = False) -> AnalyzedLot:
+        """Переносит неизмененные поля из прошлого анализа и извлекает только остальные"""
+        analysis, changed = previous
+        carried = {k: v for k, v in analysis.structured_data.items() if k in schema.json_schema and k not in changed}
+
+        if len(carried) == len(schema.json_schema):
+            logger.info(f"Лот {raw_lot.id}: поля схемы не изменились, анализ перенесен из задачи {analysis.search_task_id}")
+            return AnalyzedLot(
+                raw_lot_id=raw_lot.id,
+                search_task_id=task.id,
+                schema_id=schema.id,
+                structured_data=carried,
+                relevance_note=analysis.relevance_note,
+                image_description_and_notes=analysis.image_description_and_notes
+            )
+
+        logger.info(f"Лот {raw_lot.id}: перенесено {len(carried)} полей, извлекаем {[k for k in schema.json_schema if k not in carried]}")
+        analyzed_lot = self._analyze_lot_with_schema(raw_lot, schema, task.id, task.needs_visual, known=carried, economy=economy)
+        if analyzed_lot.image_description_and_notes == "N/A":
+            analyzed_lot.image_description_and_notes = analysis.image_description_and_notes
+        return analyzed_lot
 
-        fields_desc = "\n".join(fields_list)
+    def _build_extraction_messages(self, raw_lot: RawLot, fields: Dict, known: Dict, photo_parts: List[Dict], notes: List[str]) -> List[Dict]:
+        """Промпт извлечения для заданного набора полей и служебных заметок"""
+        fields_desc = self._format_fields(fields)
+        if known:
+            fields_desc += "\n\nУже известно (не извлекай повторно): " + json.dumps(known, ensure_ascii=False)
+
+        notes_desc = {
+            "relevance_note": "- relevance_note: почему этот лот подходит пользователю.",
+            "image_description_and_notes": "- image_description_and_notes: что изображено, видно на фото (объект, цвета, детали, состояние).",
+        }
+        notes_text = "\n".join(notes_desc[note] for note in notes)
 
         messages = [
             {
@@ -148,106 +680,179 @@ class DeepSearchService:
 
 ### **ВАЖНЫЕ ПРАВИЛА**
 1. Если в объявлении предлагается несколько разных моделей (или товаров) в одном тексте, обязательно запиши это в relevance_note. Укажи, что в таком случае, цена указанная в объявлении может не являться реальной ценой.  
+2. Если значения поля нет в объявлении, укажи null - не придумывай его.
 
 Поля для извлечения:
 {fields_desc}
-- relevance_note: почему этот лот подходит пользователю.
-- image_description_and_notes: что изображено, видно на фото (объект, цвета, детали, состояние).
+{notes_text}
 
 
 Возвращай СТРОГО чистый JSON."""
                     },]
         user_content = [{"type": "text", "text": f"Title: {raw_lot.title}\nDesc: {raw_lot.description}\nPrice: {raw_lot.price}"}]
-        
-        
-        # 3. Фото-логика (подключаемая)
+        user_content.extend(photo_parts)
+        messages.append({"role": "user", "content": user_content})
+        return messages
+
+    def _photo_content(self, raw_lot: RawLot) -> List[Dict]:
+        """Фото-логика (подключаемая): описание из кэша вместо повторного кодирования картинки"""
+        caption = None
+        if raw_lot.image_path and IMAGE_CAPTIONING_ENABLED:
+            try:
+                caption = self._captions().get_caption(raw_lot.image_path)
+            except Exception as e:
+                # Без описания лот все равно извлекается - с картинкой, как до кэша описаний
+                logger.warning(f"Не удалось описать фото лота {raw_lot.id}, прикладываем изображение: {e}")
+
+        if caption:
+            return [{"type": "text", "text": f"Photo description: {caption}"}]
         if raw_lot.image_path:
             try:
                 with open(raw_lot.image_path, "rb") as f:
                     img_b64 = base64.b64encode(f.read()).decode('utf-8')
-                user_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}})
+                return [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}}]
             except Exception as e:
                 logger.error(f"Image error: {e}")
-        else:
-            user_content.append({"type": "text", "text": "(NO PHOTO provided for this lot. Put 'N/A' in image_description_and_notes)"})
+                return []
+        return [{"type": "text", "text": "(NO PHOTO provided for this lot. Put 'N/A' in image_description_and_notes)"}]
 
-        messages.append({"role": "user", "content": user_content})
+    def _extract_visual_fields(self, raw_lot: RawLot, fields: Dict) -> Tuple[Dict, str]:
+        """
+        Второй проход по фото для визуальных полей
+        :return: (заполненные поля, описание фото)
+        """
+        logger.info(f"Лот {raw_lot.id}: второй проход с фото для полей {list(fields.keys())}")
 
-        response = get_completion(messages)
+        from utils.llm_client import get_completion
 
-        # Парсим ответ от LLM
-        try:
-            structured_data = json.loads(response.content)
-            
-        except json.JSONDecodeError:
-            # Если LLM вернул неправильный JSON, используем хотя бы частичные данные
-            # В реальной реализации нужно будет обработать ошибку и, возможно, повторить запрос
-            logger.error(f"LLM вернул некорректный JSON для лота {raw_lot.id}")
-            structured_data = {}
+        notes = ["image_description_and_notes"]
+        messages = self._build_extraction_messages(raw_lot, fields, {}, self._photo_content(raw_lot), notes)
+        response_format = None
+        if EXTRACTION_GRAMMAR_ENABLED:
+            response_format = response_format_for(compile_extraction_schema(fields, notes))
+        response = get_completion(messages, response_format=response_format, stage="extraction")
+
+        parsed = parse_json_lenient(response.content) or {}
+        valid, problems = validate_fields(parsed, fields)
+        if problems:
+            logger.warning(f"По фото лота {raw_lot.id} не заполнены поля: {problems}")
+        return valid, parsed.get("image_description_and_notes") or "No visual info"
+
+    @staticmethod
+    def _format_fields(fields: Dict) -> str:
+        """Читаемый список полей схемы для промпта"""
+        fields_list = []
+        for k, v in fields.items():
+            if isinstance(v, dict):
+                # Если это словарь, берем значения через .get() с дефолтами
+                desc = v.get('description', 'Нет описания')
+                field_type = v.get('type', 'string')
+                fields_list.append(f"- {k}: {desc} (тип: {field_type})")
+            else:
+                # На случай, если LLM прислала просто "field": "string"
+                fields_list.append(f"- {k}: (тип: {v})")
+        return "\n".join(fields_list)
 
-        relevance_note = structured_data.pop("relevance_note", "No note")
-        image_description_and_notes = structured_data.pop("image_description_and_notes", "No visual info")
+    def _reask_fields(self, raw_lot: RawLot, fields: Dict) -> Dict:
+        """
+        Короткий повторный запрос только по отсутствующим или невалидным полям.
+        Без фото и служебных заметок - это доля стоимости полного извлечения.
+        """
+        logger.info(f"Переспрашиваем для лота {raw_lot.id} поля: {list(fields.keys())}")
 
-        analyzed_lot = AnalyzedLot(
-            raw_lot_id=raw_lot.id,
-            search_task_id=task_id,  
-            schema_id=schema.id,
-            structured_data=structured_data,
-            relevance_note=relevance_note,
-            image_description_and_notes=image_description_and_notes
-        )
+        from utils.llm_client import get_completion
 
-        return analyzed_lot
+        messages = [
+            {
+                "role": "system",
+                "content": f"""Дополни характеристики товара. Верни JSON только с этими полями:
+{self._format_fields(fields)}
 
-    def _apply_tournament_ranking(self, analyzed_lots: List[AnalyzedLot], schema: Schema, num_rounds: int = 4) -> List[AnalyzedLot]:
-        """Применение турнирного реранкинга к результатам с возможностью указания количества раундов"""
-        logger.info(f"Применяем турнирный реранкинг к {len(analyzed_lots)} лотам, {num_rounds} раундов")
+Если значения нет в объявлении, укажи null - не придумывай его."""
+            },
+            {"role": "user", "content": f"Title: {raw_lot.title}\nDesc: {raw_lot.description}\nPrice: {raw_lot.price}"}
+        ]
+
+        response_format = None
+        if EXTRACTION_GRAMMAR_ENABLED:
+            response_format = response_format_for(compile_extraction_schema(fields, notes=[]))
+        response = get_completion(messages, response_format=response_format, stage="extraction")
+
+        valid, problems = validate_fields(parse_json_lenient(response.content) or {}, fields)
+        if problems:
+            logger.warning(f"После повторного запроса для лота {raw_lot.id} не заполнены поля: {problems}")
+        return valid
+
+    def _apply_tournament_ranking(self, analyzed_lots: List[AnalyzedLot], schema: Schema, task_id: int, num_rounds: int = TOURNAMENT_MAX_ROUNDS, planner: Optional[BudgetPlanner] = None) -> List[AnalyzedLot]:
+        """
+        Применение турнирного реранкинга к результатам с возможностью указания количества раундов.
+        С planner число раундов и размер групп подбираются под остаток бюджета.
+        """
+        # Сыгранные группы сохраняются в БД: после перезапуска турнир продолжается с места остановки
+        checkpoint = TournamentCheckpoint(self.tournament_match_repo, task_id)
+
+        # Лоты с ненулевым рейтингом уже прошли турнир раньше (например, до дозагрузки страниц)
+        existing_scores = {str(lot.id): lot.tournament_score for lot in analyzed_lots if lot.tournament_score > 0}
+        new_count = len(analyzed_lots) - len(existing_scores)
+        incremental = TOURNAMENT_INCREMENTAL and new_count > 0 and len(existing_scores) >= TOURNAMENT_GROUP_SIZE
+        if not incremental:
+            # Полный турнир: раунды, сыгранные без новых лотов, не переигрываем, а начинаем заново
+            checkpoint.skip_stale_rounds([str(lot.id) for lot in analyzed_lots])
+
+        criteria = self._tournament_criteria(schema)
+
+        # Данные лотов для промпта собираем один раз
+        lots_data = [self._tournament_item(lot) for lot in analyzed_lots]
+
+        group_size = TOURNAMENT_GROUP_SIZE
+        should_stop = None
+        if planner:
+            # Стоимость раунда считается по тем же группам, которые составит турнир (с упаковкой по токенам)
+            token_budget = group_token_budget(criteria, schema.description, LLM_CONTEXT_TOKENS, TOURNAMENT_RESPONSE_TOKENS) if LLM_CONTEXT_TOKENS else None
+            num_rounds, group_size = planner.tournament_plan(len(lots_data), item_token_estimates(lots_data), token_budget)
+            should_stop = planner.should_stop
+            if num_rounds == 0:
+                if not checkpoint.round_numbers():
+                    logger.warning("Бюджет исчерпан, турнир пропущен: лоты остаются в порядке выдачи")
+                    return list(analyzed_lots)
+                # Уже сыгранные группы (ранний раунд) учитываем без новых вызовов LLM
+                num_rounds = 1
 
-        import random
+        logger.info(f"Применяем турнирный реранкинг к {len(analyzed_lots)} лотам, {num_rounds} раундов")
 
-        # Подготовим все группы для сравнения
-        all_groups_data = []
+        common = dict(
+            num_rounds=num_rounds,
+            group_size=group_size,
+            aggregation=TOURNAMENT_AGGREGATION,
+            top_k=TOURNAMENT_TOP_K,
+            confidence=TOURNAMENT_CONFIDENCE,
+            min_rounds=TOURNAMENT_MIN_ROUNDS,
+            context_tokens=LLM_CONTEXT_TOKENS or None,
+            response_tokens=TOURNAMENT_RESPONSE_TOKENS,
+            should_stop=should_stop
+        )
 
-        # Определяем критерии
-        criteria = "Цена (сравнение стоимости), " + ", ".join(schema.json_schema.keys())
-        criteria += ". Также учитывай соотношение цены и характеристик (выгодность)."
+        if incremental:
+            all_rankings = incremental_tournament_ranking(
+                lots_data,
+                existing_scores,
+                criteria,
+                schema.description,
+                placement_rounds=min(TOURNAMENT_PLACEMENT_ROUNDS, num_rounds),
+                group_size=common["group_size"],
+                context_tokens=common["context_tokens"],
+                response_tokens=common["response_tokens"],
+                checkpoint=checkpoint,
+                should_stop=should_stop
+            )
+        elif TOURNAMENT_MODE == "swiss":
+            all_rankings = swiss_tournament_ranking(lots_data, criteria, schema.description, keep_ratio=TOURNAMENT_KEEP_RATIO, checkpoint=checkpoint, **common)
+        else:
+            all_rankings = classic_tournament_ranking(lots_data, criteria, schema.description, scheduling=TOURNAMENT_SCHEDULING, checkpoint=checkpoint, **common)
 
-        # Подготовим группы для каждого раунда
-        for round_num in range(num_rounds):
-            # Создаем копию списка и перемешиваем (для первого раунда можно использовать оригинальный порядок)
-            if round_num == 0:
-                current_lots = analyzed_lots
-            else:
-                current_lots = analyzed_lots.copy()
-                random.shuffle(current_lots)
-            
-            group_size = 5
-            step = group_size  # Без перекрытия
-            
-            # Разбиваем на группы
-            groups = []
-            for i in range(0, len(current_lots), step):
-                group = current_lots[i:i + group_size]
-                if len(group) >= 2:
-                    groups.append(group)
-            
-            # Подготовим данные для турнирного реранкинга
-            for group in groups:
-                group_data = []
-                for lot in group:
-                    raw_lot = self.raw_lot_repo.get_by_id(lot.raw_lot_id)
-                    group_data.append({
-                        'id': lot.id,
-                        'title': raw_lot.title if raw_lot else 'N/A',
-                        'price': raw_lot.price if raw_lot else 'N/A',
-                        'structured_data': lot.structured_data,
-                        'relevance': lot.relevance_note,
-                        'image_description_and_notes': lot.image_description_and_notes
-                    })
-                all_groups_data.append(group_data)
-
-        # Выполняем все сравнения за один проход
-        all_rankings = tournament_ranking(all_groups_data, criteria, schema.description)  # Передаем все группы сразу
+        for item in all_rankings[:TOURNAMENT_TOP_K]:
+            if 'tournament_uncertainty' in item:
+                logger.info(f"Лот {item['id']}: рейтинг {item['tournament_score']} +- {item['tournament_uncertainty']}")
 
         # Объединяем результаты
         id_to_lot_map = {lot.id: lot for lot in analyzed_lots}
@@ -286,6 +891,24 @@ class DeepSearchService:
         return ranked_lots
     
 
+    @staticmethod
+    def _tournament_criteria(schema: Schema) -> str:
+        criteria = "Цена (сравнение стоимости), " + ", ".join(schema.json_schema.keys())
+        criteria += ". Также учитывай соотношение цены и характеристик (выгодность)."
+        return criteria
+
+    def _tournament_item(self, lot: AnalyzedLot) -> dict:
+        """Данные лота для промпта турнирного сравнения"""
+        raw_lot = self.raw_lot_repo.get_by_id(lot.raw_lot_id)
+        return {
+            'id': lot.id,
+            'title': raw_lot.title if raw_lot else 'N/A',
+            'price': raw_lot.price if raw_lot else 'N/A',
+            'structured_data': lot.structured_data,
+            'relevance': lot.relevance_note,
+            'image_description_and_notes': lot.image_description_and_notes
+        }
+
     def _format_deep_search_results(self, analyzed_lots: List[AnalyzedLot], schema: Schema) -> str:
             """Форматирование результатов глубокого поиска для отправки пользователю"""
             logger.info(f"Форматируем {len(analyzed_lots)} результатов глубокого поиска")
@@ -366,7 +989,7 @@ class DeepSearchService:
         ]
 
         try:
-            response = get_completion(messages)
+            response = get_completion(messages, stage="summary")
             return response.content.strip()
         except Exception as e:
             logger.error(f"Ошибка при генерации резюме: {e}")
@@ -0,0 +1,57 @@
+import base64
+from typing import Optional
+from repositories.research_repository import ImageCaptionRepository
+from utils.image_handler import compute_file_hash
+from utils.logger import logger
+from utils.llm_client import get_completion
+
+
+CAPTION_PROMPT = """Опиши фото товара из объявления. Описание будет использоваться для разных задач поиска, поэтому перечисли все, что видно:
+- что за объект (тип товара, бренд и модель, если их можно определить);
+- цвет, материал, комплектация, коробка и аксессуары;
+- состояние: царапины, сколы, потертости, трещины, следы использования;
+- надписи и цифры на фото (шильдики, экраны, ценники);
+- фото реальное или рекламное/стоковое.
+
+Пиши кратко, фактами, без оценок и без JSON."""
+
+
+class ImageCaptionService:
+    """
+    Описание фото отдельно от извлечения по схеме.
+
+    Содержимое фото не зависит от схемы задачи, поэтому описание считается
+    один раз на изображение (ключ - хеш файла) и переиспользуется во всех
+    исследованиях. Извлечение получает текст описания вместо картинки.
+    """
+
+    def __init__(self, caption_repo: ImageCaptionRepository):
+        self.caption_repo = caption_repo
+
+    def get_caption(self, image_path: str) -> Optional[str]:
+        """
+        Описание фото из кэша или от VL-модели
+        :param image_path: путь к сохраненному изображению
+        :return: текст описания или None, если файл не читается
+        """
+        image_hash = compute_file_hash(image_path)
+        if not image_hash:
+            return None
+
+        caption = self.caption_repo.get_by_hash(image_hash)
+        if caption is not None:
+            logger.info(f"Описание фото {image_path} взято из кэша")
+            return caption
+
+        logger.info(f"Описываем фото {image_path}")
+        with open(image_path, "rb") as f:
+            img_b64 = base64.b64encode(f.read()).decode('utf-8')
+
+        messages = [
+            {"role": "system", "content": CAPTION_PROMPT},
+            {"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}}]}
+        ]
+        response = get_completion(messages, stage="caption")
+        caption = (response.content or "").strip()
+
+        return self.caption_repo.create(image_hash, caption)
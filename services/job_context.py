@@ -0,0 +1,55 @@
+from typing import Optional
+from openai import OpenAI
+from database import SessionLocal
+from repositories.research_repository import (
+    MarketResearchRepository,
+    SearchTaskRepository,
+    SchemaRepository,
+    RawLotRepository,
+    AnalyzedLotRepository,
+    ImageHashRepository,
+    TournamentMatchRepository,
+    ImageCaptionRepository
+)
+from utils.llm_client import llm_scope
+from utils.metrics import JobMetrics
+from utils.logger import logger
+
+
+class JobContext:
+    """
+    Изолированное окружение одного задания: своя сессия БД, свои репозитории,
+    LLM-клиент и метрики. Ничего не разделяется с веб-запросами и другими
+    заданиями, поэтому N заданий можно выполнять параллельно в потоках или
+    asyncio-задачах.
+
+    with JobContext("deep_search:42") as ctx:
+        DeepSearchService.from_context(ctx)...
+    """
+
+    def __init__(self, name: str, llm_client: Optional[OpenAI] = None):
+        self.name = name
+        self.db = SessionLocal()
+        self.mr_repo = MarketResearchRepository(self.db)
+        self.task_repo = SearchTaskRepository(self.db)
+        self.schema_repo = SchemaRepository(self.db)
+        self.raw_lot_repo = RawLotRepository(self.db)
+        self.analyzed_lot_repo = AnalyzedLotRepository(self.db)
+        self.image_hash_repo = ImageHashRepository(self.db)
+        self.tournament_match_repo = TournamentMatchRepository(self.db)
+        self.image_caption_repo = ImageCaptionRepository(self.db)
+        self.llm_client = llm_client
+        self.metrics = JobMetrics(name)
+        self._llm_scope = None
+
+    def __enter__(self) -> "JobContext":
+        # Вызовы get_completion внутри задания идут через клиент задания и пишут в его метрики
+        self._llm_scope = llm_scope(self.llm_client, self.metrics)
+        self._llm_scope.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._llm_scope.__exit__(exc_type, exc, tb)
+        self.db.close()
+        logger.info(f"Метрики задания: {self.metrics.summary()}")
+        return False
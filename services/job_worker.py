@@ -0,0 +1,143 @@
+import os
+import socket
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from database import SessionLocal
+from repositories.research_repository import JobRepository, SearchTaskRepository
+from models.research_models import Job
+from utils.logger import logger
+from config import JOB_POLL_INTERVAL, JOB_VISIBILITY_TIMEOUT, JOB_RETRY_BASE_DELAY, JOB_WORKER_CONCURRENCY
+
+
+JobHandler = Callable[[dict], None]
+
+# kind -> (обработчик, действие после окончательной неудачи)
+_JOB_HANDLERS: Dict[str, Tuple[JobHandler, Optional[JobHandler]]] = {}
+
+
+def register_job_handler(kind: str, on_failure: Optional[JobHandler] = None):
+    def decorator(func: JobHandler) -> JobHandler:
+        _JOB_HANDLERS[kind] = (func, on_failure)
+        return func
+    return decorator
+
+
+class JobWorker:
+    """
+    Воркер очереди заданий. Можно запускать несколько процессов одновременно:
+    задание забирается атомарно, а пока оно выполняется, воркер продлевает
+    его невидимость. Если процесс упал, задание вернется в очередь по таймауту.
+    Внутри процесса concurrency потоков выполняют задания параллельно, каждое -
+    в своем JobContext.
+    """
+
+    def __init__(
+        self,
+        worker_id: str = None,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        visibility_timeout: int = JOB_VISIBILITY_TIMEOUT,
+        concurrency: int = JOB_WORKER_CONCURRENCY
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.concurrency = concurrency
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Останов после завершения текущего задания"""
+        logger.info(f"Воркер {self.worker_id}: получен запрос на остановку")
+        self._stop.set()
+
+    def run_forever(self):
+        logger.info(f"Воркер {self.worker_id} запущен, параллельных заданий: {self.concurrency}")
+        slots = [threading.Thread(target=self._loop, name=f"{self.worker_id}#{i}") for i in range(self.concurrency)]
+        for slot in slots:
+            slot.start()
+        # Главный поток ждет с таймаутом, чтобы обработчик сигнала успевал сработать
+        while any(slot.is_alive() for slot in slots):
+            for slot in slots:
+                slot.join(timeout=1)
+        logger.info(f"Воркер {self.worker_id} остановлен")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.poll_interval)
+
+    def run_once(self) -> bool:
+        """
+        Берет и выполняет одно задание
+        :return: True, если задание было
+        """
+        db = SessionLocal()
+        try:
+            job_repo = JobRepository(db)
+            for job in job_repo.expire_abandoned():
+                logger.error(f"Задание {job.id} брошено воркером, попытки исчерпаны")
+                self._on_final_failure(job)
+
+            job = job_repo.claim(self.worker_id, self.visibility_timeout)
+            if not job:
+                return False
+
+            logger.info(f"Воркер {self.worker_id}: задание {job.id} ({job.kind}), попытка {job.attempts}/{job.max_attempts}")
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job.id, done), daemon=True)
+            heartbeat.start()
+            try:
+                handler, _ = _JOB_HANDLERS[job.kind]
+                handler(job.payload)
+                job_repo.complete(job.id)
+                logger.info(f"Задание {job.id} выполнено")
+            except Exception as e:
+                logger.exception(f"Ошибка выполнения задания {job.id}: {e}")
+                job = job_repo.fail(job.id, str(e), JOB_RETRY_BASE_DELAY)
+                if job.status == "failed":
+                    logger.error(f"Задание {job.id}: попытки исчерпаны")
+                    self._on_final_failure(job)
+                else:
+                    logger.info(f"Задание {job.id} вернется в очередь после {job.available_at}")
+            finally:
+                done.set()
+                heartbeat.join()
+            return True
+        finally:
+            db.close()
+
+    def _heartbeat(self, job_id: int, done: threading.Event):
+        """Продлевает невидимость задания, пока обработчик работает (своя сессия - другой поток)"""
+        db = SessionLocal()
+        try:
+            job_repo = JobRepository(db)
+            while not done.wait(self.visibility_timeout / 3):
+                try:
+                    job_repo.extend_lock(job_id, self.worker_id, self.visibility_timeout)
+                except Exception as e:
+                    # Временная ошибка БД (например, database is locked) не должна останавливать продление
+                    logger.warning(f"Задание {job_id}: не удалось продлить блокировку: {e}")
+                    db.rollback()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _on_final_failure(job: Job):
+        handler = _JOB_HANDLERS.get(job.kind)
+        if handler and handler[1]:
+            handler[1](job.payload)
+
+
+def _mark_deep_search_failed(payload: dict):
+    db = SessionLocal()
+    try:
+        SearchTaskRepository(db).update_status(payload["task_id"], "failed")
+    finally:
+        db.close()
+
+
+@register_job_handler("deep_search", on_failure=_mark_deep_search_failed)
+def handle_deep_search_job(payload: dict):
+    """Обработка результатов глубокого поиска (лоты от расширения)"""
+    from services.deep_search_service import DeepSearchService
+
+    DeepSearchService.run_job(payload["task_id"], payload["items"])
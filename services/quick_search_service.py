@@ -4,8 +4,10 @@ from models.research_models import MarketResearch, State, ChatMessage, RawLot
 from repositories.research_repository import (
     MarketResearchRepository,
     SearchTaskRepository,
-    RawLotRepository
+    RawLotRepository,
+    ChatSummaryRepository
 )
+from services.chat_context_service import ChatContextManager
 from utils.image_handler import save_image_from_base64
 from utils.logger import logger
 from utils.llm_client import get_completion
@@ -16,11 +18,13 @@ class QuickSearchService:
         self,
         mr_repo: MarketResearchRepository,
         task_repo: SearchTaskRepository,
-        raw_lot_repo: RawLotRepository
+        raw_lot_repo: RawLotRepository,
+        chat_summary_repo: ChatSummaryRepository
     ):
         self.mr_repo = mr_repo
         self.task_repo = task_repo
         self.raw_lot_repo = raw_lot_repo
+        self.context_manager = ChatContextManager(chat_summary_repo)
 
     def handle_quick_search_results(self, task_id: int, results: List[Dict]) -> MarketResearch:
         """Обработка результатов быстрого поиска"""
@@ -74,14 +78,6 @@ class QuickSearchService:
         # Создаем специальное сообщение от пользователя с результатами и инструкцией пересказать
         user_message_with_results = f"{result_message}\n\nПожалуйста, перескажи эти результаты в виде краткого отчета, выделив ключевые моменты."
 
-        # Подготовим историю чата для LLM (без добавления результатов в постоянную историю)
-        llm_messages = []
-        for msg in market_research.chat_history:
-            llm_messages.append({"role": msg.role, "content": msg.content})
-
-        # Добавляем сообщение с результатами как сообщение от пользователя
-        llm_messages.append({"role": "user", "content": user_message_with_results})
-
         # Добавим системный промпт для генерации отчета
         system_prompt = """Ты — интеллектуальный агент по исследованию рынка на Avito. 
 Твоя задача — **кратко и по существу** предоставить пользователю сводку по результатам поиска, обобщив найденные товары и выделив ключевые особенности.
@@ -90,10 +86,15 @@ class QuickSearchService:
 Укажи **основные** модели, **средний** ценовой диапазон и **самые важные** рекомендации. 
 Избегай избыточных деталей для каждого товара, фокусируйся на общих трендах и самых интересных вариантах."""
 
-        llm_messages.insert(0, {"role": "system", "content": system_prompt})
+        # История чата в пределах бюджета токенов, результаты - сообщением пользователя (в историю не сохраняются)
+        llm_messages = self.context_manager.build_messages(
+            market_research,
+            system_prompt,
+            extra_messages=[{"role": "user", "content": user_message_with_results}]
+        )
 
         # Выполняем вызов LLM для генерации отчета
-        response = get_completion(llm_messages)
+        response = get_completion(llm_messages, stage="quick_report")
         report_content = response.content
 
         logger.info(f"Сгенерирован отчет на основе результатов поиска: {report_content}")
@@ -10,30 +10,43 @@ from repositories.research_repository import (
     SearchTaskRepository,
     SchemaRepository,
     RawLotRepository,
-    AnalyzedLotRepository
+    AnalyzedLotRepository,
+    ImageHashRepository,
+    TournamentMatchRepository,
+    ImageCaptionRepository,
+    ChatSummaryRepository,
+    JobRepository
 )
-from database import SessionLocal
+from sqlalchemy.orm import Session
 from utils.logger import logger
+from config import JOB_MAX_ATTEMPTS
 from .chat_service import ChatService
 from .quick_search_service import QuickSearchService
 from .deep_search_service import DeepSearchService
 
 
 class MarketResearchService:
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, db: Session):
+        # Сессия принадлежит вызывающему (запросу): сервис ее не открывает и не закрывает
+        self.db = db
         self.mr_repo = MarketResearchRepository(self.db)
         self.task_repo = SearchTaskRepository(self.db)
         self.schema_repo = SchemaRepository(self.db)
         self.raw_lot_repo = RawLotRepository(self.db)
         self.analyzed_lot_repo = AnalyzedLotRepository(self.db)
+        self.image_hash_repo = ImageHashRepository(self.db)
+        self.tournament_match_repo = TournamentMatchRepository(self.db)
+        self.image_caption_repo = ImageCaptionRepository(self.db)
+        self.chat_summary_repo = ChatSummaryRepository(self.db)
+        self.job_repo = JobRepository(self.db)
 
         # Инициализируем специализированные сервисы
-        self.chat_service = ChatService(self.mr_repo)
+        self.chat_service = ChatService(self.mr_repo, self.chat_summary_repo)
         self.quick_search_service = QuickSearchService(
             self.mr_repo,
             self.task_repo,
-            self.raw_lot_repo
+            self.raw_lot_repo,
+            self.chat_summary_repo
         )
         self.deep_search_service = DeepSearchService(
             self.mr_repo,
@@ -41,6 +54,9 @@ class MarketResearchService:
             self.schema_repo,
             self.raw_lot_repo,
             self.analyzed_lot_repo,
+            self.image_hash_repo,
+            self.tournament_match_repo,
+            self.image_caption_repo,
         )
 
     def create_market_research(self, initial_query: str) -> MarketResearch:
@@ -146,6 +162,8 @@ class MarketResearchService:
                                 query=params.get('query', message), 
                                 limit=int(params.get('limit', 10)),
                                 needs_visual=bool(params.get('needs_visual', False)),
+                                time_budget_min=float(params['time_budget_min']) if params.get('time_budget_min') else None,
+                                token_budget=int(params['token_budget']) if params.get('token_budget') else None,
                                 schema_id=new_schema.id,
                                 status="pending"
                             )
@@ -176,6 +194,13 @@ class MarketResearchService:
         """Обработка результатов глубокого поиска"""
         return self.deep_search_service.handle_deep_search_results(task_id, results)
 
+    def enqueue_deep_search_results(self, task_id: int, results: List[Dict]):
+        """Постановка обработки результатов глубокого поиска в очередь (выполняет run_worker.py)"""
+        self.task_repo.update_status(task_id, "processing")
+        # Повторная отправка результатов, пока задание задачи не завершено, нового задания не создает
+        return self.job_repo.enqueue("deep_search", {"task_id": task_id, "items": results}, JOB_MAX_ATTEMPTS,
+                                     dedupe_key=f"deep_search:{task_id}")
+
     def get_market_research(self, mr_id: int) -> MarketResearch:
         """Получение исследования по ID"""
         return self.mr_repo.get_by_id(mr_id)
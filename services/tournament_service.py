@@ -1,58 +1,589 @@
 import re
-from typing import List, Dict, Any
+import math
+import time
+import random
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple, Callable
+import numpy as np
+from models.research_models import TournamentMatch
+from repositories.research_repository import TournamentMatchRepository
 from utils.logger import logger
-from utils.llm_client import get_completion
+from utils.llm_client import get_completion, parallel_capacity
+from utils.rank_aggregation import pairwise_wins, bradley_terry, top_k_stability
+from utils.group_scheduler import GroupScheduler, pack_sequential, group_is_full
+from utils.token_counter import estimate_tokens, estimate_messages_tokens
 
-def tournament_ranking(lot_groups: List[List[Dict[str, Any]]], criteria: str, context: str = "") -> List[Dict[str, Any]]:
-    logger.info(f"Начало турнира: {len(lot_groups)} групп. Контекст: {context}")
 
-    lot_stats: Dict[str, Dict[str, Any]] = {}
+def _record_match(matches: List[List[str]], ranked_group: List[Dict[str, Any]], group_idx: int):
+    """Сохраняет порядок лотов в сыгранной группе (от лучшего к худшему)"""
+    ordering = []
+    for lot in ranked_group:
+        lot_id = str(lot.get('id'))
+        if not lot_id or lot_id == "None":
+            logger.error(f"Критическая ошибка: у лота отсутствует ID в группе {group_idx}")
+            continue
+        ordering.append(lot_id)
+    matches.append(ordering)
 
-    for group_idx, group in enumerate(lot_groups):
-        logger.info(f"Обработка группы {group_idx + 1}/{len(lot_groups)}")
-        
-        ranked_group = rank_group(group, criteria, context)
-
-        n = len(ranked_group)
-        for position, lot in enumerate(ranked_group):
-            lot_id = str(lot.get('id'))
-            if not lot_id or lot_id == "None":
-                logger.error(f"Критическая ошибка: у лота отсутствует ID в группе {group_idx}")
-                continue
 
+def _borda_scores(matches: List[List[str]]) -> Dict[str, float]:
+    """Средние очки Борда за место в группе"""
+    lot_stats: Dict[str, Dict[str, int]] = {}
+    for ordering in matches:
+        n = len(ordering)
+        for position, lot_id in enumerate(ordering):
             points = n - position
 
             if lot_id not in lot_stats:
-                lot_stats[lot_id] = {"sum": 0, "count": 0, "data": lot}
-            
+                lot_stats[lot_id] = {"sum": 0, "count": 0}
+
             lot_stats[lot_id]["sum"] += points
             lot_stats[lot_id]["count"] += 1
 
+    return {lot_id: stats["sum"] / stats["count"] for lot_id, stats in lot_stats.items()}
+
+
+def _fit_bradley_terry(matches: List[List[str]], lot_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    index = {lot_id: i for i, lot_id in enumerate(lot_ids)}
+    wins = pairwise_wins([[index[lot_id] for lot_id in ordering] for ordering in matches], len(lot_ids))
+    return bradley_terry(wins)
+
+
+def _aggregate(matches: List[List[str]], lot_ids: List[str], aggregation: str) -> Dict[str, Tuple[float, Optional[float]]]:
+    """
+    Итоговая оценка лотов по всем сыгранным группам
+    :param aggregation: "borda" - средние очки за место, "bradley_terry" - вероятностная модель
+    :return: lot_id -> (оценка, неопределенность или None)
+    """
+    if aggregation == "bradley_terry":
+        theta, cov = _fit_bradley_terry(matches, lot_ids)
+        se = np.sqrt(np.diag(cov))
+        # Оценка - вероятность обыграть "среднего" лота, неопределенность - стандартная ошибка theta
+        return {
+            lot_id: (float(1 / (1 + np.exp(-theta[i]))), float(se[i]))
+            for i, lot_id in enumerate(lot_ids)
+        }
+
+    return {lot_id: (score, None) for lot_id, score in _borda_scores(matches).items()}
+
+
+def _top_k_is_stable(matches: List[List[str]], lot_ids: List[str], contender_ids: List[str], top_k: int, confidence: float) -> bool:
+    """Правило остановки: состав и порядок топ-K среди претендентов подтверждены с заданной уверенностью"""
+    theta, cov = _fit_bradley_terry(matches, lot_ids)
+    index = {lot_id: i for i, lot_id in enumerate(lot_ids)}
+    idx = [index[lot_id] for lot_id in contender_ids]
+    stability = top_k_stability(theta[idx], cov[np.ix_(idx, idx)], top_k)
+    logger.info(f"Устойчивость топ-{top_k}: {stability:.3f} (нужно {confidence})")
+    return stability >= confidence
+
+
+def _finalize(lots: List[Dict[str, Any]], scores: Dict[str, Tuple[float, Optional[float]]]) -> List[Dict[str, Any]]:
     final_list = []
-    for lot_id, stats in lot_stats.items():
-        avg_score = stats["sum"] / stats["count"]
-        lot_data = stats["data"]
-        lot_data["tournament_score"] = round(avg_score, 2)
-        final_list.append(lot_data)
-
-    sorted_result = sorted(final_list, key=lambda x: x["tournament_score"], reverse=True)
-    
-    logger.info(f"Турнир завершен. Отранжировано {len(sorted_result)} уникальных лотов")
+    for lot in lots:
+        lot_id = str(lot['id'])
+        if lot_id not in scores:
+            continue
+        score, uncertainty = scores[lot_id]
+        lot["tournament_score"] = round(score, 4)
+        if uncertainty is not None:
+            lot["tournament_uncertainty"] = round(uncertainty, 4)
+        final_list.append(lot)
+
+    return sorted(final_list, key=lambda x: x["tournament_score"], reverse=True)
+
+
+class TournamentCheckpoint:
+    """
+    Персистентный журнал групп турнира одной задачи (таблица tournament_matches).
+
+    Группы раунда сохраняются до начала игры, результат каждой группы -
+    сразу после ответа LLM. При перезапуске уже сыгранные группы берутся из
+    журнала, недоигранный раунд доигрывается в том же составе.
+    Номера раундов для турнира отсчитываются от base (см. skip_stale_rounds).
+    """
+
+    def __init__(self, match_repo: TournamentMatchRepository, task_id: int):
+        self.match_repo = match_repo
+        self.task_id = task_id
+        self.base = 0
+        self.rounds: Dict[int, List[TournamentMatch]] = {}
+        for match in match_repo.get_by_task_id(task_id):
+            self.rounds.setdefault(match.round_num, []).append(match)
+        if self.rounds:
+            played = sum(1 for matches in self.rounds.values() for m in matches if m.ranked_ids is not None)
+            logger.info(f"Чекпоинт турнира задачи {task_id}: {len(self.rounds)} раундов, {played} сыгранных групп")
+
+    def round_matches(self, round_num: int) -> List[TournamentMatch]:
+        return self.rounds.get(self.base + round_num, [])
+
+    def round_numbers(self) -> List[int]:
+        return [r - self.base for r in sorted(self.rounds) if r >= self.base]
+
+    def plan_round(self, round_num: int, groups: List[List[str]]) -> List[TournamentMatch]:
+        self.rounds[self.base + round_num] = self.match_repo.create_round(self.task_id, self.base + round_num, groups)
+        return self.rounds[self.base + round_num]
+
+    def add_group(self, round_num: int, member_ids: List[str]) -> TournamentMatch:
+        """Дописывает в раунд еще одну группу (ранний раунд планируется по одной группе)"""
+        matches = self.rounds.setdefault(self.base + round_num, [])
+        match = self.match_repo.create_round(self.task_id, self.base + round_num, [member_ids], first_group_idx=len(matches))[0]
+        matches.append(match)
+        return match
+
+    def _covers(self, round_num: int, lot_ids: List[str]) -> bool:
+        members = {lot_id for match in self.rounds.get(round_num, []) for lot_id in match.member_ids}
+        return set(lot_ids) <= members
+
+    def skip_stale_rounds(self, lot_ids: List[str]):
+        """
+        Раунды, запланированные до появления части лотов (дозагрузка страниц),
+        не знают о новых лотах - их переигровка оставила бы новые лоты без оценки.
+        Турнир начинается с раунда, который покрывает всех участников и которому
+        предшествует непокрывающий (то есть с начала уже перезапущенного турнира),
+        а если такого нет - заново после последнего раунда. Старые группы остаются
+        в журнале (история задержек), но в оценку не входят.
+        """
+        numbers = sorted(self.rounds)
+        if not numbers:
+            return
+        starts = [r for r in numbers if self._covers(r, lot_ids) and (r == numbers[0] or not self._covers(r - 1, lot_ids))]
+        self.base = starts[-1] if starts else numbers[-1] + 1
+        if self.base > numbers[0]:
+            logger.info(f"Чекпоинт турнира задачи {self.task_id}: раунды до {self.base + 1} не покрывают новые лоты, турнир идет с раунда {self.base + 1}")
+
+    def complete(self, match: TournamentMatch, ranked_ids: List[str], latency_ms: float):
+        match.ranked_ids = ranked_ids
+        match.latency_ms = latency_ms
+        self.match_repo.complete(match.id, ranked_ids, latency_ms)
+
+
+class EarlyRound:
+    """
+    Первый раунд турнира, который играется, пока еще идет извлечение.
+
+    Лоты поступают по одному; как только набирается группа (group_size лотов
+    или исчерпан бюджет токенов - как в pack_sequential), она сразу уходит в
+    rank_group. Каждая группа записывается в чекпоинт первым раундом до вызова
+    LLM, результат - сразу после ответа, поэтому при падении задания сыгранные
+    группы не теряются: повторная попытка пропускает уже распределенные лоты,
+    а обычный турнир восстанавливает раунд из чекпоинта (несыгранные группы
+    доигрывает) и продолжает со второго.
+    allow() проверяется перед каждой группой: False - ранний раунд прекращается.
+    Раунд, не покрывший всех лотов, турнир считает устаревшим (skip_stale_rounds)
+    и начинает заново.
+    """
+
+    def __init__(
+        self,
+        criteria: str,
+        checkpoint: TournamentCheckpoint,
+        context: str = "",
+        group_size: int = 5,
+        context_tokens: Optional[int] = None,
+        response_tokens: int = 1500,
+        allow: Optional[Callable[[], bool]] = None
+    ):
+        self.criteria = criteria
+        self.checkpoint = checkpoint
+        self.allow = allow
+        self.stopped = False
+        self.context = context
+        self.group_size = group_size
+        self.token_budget = group_token_budget(criteria, context, context_tokens, response_tokens) if context_tokens else None
+        self.pending: List[Dict[str, Any]] = []
+        self.pending_tokens = 0
+        self.last_group: List[Dict[str, Any]] = []
+        self.played = 0
+        # Лоты, уже распределенные по группам в прошлой попытке
+        self.assigned = {lot_id for match in checkpoint.round_matches(0) for lot_id in match.member_ids}
+        if self.assigned:
+            logger.info(f"Ранний раунд продолжается: {len(checkpoint.round_matches(0))} групп уже в чекпоинте")
+
+    def add(self, lot: Dict[str, Any]):
+        if str(lot['id']) in self.assigned:
+            return
+        tokens = item_token_estimates([lot])[0]
+        if group_is_full(len(self.pending), self.pending_tokens, tokens, self.group_size, self.token_budget):
+            self._play()
+        self.pending.append(lot)
+        self.pending_tokens += tokens
+        if len(self.pending) >= self.group_size:
+            self._play()
+
+    def finish(self):
+        """Доигрывает неполную группу. Оставшийся одиночка играет в паре с лотом из последней группы"""
+        if len(self.pending) == 1 and self.last_group:
+            self.pending.insert(0, self.last_group[len(self.last_group) // 2])
+        if len(self.pending) >= 2:
+            self._play()
+        logger.info(f"Ранний раунд турнира: сыграно {self.played} групп")
+
+    def _play(self):
+        group, self.pending, self.pending_tokens = self.pending, [], 0
+        if self.stopped:
+            return
+        if self.allow and not self.allow():
+            self.stopped = True
+            logger.info(f"Ранний раунд турнира прекращен после {self.played} групп: турнир не помещается в бюджет")
+            return
+        self.last_group = group
+        match = self.checkpoint.add_group(0, [str(lot['id']) for lot in group])
+        started = time.time()
+        matches: List[List[str]] = []
+        try:
+            _record_match(matches, rank_group(group, self.criteria, self.context), match.group_idx)
+        except Exception as e:
+            # Группа остается в чекпоинте несыгранной: обычный турнир переиграет ее
+            logger.error(f"Ранняя группа {match.group_idx + 1} не сыграна: {e}")
+            return
+        latency_ms = (time.time() - started) * 1000
+        self.checkpoint.complete(match, matches[0], latency_ms)
+        self.played += 1
+        logger.info(f"Ранняя группа {match.group_idx + 1} ({len(group)} лотов): {latency_ms:.0f} мс")
+
+
+def _out_of_budget(should_stop: Optional[Callable[[int], bool]], round_num: int, checkpoint: Optional[TournamentCheckpoint]) -> bool:
+    """Проверка бюджета перед раундом. Раунд, уже запланированный в чекпоинте, доигрывается всегда"""
+    if not should_stop or round_num == 0:
+        return False
+    if checkpoint and checkpoint.round_matches(round_num):
+        return False
+    return should_stop(round_num)
+
+
+def _play_round(
+    round_num: int,
+    plan: Callable[[], List[List[str]]],
+    lots_by_id: Dict[str, Dict[str, Any]],
+    criteria: str,
+    context: str,
+    matches: List[List[str]],
+    checkpoint: Optional[TournamentCheckpoint]
+) -> List[List[str]]:
+    """
+    Играет один раунд: группы берутся из чекпоинта, если раунд уже был
+    запланирован, иначе из plan(). Сыгранные группы не переигрываются.
+    :return: составы групп раунда (id лотов)
+    """
+    stored = checkpoint.round_matches(round_num) if checkpoint else []
+    if stored:
+        # Лоты могли исчезнуть из задачи (например, стали дубликатами) - играем только известных
+        groups = [[lot_id for lot_id in match.member_ids if lot_id in lots_by_id] for match in stored]
+        logger.info(f"Раунд {round_num + 1} восстановлен из чекпоинта: {len(groups)} групп")
+    else:
+        groups = plan()
+        stored = checkpoint.plan_round(round_num, groups) if checkpoint else [None] * len(groups)
+
+    to_play = []
+    for group_idx, (group, match) in enumerate(zip(groups, stored)):
+        if len(group) < 2:
+            continue
+        if match and match.ranked_ids is not None:
+            matches.append([lot_id for lot_id in match.ranked_ids if lot_id in lots_by_id])
+            continue
+        to_play.append((group_idx, group, match))
+
+    def play(group: List[str]) -> Tuple[List[Dict[str, Any]], float]:
+        started = time.time()
+        ranked = rank_group([lots_by_id[lot_id] for lot_id in group], criteria, context)
+        return ranked, (time.time() - started) * 1000
+
+    # Группы раунда независимы: при нескольких LLM-серверах играются параллельно.
+    # Результаты пишутся в чекпоинт из этого потока (сессия БД не потокобезопасна)
+    workers = max(1, min(parallel_capacity("rank_group"), len(to_play)))
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(contextvars.copy_context().run, play, group): (group_idx, match) for group_idx, group, match in to_play}
+        for future in as_completed(futures):
+            group_idx, match = futures[future]
+            try:
+                ranked, latency_ms = future.result()
+            except Exception as e:
+                # Группа остается в чекпоинте несыгранной и переиграется при повторе задания
+                logger.error(f"Группа {group_idx + 1}/{len(groups)} раунда {round_num + 1} не сыграна: {e}")
+                errors.append(e)
+                continue
+            _record_match(matches, ranked, len(matches))
+            if match:
+                checkpoint.complete(match, matches[-1], latency_ms)
+            logger.info(f"Группа {group_idx + 1}/{len(groups)} раунда {round_num + 1}: {latency_ms:.0f} мс")
+
+    if errors:
+        # Остальные группы раунда уже записаны; турнир без части групп дал бы неполные оценки
+        raise RuntimeError(f"Раунд {round_num + 1}: не сыграно {len(errors)} групп из-за ошибок LLM") from errors[0]
+    return [group for group in groups if len(group) >= 2]
+
+
+def classic_tournament_ranking(
+    lots: List[Dict[str, Any]],
+    criteria: str,
+    context: str = "",
+    num_rounds: int = 4,
+    group_size: int = 5,
+    aggregation: str = "borda",
+    top_k: int = 10,
+    confidence: Optional[float] = None,
+    min_rounds: int = 2,
+    scheduling: str = "balanced",
+    context_tokens: Optional[int] = None,
+    response_tokens: int = 1500,
+    checkpoint: Optional[TournamentCheckpoint] = None,
+    should_stop: Optional[Callable[[int], bool]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Классический турнир: в каждом раунде все лоты делятся на группы.
+
+    scheduling="balanced" - группы собираются из пар, которые еще не встречались
+    (GroupScheduler), "random" - случайное перемешивание.
+    Если задан context_tokens, group_size - лишь максимум: в группу берется
+    столько лотов, сколько помещается в контекст модели за вычетом ответа.
+    num_rounds - максимум раундов. При aggregation="bradley_terry" и заданном
+    confidence турнир останавливается раньше, как только состав и порядок топ-K устойчивы.
+    С checkpoint турнир продолжается с места остановки.
+    should_stop(round_num) перед каждым следующим раундом решает, не пора ли
+    закончить (например, кончается бюджет времени).
+    """
+    logger.info(f"Начало турнира: {len(lots)} лотов, до {num_rounds} раундов, агрегация {aggregation}. Контекст: {context}")
+
+    matches: List[List[str]] = []
+    lot_ids = [str(lot['id']) for lot in lots]
+    lots_by_id = dict(zip(lot_ids, lots))
+    index = {lot_id: i for i, lot_id in enumerate(lot_ids)}
+
+    scheduler = GroupScheduler(len(lots))
+    token_budget = group_token_budget(criteria, context, context_tokens, response_tokens) if context_tokens else None
+    item_tokens = item_token_estimates(lots)
+
+    for round_num in range(num_rounds):
+        if _out_of_budget(should_stop, round_num, checkpoint):
+            break
+
+        def plan() -> List[List[str]]:
+            if scheduling == "balanced":
+                index_groups = scheduler.next_round(list(range(len(lots))), group_size, item_tokens, token_budget)
+            else:
+                # Перемешиваем (для первого раунда используем исходный порядок)
+                order = list(range(len(lots)))
+                if round_num > 0:
+                    random.shuffle(order)
+                if token_budget:
+                    index_groups = pack_sequential(order, group_size, item_tokens, token_budget)
+                else:
+                    index_groups = [order[i:i + group_size] for i in range(0, len(order), group_size)]
+                    index_groups = [group for group in index_groups if len(group) >= 2]
+            return [[lot_ids[i] for i in group] for group in index_groups]
+
+        groups = _play_round(round_num, plan, lots_by_id, criteria, context, matches, checkpoint)
+        for group in groups:
+            scheduler.record([index[lot_id] for lot_id in group])
+        logger.info(f"Раунд {round_num + 1}: {len(groups)} групп. Сравнено различных пар: {scheduler.distinct_pairs()}")
+
+        if (aggregation == "bradley_terry" and confidence and round_num + 1 >= min_rounds
+                and round_num < num_rounds - 1
+                and _top_k_is_stable(matches, lot_ids, lot_ids, top_k, confidence)):
+            logger.info(f"Ранняя остановка турнира после раунда {round_num + 1}")
+            break
+
+    sorted_result = _finalize(lots, _aggregate(matches, lot_ids, aggregation))
+
+    logger.info(f"Турнир завершен. {len(matches)} групп, отранжировано {len(sorted_result)} лотов")
     return sorted_result
 
 
-def rank_group(group: List[Dict[str, Any]], criteria: str, context: str = "") -> List[Dict[str, Any]]:
+def swiss_tournament_ranking(
+    lots: List[Dict[str, Any]],
+    criteria: str,
+    context: str = "",
+    num_rounds: int = 4,
+    group_size: int = 5,
+    top_k: int = 10,
+    keep_ratio: float = 0.5,
+    aggregation: str = "borda",
+    confidence: Optional[float] = None,
+    min_rounds: int = 2,
+    context_tokens: Optional[int] = None,
+    response_tokens: int = 1500,
+    checkpoint: Optional[TournamentCheckpoint] = None,
+    should_stop: Optional[Callable[[int], bool]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Швейцарская система с отсевом (successive halving).
+
+    После каждого раунда лоты сортируются по текущей оценке, нижняя часть
+    выбывает (но в игре всегда остается не меньше 2 * top_k), а оставшиеся
+    группируются с соседями по рейтингу. Так вызовы LLM тратятся на
+    претендентов в топ-K, а не на заведомо слабые лоты.
+
+    Размер групп, checkpoint и should_stop - как в classic_tournament_ranking.
+
+    Итоговый рейтинг: stage + нормированная оценка в (0, 1), где stage - число
+    пройденных отсевов. Лот, прошедший больше отсевов, всегда выше выбывшего.
+    """
+    logger.info(f"Начало швейцарского турнира: {len(lots)} лотов, до {num_rounds} раундов, топ-{top_k}, агрегация {aggregation}. Контекст: {context}")
+
+    matches: List[List[str]] = []
+    lot_ids = [str(lot['id']) for lot in lots]
+    lots_by_id = dict(zip(lot_ids, lots))
+    stage: Dict[str, int] = {lot_id: 0 for lot_id in lot_ids}
+    contenders = list(lot_ids)
+    token_budget = group_token_budget(criteria, context, context_tokens, response_tokens) if context_tokens else None
+    item_tokens = dict(zip(lot_ids, item_token_estimates(lots)))
+
+    for round_num in range(num_rounds):
+        if _out_of_budget(should_stop, round_num, checkpoint):
+            break
+
+        def plan() -> List[List[str]]:
+            # Группируем соседей по текущему рейтингу (в первом раунде - исходный порядок)
+            positions = pack_sequential(list(range(len(contenders))), group_size,
+                                        [item_tokens[lot_id] for lot_id in contenders], token_budget)
+            return [[contenders[i] for i in group] for group in positions]
+
+        groups = _play_round(round_num, plan, lots_by_id, criteria, context, matches, checkpoint)
+        logger.info(f"Раунд {round_num + 1}: {len(contenders)} претендентов, {len(groups)} групп")
+
+        scores = _aggregate(matches, lot_ids, aggregation)
+        contenders.sort(key=lambda lot_id: scores.get(lot_id, (0.0, None))[0], reverse=True)
+
+        if round_num == num_rounds - 1:
+            break
+
+        if (aggregation == "bradley_terry" and confidence and round_num + 1 >= min_rounds
+                and _top_k_is_stable(matches, lot_ids, contenders, top_k, confidence)):
+            logger.info(f"Ранняя остановка швейцарского турнира после раунда {round_num + 1}")
+            break
+
+        keep = max(2 * top_k, math.ceil(len(contenders) * keep_ratio))
+        if keep < len(contenders):
+            logger.info(f"Отсев после раунда {round_num + 1}: выбывают {len(contenders) - keep} лотов")
+            contenders = contenders[:keep]
+        for lot_id in contenders:
+            stage[lot_id] += 1
+
+    scores = _aggregate(matches, lot_ids, aggregation)
+    if aggregation == "borda":
+        # Средние очки Борда не больше group_size
+        scores = {lot_id: (score / (group_size + 1), unc) for lot_id, (score, unc) in scores.items()}
+    scores = {lot_id: (stage[lot_id] + score, unc) for lot_id, (score, unc) in scores.items()}
+
+    sorted_result = _finalize(lots, scores)
+
+    logger.info(f"Швейцарский турнир завершен. {len(matches)} групп, отранжировано {len(sorted_result)} лотов")
+    return sorted_result
+
+
+def incremental_tournament_ranking(
+    lots: List[Dict[str, Any]],
+    existing_scores: Dict[str, float],
+    criteria: str,
+    context: str = "",
+    placement_rounds: int = 2,
+    group_size: int = 5,
+    context_tokens: Optional[int] = None,
+    response_tokens: int = 1500,
+    checkpoint: Optional[TournamentCheckpoint] = None,
+    should_stop: Optional[Callable[[int], bool]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Доигрывание завершенного турнира для новых лотов без переигровки старых групп.
+
+    Новые лоты играют установочные группы против "якорей" из текущего рейтинга:
+    в первом раунде якоря равномерно покрывают квантили рейтинга, в следующих -
+    окно сужается вокруг оценки позиции новых лотов. Позиция оценивается
+    моделью Брэдли-Терри по всем сыгранным группам (старым и установочным),
+    а рейтинг нового лота - квантильным отображением его силы на шкалу
+    существующих оценок. Оценки старых лотов не меняются.
+    should_stop - как в classic_tournament_ranking.
+    :param existing_scores: lot_id -> текущий tournament_score уже отранжированных лотов
+    """
+    lot_ids = [str(lot['id']) for lot in lots]
+    lots_by_id = dict(zip(lot_ids, lots))
+    existing_ids = sorted([lot_id for lot_id in lot_ids if lot_id in existing_scores], key=lambda lot_id: existing_scores[lot_id], reverse=True)
+    new_ids = [lot_id for lot_id in lot_ids if lot_id not in existing_scores]
+    logger.info(f"Инкрементальный турнир: {len(new_ids)} новых лотов против {len(existing_ids)} отранжированных. Контекст: {context}")
+
+    # Установочные раунды - те, где играют новые лоты (могли быть начаты до перезапуска)
+    matches: List[List[str]] = []
+    first_round = 0
+    if checkpoint:
+        new_set = set(new_ids)
+        placement = [r for r in checkpoint.round_numbers() if any(new_set & set(m.member_ids) for m in checkpoint.round_matches(r))]
+        first_round = placement[0] if placement else (max(checkpoint.round_numbers(), default=-1) + 1)
+        for round_num in checkpoint.round_numbers():
+            if round_num < first_round:
+                for match in checkpoint.round_matches(round_num):
+                    if match.ranked_ids is not None:
+                        matches.append([lot_id for lot_id in match.ranked_ids if lot_id in lots_by_id])
+
+    token_budget = group_token_budget(criteria, context, context_tokens, response_tokens) if context_tokens else None
+    item_tokens = dict(zip(lot_ids, item_token_estimates(lots)))
+
+    new_per_group = max(1, group_size // 2)
+    anchors_per_group = group_size - new_per_group
+    # Оценка позиции нового лота: доля отранжированных лотов сильнее него (0 - лидер)
+    position = {lot_id: 0.5 for lot_id in new_ids}
+
+    for r in range(placement_rounds):
+        if r > 0 and _out_of_budget(should_stop, first_round + r, checkpoint):
+            break
+
+        def plan() -> List[List[str]]:
+            groups = []
+            ordered_new = sorted(new_ids, key=lambda lot_id: position[lot_id])
+            for i in range(0, len(ordered_new), new_per_group):
+                chunk = ordered_new[i:i + new_per_group]
+                center = sum(position[lot_id] for lot_id in chunk) / len(chunk)
+                spread = 0.5 ** r
+                quantiles = np.clip(np.linspace(center - spread / 2, center + spread / 2, anchors_per_group), 0, 1)
+                anchors = list(dict.fromkeys(existing_ids[int(round(q * (len(existing_ids) - 1)))] for q in quantiles))
+
+                # Не выходим за контекст: лишние якоря отбрасываем, хотя бы один остается
+                while token_budget and len(anchors) > 1 and sum(item_tokens[lot_id] for lot_id in chunk + anchors) > token_budget:
+                    anchors.pop()
+                groups.append(chunk + anchors)
+            return groups
+
+        _play_round(first_round + r, plan, lots_by_id, criteria, context, matches, checkpoint)
+
+        theta, _ = _fit_bradley_terry(matches, lot_ids)
+        theta_by_id = dict(zip(lot_ids, theta))
+        existing_theta = np.array([theta_by_id[lot_id] for lot_id in existing_ids])
+        for lot_id in new_ids:
+            position[lot_id] = float(np.mean(existing_theta > theta_by_id[lot_id]))
+        logger.info(f"Установочный раунд {r + 1}: позиции новых лотов {[round(position[lot_id], 2) for lot_id in new_ids]}")
+
+    # Квантильное отображение силы новых лотов на шкалу существующих оценок
+    theta, _ = _fit_bradley_terry(matches, lot_ids)
+    theta_by_id = dict(zip(lot_ids, theta))
+    existing_theta = np.array([theta_by_id[lot_id] for lot_id in existing_ids])
+    scores = {lot_id: (existing_scores[lot_id], None) for lot_id in existing_ids}
+    sorted_theta = np.sort(existing_theta)
+    sorted_scores = np.sort([existing_scores[lot_id] for lot_id in existing_ids])
+    for lot_id in new_ids:
+        scores[lot_id] = (float(np.interp(theta_by_id[lot_id], sorted_theta, sorted_scores)), None)
+
+    sorted_result = _finalize(lots, scores)
+
+    logger.info(f"Инкрементальный турнир завершен. {len(matches)} групп, отранжировано {len(sorted_result)} лотов")
+    return sorted_result
+
+
+def _format_item(local_id: int, item: Dict[str, Any]) -> str:
+    return (
+        f"Local ID: {local_id}\n"
+        f"Title: {item.get('title')}\n"
+        f"Price: {item.get('price')}\n"
+        f"Characteristics: {item.get('structured_data')}\n"
+        f"Visual analysis: {item.get('image_description_and_notes')}\n"
+        f"Relevance: {item.get('relevance')}\n"
+    )
+
+
+def _build_rank_messages(group: List[Dict[str, Any]], criteria: str, context: str = "") -> List[Dict[str, str]]:
     items_description = []
     for i, item in enumerate(group):
-        desc = (
-            f"Local ID: {i+1}\n"
-            f"Title: {item.get('title')}\n"
-            f"Price: {item.get('price')}\n"
-            f"Characteristics: {item.get('structured_data')}\n"
-            f"Visual analysis: {item.get('image_description_and_notes')}\n"
-            f"Relevance: {item.get('relevance')}\n"
-        )
-        items_description.append(desc)
+        items_description.append(_format_item(i + 1, item))
 
     full_items_text = "\n---\n".join(items_description)
 
@@ -77,13 +608,31 @@ Reasoning:
 RANKING: 1, 3, 2
 """
 
-    messages = [
+    return [
         {"role": "system", "content": "You provide expert market analysis. Always use the RANKING: marker at the end."},
         {"role": "user", "content": prompt}
     ]
 
+
+def group_token_budget(criteria: str, context: str, context_tokens: int, response_tokens: int) -> int:
+    """Сколько токенов остается на описания лотов в одном промпте rank_group"""
+    template_tokens = estimate_messages_tokens(_build_rank_messages([], criteria, context))
+    budget = context_tokens - response_tokens - template_tokens
+    logger.info(f"Бюджет токенов на лоты в группе: {budget} (контекст {context_tokens}, ответ {response_tokens}, шаблон {template_tokens})")
+    return budget
+
+
+def item_token_estimates(lots: List[Dict[str, Any]]) -> List[int]:
+    """Оценка токенов каждого лота в промпте (с разделителем между лотами)"""
+    return [estimate_tokens(_format_item(99, lot) + "\n---\n") for lot in lots]
+
+
+def rank_group(group: List[Dict[str, Any]], criteria: str, context: str = "") -> List[Dict[str, Any]]:
+    messages = _build_rank_messages(group, criteria, context)
+    prompt = messages[1]["content"]
+
     try:
-        response = get_completion(messages)
+        response = get_completion(messages, stage="rank_group")
         content = response.content.strip()
         
         logger.info(f"Промпт для группы:\n{prompt}")
@@ -117,5 +666,6 @@ RANKING: 1, 3, 2
         return ranked_items
 
     except Exception as e:
+        # Порядок "как пришли" нельзя выдавать за результат: он попал бы в чекпоинт как сыгранная группа
         logger.error(f"Ошибка в rank_group: {e}", exc_info=True)
-        return group
\ No newline at end of file
+        raise
\ No newline at end of file
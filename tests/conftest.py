@@ -0,0 +1,22 @@
+import os
+import sys
+
+# Тесты запускаются из корня проекта или из tests/ - модули проекта импортируются от корня
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """
+    Фабрика сессий на чистой БД (у каждого теста своя). БД в файле, а не в памяти:
+    сессии получают разные соединения и видят записи друг друга, как воркеры
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
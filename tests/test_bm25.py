@@ -0,0 +1,39 @@
+from utils.bm25 import BM25, stem, tokenize, weighted_query
+
+
+def test_tokenize_stems_and_splits_units():
+    assert tokenize("Ноутбуки для игр") == ["ноутбук", "игр"]
+    assert tokenize("SSD 2Tb") == ["ssd", "2", "tb"]
+    # Кириллические единицы приводятся к латинским
+    assert tokenize("256 ГБ") == tokenize("256 gb")
+
+
+def test_stem_keeps_short_and_latin_words():
+    assert stem("ноутбука") == "ноутбук"
+    assert stem("игра") == stem("игры") == "игр"
+    # Основа не короче 3 букв
+    assert stem("яма") == "яма"
+    assert stem("iphone") == "iphone"
+
+
+def test_relevant_document_scores_higher():
+    docs = [
+        tokenize("Ноутбук Lenovo ThinkPad 16 ГБ"),
+        tokenize("Чехол для телефона"),
+        tokenize("Ноутбук ASUS игровой ноутбук"),
+    ]
+    scores = BM25(docs).scores(weighted_query([("ноутбук", 1.0)]))
+    assert scores[1] == 0.0
+    assert scores[0] > 0 and scores[2] > 0
+    # Повтор термина повышает оценку
+    assert scores[2] > scores[0]
+
+
+def test_weighted_query_keeps_max_weight():
+    weights = weighted_query([("ноутбук lenovo", 1.0), ("ноутбук для работы", 0.25)])
+    assert weights["ноутбук"] == 1.0
+    assert weights["работ"] == 0.25
+
+
+def test_empty_collection():
+    assert BM25([]).scores({"ноутбук": 1.0}) == []
@@ -0,0 +1,37 @@
+from services import budget_planner
+from services.budget_planner import BudgetPlanner
+from utils.metrics import JobMetrics
+
+
+def make_planner(**kwargs):
+    # Задержка группы = 1 с на лот, без постоянной части
+    return BudgetPlanner(JobMetrics("test"), rank_latency=(0.0, 1.0), group_size=5, max_group_size=8, **kwargs)
+
+
+def test_round_cost_follows_balanced_groups(monkeypatch):
+    monkeypatch.setattr(budget_planner, "TOURNAMENT_RESPONSE_TOKENS", 100)
+    monkeypatch.setattr(budget_planner, "RANK_LOT_TOKENS", 10)
+    planner = make_planner()
+    # 11 лотов по 5 -> группы [4, 4, 3]: 11 лотов в промптах, а не 3 полные группы по 5
+    assert planner._round_cost(11, 5) == (11.0, 3 * 100 + 11 * 10)
+    # Одиночка не играет
+    assert planner._round_cost(1, 5) == (0.0, 0.0)
+
+
+def test_round_cost_counts_token_packing(monkeypatch):
+    monkeypatch.setattr(budget_planner, "TOURNAMENT_RESPONSE_TOKENS", 100)
+    planner = make_planner()
+    # Длинные описания: в группу влезает только по два лота
+    item_tokens = [400] * 8
+    seconds, tokens = planner._round_cost(8, 5, item_tokens, token_budget=800)
+    assert seconds == 8.0
+    assert tokens == 4 * 100 + sum(item_tokens)
+
+
+def test_tournament_plan_uses_actual_groups():
+    # Раунд 21 лота стоит 21 с при любом размере групп - два раунда помещаются уже с группами по 5
+    # (по числу полных групп вышло бы 5 * 5 = 25 с на раунд)
+    planner = make_planner(time_budget_s=45)
+    planner._summary_cost = lambda: (0.0, 0.0)
+    rounds, size = planner.tournament_plan(21)
+    assert rounds == 2 and size == 5
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+from models.research_models import MarketResearch, ChatMessage
+from repositories.research_repository import ChatSummaryRepository
+from services import chat_context_service
+from services.chat_context_service import ChatContextManager
+
+
+def make_manager(monkeypatch, session_factory, calls, max_tokens=1000):
+    def get_completion(messages, stage=None):
+        calls.append(messages)
+        return SimpleNamespace(content="краткое содержание")
+
+    monkeypatch.setattr(chat_context_service, "get_completion", get_completion)
+    return ChatContextManager(ChatSummaryRepository(session_factory()), max_tokens=max_tokens)
+
+
+def research(n_messages):
+    history = [
+        ChatMessage(role="user" if i % 2 == 0 else "assistant", content=f"сообщение номер {i} про ноутбук " * 5)
+        for i in range(n_messages)
+    ]
+    return MarketResearch(id=1, chat_history=history)
+
+
+def test_short_history_is_sent_as_is(monkeypatch, session_factory):
+    calls = []
+    manager = make_manager(monkeypatch, session_factory, calls)
+    messages = manager.build_messages(research(4), "системный промпт")
+    assert len(messages) == 5
+    assert calls == []
+
+
+def test_large_extra_messages_keep_recent_history(monkeypatch, session_factory):
+    calls = []
+    manager = make_manager(monkeypatch, session_factory, calls)
+    # Результаты поиска больше всего бюджета чата
+    extra = [{"role": "user", "content": "лот " * 2000}]
+
+    messages = manager.build_messages(research(10), "системный промпт", extra)
+    history = messages[1:-1]
+    # Под историю остается минимальная доля бюджета, а не только последнее сообщение
+    assert len(history) > 1
+    assert len(calls) == 1
+
+    # Следующий ход с тем же объемом результатов не сворачивает историю заново
+    mr = research(11)
+    manager.build_messages(mr, "системный промпт", extra)
+    assert len(calls) == 1
+
+
+def test_summary_is_rebuilt_when_history_is_rewritten(monkeypatch, session_factory):
+    calls = []
+    manager = make_manager(monkeypatch, session_factory, calls, max_tokens=300)
+    mr = research(12)
+    manager.build_messages(mr, "системный промпт")
+    first_calls = len(calls)
+    assert first_calls > 0 and manager.summary_repo.get_by_research_id(1).covered_messages > 0
+
+    # Начало диалога переписано: старое содержание к новой истории не относится
+    mr.chat_history[0] = ChatMessage(role="user", content="совсем другой вопрос про телефон " * 5)
+    manager.build_messages(mr, "системный промпт")
+    assert len(calls) > first_calls
+    assert "совсем другой вопрос" in calls[first_calls][1]["content"]
+    assert "(пусто)" in calls[first_calls][1]["content"]
+
+    # История укорочена - содержание тоже строится заново, а не обрезается по позиции
+    mr = research(3)
+    messages = manager.build_messages(mr, "системный промпт")
+    assert "КРАТКОЕ СОДЕРЖАНИЕ" not in messages[0]["content"]
+    assert len(messages) == 4
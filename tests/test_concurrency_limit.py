@@ -0,0 +1,46 @@
+from utils.concurrency_limit import GradientLimit
+
+
+def test_limit_grows_while_latency_is_flat():
+    limit = GradientLimit(1, max_limit=4)
+    for _ in range(50):
+        limit.on_sample(1.0, 100, inflight=int(limit.limit))
+    assert limit.limit == 4
+
+
+def test_limit_shrinks_when_queue_builds_up():
+    limit = GradientLimit(4, max_limit=4)
+    for _ in range(5):
+        limit.on_sample(1.0, 100, inflight=4)
+    # Задержка на токен выросла в 4 раза - на сервере очередь
+    for _ in range(20):
+        limit.on_sample(4.0, 100, inflight=int(limit.limit))
+    assert limit.limit < 2
+
+
+def test_latency_is_normalized_by_tokens():
+    limit = GradientLimit(2, max_limit=4)
+    # Длинный запрос (лот с фото) не считается перегрузкой
+    for seconds, tokens in [(1.0, 100), (10.0, 1000)] * 10:
+        limit.on_sample(seconds, tokens, inflight=int(limit.limit))
+    assert limit.limit == 4
+
+
+def test_idle_server_does_not_grow_limit():
+    limit = GradientLimit(4, max_limit=8)
+    for _ in range(20):
+        limit.on_sample(1.0, 100, inflight=1)
+    assert limit.limit == 4
+
+
+def test_drop_backs_off_within_bounds():
+    limit = GradientLimit(4, min_limit=1, max_limit=8)
+    assert limit.on_drop() == 2
+    assert limit.on_drop() == 1
+    assert limit.on_drop() == 1
+    assert limit.stats()["drops"] == 3
+
+
+def test_initial_limit_is_clamped():
+    assert GradientLimit(10, max_limit=4).limit == 4
+    assert GradientLimit(0, min_limit=1, max_limit=4).limit == 1
@@ -0,0 +1,52 @@
+from itertools import combinations
+from utils.group_scheduler import GroupScheduler, balanced_group_sizes, pack_sequential
+
+
+def test_balanced_group_sizes():
+    assert balanced_group_sizes(11, 5) == [4, 4, 3]
+    assert balanced_group_sizes(10, 5) == [5, 5]
+    assert balanced_group_sizes(6, 5) == [3, 3]
+    assert balanced_group_sizes(1, 5) == []
+
+
+def test_every_lot_plays_once_per_round():
+    scheduler = GroupScheduler(23, seed=1)
+    for _ in range(4):
+        groups = scheduler.next_round(list(range(23)), 5)
+        played = [lot for group in groups for lot in group]
+        assert sorted(played) == list(range(23))
+        assert max(len(g) for g in groups) - min(len(g) for g in groups) <= 1
+        for group in groups:
+            scheduler.record(group)
+
+
+def test_rounds_avoid_repeated_pairs():
+    scheduler = GroupScheduler(25, seed=1)
+    seen = set()
+    repeats = 0
+    for _ in range(3):
+        for group in scheduler.next_round(list(range(25)), 5):
+            scheduler.record(group)
+            for pair in combinations(sorted(group), 2):
+                repeats += pair in seen
+                seen.add(pair)
+    # 3 раунда по 5 групп из 5 - 150 пар, почти все различные
+    assert scheduler.distinct_pairs() == len(seen)
+    assert repeats <= 10
+
+
+def test_token_budget_limits_group():
+    scheduler = GroupScheduler(8, seed=1)
+    tokens = [100] * 8
+    groups = scheduler.next_round(list(range(8)), 8, tokens, token_budget=300)
+    assert all(2 <= len(group) <= 3 for group in groups)
+    assert sorted(lot for group in groups for lot in group) == list(range(8))
+
+
+def test_pack_sequential_keeps_order_and_no_singletons():
+    groups = pack_sequential(list(range(11)), 5)
+    assert groups == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10]]
+
+    groups = pack_sequential(list(range(5)), 5, [100] * 5, token_budget=200)
+    assert all(len(group) >= 2 for group in groups)
+    assert sorted(lot for group in groups for lot in group) == list(range(5))
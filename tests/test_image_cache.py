@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+from models.research_models import RawLot
+from repositories.research_repository import ImageCaptionRepository, ImageHashRepository
+from services import deep_search_service
+from services.deep_search_service import DeepSearchService
+
+
+def test_concurrent_caption_insert_returns_existing(session_factory):
+    first, second = ImageCaptionRepository(session_factory()), ImageCaptionRepository(session_factory())
+
+    assert first.create("md5", "красный телефон") == "красный телефон"
+    # Второй поток описал то же фото параллельно и вставляет после первого
+    assert second.create("md5", "телефон красного цвета") == "красный телефон"
+    # Сессия после ошибки вставки остается рабочей
+    assert second.create("other", "ноутбук") == "ноутбук"
+
+
+def test_concurrent_hash_insert_returns_existing(session_factory):
+    first, second = ImageHashRepository(session_factory()), ImageHashRepository(session_factory())
+
+    assert first.create("img/1.jpg", "aaaa") == "aaaa"
+    assert second.create("img/1.jpg", "aaaa") == "aaaa"
+    assert second.get_by_path("img/1.jpg") == "aaaa"
+
+
+def test_caption_error_falls_back_to_image(tmp_path, monkeypatch):
+    image = tmp_path / "photo.jpg"
+    image.write_bytes(b"jpeg")
+
+    def failing_captions():
+        def get_caption(image_path):
+            raise TimeoutError("сервер не ответил")
+        return SimpleNamespace(get_caption=get_caption)
+
+    monkeypatch.setattr(deep_search_service, "IMAGE_CAPTIONING_ENABLED", True)
+    raw_lot = RawLot(id=1, url="", title="Телефон", price="1000", description="", image_path=str(image))
+    parts = DeepSearchService._photo_content(SimpleNamespace(_captions=failing_captions), raw_lot)
+    assert parts[0]["type"] == "image_url"
@@ -0,0 +1,127 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+from database import DBJob
+from repositories.research_repository import JobRepository
+from services import job_worker
+from services.job_worker import JobWorker
+
+
+@pytest.fixture
+def repo(session_factory):
+    return JobRepository(session_factory())
+
+
+def test_claim_is_exclusive(repo):
+    job = repo.enqueue("deep_search", {"task_id": 1}, max_attempts=3)
+
+    claimed = repo.claim("w1", visibility_timeout=60)
+    assert claimed.id == job.id
+    assert claimed.status == "running" and claimed.attempts == 1 and claimed.locked_by == "w1"
+    # Взятое задание невидимо для других воркеров
+    assert repo.claim("w2", visibility_timeout=60) is None
+
+
+def test_fail_retries_with_exponential_backoff(repo):
+    repo.enqueue("deep_search", {"task_id": 1}, max_attempts=3)
+
+    job = repo.claim("w1", visibility_timeout=60)
+    before = datetime.utcnow()
+    job = repo.fail(job.id, "ошибка", retry_base_delay=30)
+    assert job.status == "queued" and job.last_error == "ошибка"
+    assert timedelta(seconds=29) < job.available_at - before < timedelta(seconds=31)
+    # До истечения задержки задание не берется
+    assert repo.claim("w1", visibility_timeout=60) is None
+
+    repo.db.query(DBJob).update({DBJob.available_at: datetime.utcnow()})
+    repo.db.commit()
+    job = repo.claim("w1", visibility_timeout=60)
+    assert job.attempts == 2
+    before = datetime.utcnow()
+    job = repo.fail(job.id, "ошибка", retry_base_delay=30)
+    # Вторая неудача - задержка удваивается
+    assert timedelta(seconds=59) < job.available_at - before < timedelta(seconds=61)
+
+
+def test_fail_after_last_attempt(repo):
+    repo.enqueue("deep_search", {"task_id": 1}, max_attempts=1)
+    job = repo.claim("w1", visibility_timeout=60)
+    job = repo.fail(job.id, "ошибка", retry_base_delay=0)
+    assert job.status == "failed"
+    assert repo.claim("w1", visibility_timeout=60) is None
+
+
+def test_abandoned_job_is_reclaimed_or_expired(repo):
+    repo.enqueue("deep_search", {"task_id": 1}, max_attempts=2)
+    repo.claim("w1", visibility_timeout=60)
+
+    # Воркер упал: блокировка истекла без продления
+    repo.db.query(DBJob).update({DBJob.locked_until: datetime.utcnow() - timedelta(seconds=1)})
+    repo.db.commit()
+    job = repo.claim("w2", visibility_timeout=60)
+    assert job.locked_by == "w2" and job.attempts == 2
+
+    repo.db.query(DBJob).update({DBJob.locked_until: datetime.utcnow() - timedelta(seconds=1)})
+    repo.db.commit()
+    assert repo.claim("w3", visibility_timeout=60) is None
+    expired = repo.expire_abandoned()
+    assert [j.status for j in expired] == ["failed"]
+
+
+def test_extend_lock_only_by_owner(repo):
+    job = repo.enqueue("deep_search", {"task_id": 1}, max_attempts=3)
+    repo.claim("w1", visibility_timeout=60)
+    assert repo.extend_lock(job.id, "w1", visibility_timeout=120)
+    assert not repo.extend_lock(job.id, "w2", visibility_timeout=120)
+
+
+def test_heartbeat_survives_extend_lock_error(monkeypatch, session_factory):
+    monkeypatch.setattr(job_worker, "SessionLocal", session_factory)
+    calls = []
+    enough = threading.Event()
+
+    def extend_lock(self, job_id, worker_id, visibility_timeout):
+        calls.append(job_id)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        if len(calls) >= 3:
+            enough.set()
+        return True
+
+    monkeypatch.setattr(job_worker.JobRepository, "extend_lock", extend_lock)
+    worker = JobWorker(worker_id="w1", visibility_timeout=0.03)
+    done = threading.Event()
+    heartbeat = threading.Thread(target=worker._heartbeat, args=(1, done), daemon=True)
+    heartbeat.start()
+
+    assert enough.wait(2)
+    done.set()
+    heartbeat.join(2)
+    assert not heartbeat.is_alive()
+
+
+def test_active_job_is_not_enqueued_twice(repo):
+    job = repo.enqueue("deep_search", {"task_id": 1}, max_attempts=3, dedupe_key="deep_search:1")
+    # Повторная отправка тех же результатов - то же задание, и в очереди, и во время работы
+    assert repo.enqueue("deep_search", {"task_id": 1}, max_attempts=3, dedupe_key="deep_search:1").id == job.id
+    repo.claim("w1", visibility_timeout=60)
+    assert repo.enqueue("deep_search", {"task_id": 1}, max_attempts=3, dedupe_key="deep_search:1").id == job.id
+    # Другая задача ставится независимо
+    assert repo.enqueue("deep_search", {"task_id": 2}, max_attempts=3, dedupe_key="deep_search:2").id != job.id
+    assert repo.db.query(DBJob).count() == 2
+
+    # После завершения задание задачи можно поставить снова
+    repo.complete(job.id)
+    assert repo.enqueue("deep_search", {"task_id": 1}, max_attempts=3, dedupe_key="deep_search:1").id != job.id
+
+
+def test_payload_is_cleared_when_job_finishes(repo):
+    done = repo.enqueue("deep_search", {"task_id": 1, "items": ["base64"]}, max_attempts=1)
+    repo.complete(repo.claim("w1", visibility_timeout=60).id)
+    assert repo.db.query(DBJob).filter(DBJob.id == done.id).one().payload is None
+
+    failed = repo.enqueue("deep_search", {"task_id": 2, "items": ["base64"]}, max_attempts=1)
+    job = repo.fail(repo.claim("w1", visibility_timeout=60).id, "ошибка", retry_base_delay=0)
+    # Обработчику on_failure payload еще передается, в БД он уже очищен
+    assert job.status == "failed" and job.payload["task_id"] == 2
+    assert repo.db.query(DBJob).filter(DBJob.id == failed.id).one().payload is None
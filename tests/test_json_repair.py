@@ -0,0 +1,62 @@
+from utils.json_repair import parse_json_lenient, validate_fields
+
+
+def test_markdown_fence_and_surrounding_text():
+    text = 'Вот результат:\n```json\n{"brand": "Apple", "ram": 8}\n```\nГотово.'
+    assert parse_json_lenient(text) == {"brand": "Apple", "ram": 8}
+
+
+def test_truncated_inside_string():
+    assert parse_json_lenient('{"brand": "Apple", "note": "хорошее сост') == {"brand": "Apple", "note": "хорошее сост"}
+
+
+def test_truncated_after_key_drops_unfinished_pair():
+    assert parse_json_lenient('{"brand": "Apple", "ram": ') == {"brand": "Apple"}
+    assert parse_json_lenient('{"brand": "Apple", "colors": ["red", ') == {"brand": "Apple", "colors": ["red"]}
+
+
+def test_nested_truncated_object():
+    assert parse_json_lenient('{"a": {"b": 1, "c": [1, 2') == {"a": {"b": 1, "c": [1, 2]}}
+
+
+def test_escaped_quote_in_string():
+    assert parse_json_lenient('{"title": "Экран 15.6\\" IPS", "ram": 16}') == {"title": "Экран 15.6\" IPS", "ram": 16}
+
+
+def test_not_an_object():
+    assert parse_json_lenient("") is None
+    assert parse_json_lenient("модель не ответила") is None
+    assert parse_json_lenient('["a", "b"]') is None
+    assert parse_json_lenient('{"brand": Apple}') is None
+
+
+def test_validate_fields_coerces_types():
+    fields = {
+        "ram": {"type": "integer"},
+        "battery": {"type": "number"},
+        "is_new": {"type": "boolean"},
+        "color": {"type": "string", "enum": ["Черный", "Белый"]},
+    }
+    valid, problems = validate_fields({"ram": "8", "battery": "87,5%", "is_new": "да", "color": "черный"}, fields)
+    assert valid == {"ram": 8, "battery": 87.5, "is_new": True, "color": "Черный"}
+    assert problems == []
+
+
+def test_validate_fields_reports_missing_and_invalid():
+    fields = {
+        "ram": {"type": "integer"},
+        "color": {"type": "string", "enum": ["Черный", "Белый"]},
+        "year": {"type": "integer"},
+        "note": {"type": "string", "optional": True},
+    }
+    valid, problems = validate_fields({"ram": "много", "color": "Зеленый"}, fields)
+    assert sorted(problems) == ["color", "ram", "year"]
+    # Необязательное поле можно не переспрашивать
+    assert valid == {"note": None}
+
+
+def test_validate_fields_null_only_for_optional():
+    fields = {"ram": {"type": "integer"}, "year": {"type": "integer", "optional": True}}
+    valid, problems = validate_fields({"ram": None, "year": None}, fields)
+    assert valid == {"year": None}
+    assert problems == ["ram"]
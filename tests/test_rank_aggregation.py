@@ -0,0 +1,80 @@
+import numpy as np
+from services import tournament_service
+from services.tournament_service import _aggregate, classic_tournament_ranking
+from utils.rank_aggregation import pairwise_wins, bradley_terry, top_k_stability
+
+
+def test_pairwise_wins_full_rank_breaking():
+    wins = pairwise_wins([[2, 0, 1], [0, 1]], 3)
+    # 2 > 0, 2 > 1, 0 > 1 (дважды)
+    assert wins[2, 0] == 1 and wins[2, 1] == 1
+    assert wins[0, 1] == 2
+    assert wins[1].sum() == 0
+
+
+def test_borda_average_points():
+    scores = _aggregate([["a", "b", "c"], ["b", "a"]], ["a", "b", "c"], "borda")
+    # a: 3 и 1, b: 2 и 2, c: 1
+    assert scores["a"] == (2.0, None)
+    assert scores["b"] == (2.0, None)
+    assert scores["c"] == (1.0, None)
+
+
+def test_bradley_terry_orders_by_strength():
+    # 0 всегда выигрывает, 2 всегда проигрывает
+    wins = pairwise_wins([[0, 1, 2]] * 5, 3)
+    theta, cov = bradley_terry(wins)
+    assert theta[0] > theta[1] > theta[2]
+    # Априорные партии со "средним" лотом не дают силе непобежденного уйти в бесконечность
+    assert np.all(np.isfinite(theta))
+    assert np.all(np.diag(cov) > 0)
+
+
+def test_bradley_terry_uncertainty_shrinks_with_games():
+    _, cov_few = bradley_terry(pairwise_wins([[0, 1], [1, 0]], 2))
+    _, cov_many = bradley_terry(pairwise_wins([[0, 1], [1, 0]] * 10, 2))
+    assert cov_many[0, 0] < cov_few[0, 0]
+
+
+def _play(n, rounds, judge_order):
+    rng = np.random.default_rng(1)
+    orderings = []
+    for _ in range(rounds):
+        order = rng.permutation(n)
+        for start in range(0, n, 5):
+            orderings.append(judge_order(order[start:start + 5]))
+    return bradley_terry(pairwise_wins(orderings, n))
+
+
+def test_stability_separates_consistent_and_random_judge():
+    rng = np.random.default_rng(2)
+    consistent = _play(40, 8, lambda group: sorted(group))
+    random_judge = _play(40, 8, lambda group: list(rng.permutation(group)))
+    assert top_k_stability(*consistent, 10) >= 0.8
+    assert top_k_stability(*random_judge, 10) < 0.8
+
+
+def test_stability_all_lots_in_top():
+    theta, cov = _play(6, 4, lambda group: sorted(group))
+    # Состав совпадает всегда, остается неуверенность в порядке
+    assert 0.0 < top_k_stability(theta, cov, 10) <= 1.0
+
+
+def test_early_stop_on_consistent_judge(monkeypatch):
+    calls = []
+
+    def rank_group(group, criteria, context=""):
+        calls.append(len(group))
+        return sorted(group, key=lambda lot: lot["quality"], reverse=True)
+
+    monkeypatch.setattr(tournament_service, "rank_group", rank_group)
+    lots = [{"id": i, "title": f"lot {i}", "price": 1000, "quality": i} for i in range(40)]
+    result = classic_tournament_ranking(
+        lots, "criteria", num_rounds=8, group_size=5,
+        aggregation="bradley_terry", top_k=10, confidence=0.8
+    )
+
+    # Полный турнир - 8 раундов по 8 групп
+    assert len(calls) < 8 * 8
+    # Не встречавшиеся соседи могут поменяться местами, но состав лидеров верный
+    assert len({lot["id"] for lot in result[:10]} & set(range(30, 40))) >= 8
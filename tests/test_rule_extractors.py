@@ -0,0 +1,73 @@
+from utils.rule_extractors import extract_known_fields
+
+
+def test_phone_ram_and_storage_from_slash_notation():
+    schema = {
+        "ram_gb": {"type": "integer", "description": "Оперативная память, ГБ"},
+        "storage": {"type": "string", "description": "Встроенная память", "enum": ["128GB", "256GB"]},
+    }
+    assert extract_known_fields(schema, "iPhone 13 8/256 отличное состояние") == {"ram_gb": 8, "storage": "256GB"}
+
+
+def test_battery_capacity_is_not_storage():
+    schema = {"battery_capacity": {"type": "string", "description": "Емкость аккумулятора, мАч"}}
+    assert extract_known_fields(schema, "iPhone 13 8/256") == {}
+
+
+def test_engine_volume_is_not_storage():
+    schema = {"engine_volume": {"type": "number", "description": "Объем двигателя"}}
+    assert extract_known_fields(schema, "Магнитола 16 гб, объем двигателя уточняйте") == {}
+
+
+def test_capacity_in_gb_is_storage():
+    schema = {"capacity": {"type": "string", "description": "Объем, ГБ"}}
+    assert extract_known_fields(schema, "Флешка 64 гб") == {"capacity": "64 GB"}
+
+
+def test_year_needs_anchor():
+    schema = {"year": {"type": "integer", "description": "Год выпуска"}}
+    assert extract_known_fields(schema, "Телефон, аккумулятор 2000 мАч") == {}
+    assert extract_known_fields(schema, "Отдам за 2010 рублей") == {}
+    assert extract_known_fields(schema, "Ноутбук 2019 г., аккумулятор 2000 мАч") == {"year": 2019}
+    assert extract_known_fields(schema, "Год выпуска: 2021") == {"year": 2021}
+
+
+def test_explicit_ram_wins_over_slash_notation():
+    schema = {"ram_gb": {"type": "integer", "description": "Оперативная память"}}
+    assert extract_known_fields(schema, "Планшет 12/128, 4 гб ram") == {"ram_gb": 4}
+
+
+def test_ambiguous_values_are_left_to_llm():
+    schema = {"ram_gb": {"type": "integer", "description": "ОЗУ"}}
+    assert extract_known_fields(schema, "Есть два варианта: 8/128 и 6/128") == {}
+
+
+def test_condition_and_battery_percent():
+    schema = {
+        "is_new": {"type": "boolean", "description": "Новый ли товар"},
+        "battery_health": {"type": "integer", "description": "Состояние аккумулятора, %"},
+    }
+    assert extract_known_fields(schema, "Б/у, аккумулятор 87%") == {"is_new": False, "battery_health": 87}
+
+
+def test_keyword_inside_another_word_does_not_match():
+    # "нов" внутри "установлена", "ram" внутри "frame"
+    schema = {"os_installed": {"type": "boolean", "description": "Установлена ли операционная система"}}
+    assert extract_known_fields(schema, "Новый ноутбук, Windows не установлена") == {}
+    schema = {"frame_material": {"type": "string", "description": "Материал рамы"}}
+    assert extract_known_fields(schema, "Велосипед 8/256") == {}
+
+
+def test_part_condition_is_not_item_condition_or_size():
+    schema = {"screen_condition": {"type": "string", "description": "Состояние экрана"}}
+    assert extract_known_fields(schema, "iPhone 13, экран 6.1\", новый") == {}
+
+
+def test_description_words_do_not_select_extractor():
+    schema = {"has_box": {"type": "boolean", "description": "Есть ли коробка (новый комплект)"}}
+    assert extract_known_fields(schema, "Новый, в упаковке") == {}
+
+
+def test_screen_size_field():
+    schema = {"screen_size": {"type": "number", "description": "Диагональ, дюймы"}}
+    assert extract_known_fields(schema, "iPhone 13, экран 6.1\"") == {"screen_size": 6.1}
@@ -0,0 +1,20 @@
+from utils.schema_compiler import compile_extraction_schema, changed_fields
+
+
+def test_every_field_is_nullable():
+    schema = compile_extraction_schema({
+        "ram": {"type": "integer"},
+        "color": {"type": "string", "enum": ["Черный", "Белый"]},
+        "note": {"type": "string", "optional": True},
+    }, notes=[])
+    # Модель может ответить null на любое поле, а не выдумывать значение
+    assert schema["properties"]["ram"]["type"] == ["integer", "null"]
+    assert schema["properties"]["color"]["enum"] == ["Черный", "Белый", None]
+    assert schema["properties"]["note"]["type"] == ["string", "null"]
+    assert schema["required"] == ["ram", "color", "note"]
+
+
+def test_optional_change_is_a_schema_change():
+    old = {"ram": {"type": "integer"}, "year": {"type": "integer"}}
+    new = {"ram": {"type": "integer"}, "year": {"type": "integer", "optional": True}}
+    assert changed_fields(old, new) == ["year"]
@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from pydantic import BaseModel
+from utils.single_flight import SingleFlight, request_key
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "ответ"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flight.do, "k", slow)
+        assert started.wait(2)
+        followers = [pool.submit(flight.do, "k", slow) for _ in range(3)]
+        # Ждем, пока все три встанут в очередь за первым
+        while flight.shared < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert len(calls) == 1
+    assert results[0] == ("ответ", False)
+    assert all(r == ("ответ", True) for r in results[1:])
+    assert flight.stats() == {"executed": 1, "shared": 3, "in_flight": 0}
+
+
+def test_error_is_propagated_to_waiters():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(2)
+        raise TimeoutError("сервер не ответил")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "k", failing)
+        assert started.wait(2)
+        follower = pool.submit(flight.do, "k", failing)
+        while flight.shared < 1:
+            time.sleep(0.001)
+        release.set()
+        with pytest.raises(TimeoutError):
+            leader.result()
+        with pytest.raises(TimeoutError):
+            follower.result()
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_no_caching_after_completion():
+    flight = SingleFlight()
+    calls = []
+
+    def func():
+        calls.append(1)
+        return len(calls)
+
+    assert flight.do("k", func) == (1, False)
+    assert flight.do("k", func) == (2, False)
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("b", lambda: 2) == (2, False)
+    assert flight.stats()["shared"] == 0
+
+
+class Answer(BaseModel):
+    brand: str
+
+
+class OtherAnswer(BaseModel):
+    price: int
+
+
+def test_request_key():
+    params = {"model": "m", "messages": [{"role": "user", "content": "привет"}], "timeout": 60}
+    assert request_key("url", params) == request_key("url", dict(reversed(list(params.items()))))
+    assert request_key("url", params) != request_key("other", params)
+    # Pydantic-модели response_format различаются по схеме
+    assert request_key("url", {**params, "response_format": Answer}) != request_key("url", {**params, "response_format": OtherAnswer})
@@ -0,0 +1,146 @@
+import pytest
+from repositories.research_repository import TournamentMatchRepository
+from services import tournament_service
+from services.tournament_service import EarlyRound, TournamentCheckpoint, classic_tournament_ranking
+
+
+@pytest.fixture
+def repo(session_factory):
+    return TournamentMatchRepository(session_factory())
+
+
+def lots(ids):
+    # Судья ставит выше лот с большим quality
+    return [{"id": lot_id, "title": f"lot {lot_id}", "price": 1000, "quality": lot_id} for lot_id in ids]
+
+
+def judge(calls):
+    def rank_group(group, criteria, context=""):
+        calls.append([lot["id"] for lot in group])
+        return sorted(group, key=lambda lot: lot["quality"], reverse=True)
+    return rank_group
+
+
+def test_new_lots_are_ranked_after_stale_checkpoint(monkeypatch, repo):
+    calls = []
+    monkeypatch.setattr(tournament_service, "rank_group", judge(calls))
+
+    # Первая страница: 7 лотов, турнир завершен
+    classic_tournament_ranking(lots(range(1, 8)), "criteria", num_rounds=2, group_size=4, checkpoint=TournamentCheckpoint(repo, 1))
+    first_calls = len(calls)
+    assert first_calls > 0
+
+    # Дозагрузка: еще 12 лотов, среди них лучшие
+    all_lots = lots(range(1, 20))
+    checkpoint = TournamentCheckpoint(repo, 1)
+    checkpoint.skip_stale_rounds([str(lot["id"]) for lot in all_lots])
+    ranked = classic_tournament_ranking(all_lots, "criteria", num_rounds=2, group_size=4, checkpoint=checkpoint)
+
+    assert len(calls) > first_calls
+    played = {lot_id for group in calls[first_calls:] for lot_id in group}
+    assert played == set(range(1, 20))
+    assert all(lot["tournament_score"] > 0 for lot in ranked if lot["id"] != 1)
+    assert ranked[0]["id"] in range(8, 20)
+
+    # Перезапуск после этого: новый турнир восстанавливается из журнала без новых вызовов
+    calls_before = len(calls)
+    checkpoint = TournamentCheckpoint(repo, 1)
+    checkpoint.skip_stale_rounds([str(lot["id"]) for lot in all_lots])
+    assert checkpoint.base == 2
+    classic_tournament_ranking(lots(range(1, 20)), "criteria", num_rounds=2, group_size=4, checkpoint=checkpoint)
+    assert len(calls) == calls_before
+
+
+def test_complete_checkpoint_is_replayed(monkeypatch, repo):
+    calls = []
+    monkeypatch.setattr(tournament_service, "rank_group", judge(calls))
+    classic_tournament_ranking(lots(range(1, 10)), "criteria", num_rounds=2, group_size=4, checkpoint=TournamentCheckpoint(repo, 1))
+    calls_before = len(calls)
+
+    checkpoint = TournamentCheckpoint(repo, 1)
+    checkpoint.skip_stale_rounds([str(lot_id) for lot_id in range(1, 10)])
+    assert checkpoint.base == 0
+    classic_tournament_ranking(lots(range(1, 10)), "criteria", num_rounds=2, group_size=4, checkpoint=checkpoint)
+    assert len(calls) == calls_before
+
+
+def test_llm_error_is_not_saved_as_played(monkeypatch):
+    def failing_completion(*args, **kwargs):
+        raise TimeoutError("сервер не ответил")
+
+    monkeypatch.setattr(tournament_service, "get_completion", failing_completion)
+    with pytest.raises(TimeoutError):
+        tournament_service.rank_group(lots([1, 2]), "criteria")
+
+
+def test_failed_group_is_replayed_on_resume(monkeypatch, repo):
+    calls = []
+    good_judge = judge(calls)
+
+    def flaky_judge(group, criteria, context=""):
+        if any(lot["id"] == 3 for lot in group):
+            raise TimeoutError("сервер не ответил")
+        return good_judge(group, criteria, context)
+
+    monkeypatch.setattr(tournament_service, "rank_group", flaky_judge)
+    with pytest.raises(RuntimeError):
+        classic_tournament_ranking(lots(range(1, 10)), "criteria", num_rounds=2, group_size=4, checkpoint=TournamentCheckpoint(repo, 1))
+
+    # Остальные группы раунда записаны, группа с ошибкой осталась несыгранной
+    stored = TournamentCheckpoint(repo, 1).round_matches(0)
+    assert [m.ranked_ids is None for m in stored].count(True) == 1
+    assert all(("3" in m.member_ids) == (m.ranked_ids is None) for m in stored)
+
+    # Повтор задания доигрывает только ее и следующий раунд
+    monkeypatch.setattr(tournament_service, "rank_group", good_judge)
+    calls.clear()
+    ranked = classic_tournament_ranking(lots(range(1, 10)), "criteria", num_rounds=2, group_size=4, checkpoint=TournamentCheckpoint(repo, 1))
+    assert 3 in calls[0]
+    assert len(calls) == 1 + 3
+    # Второй раунд случайный, поэтому проверяем только, что отранжированы все лоты
+    assert sorted(lot["id"] for lot in ranked) == list(range(1, 10))
+
+
+def test_early_group_is_checkpointed_before_llm_call(monkeypatch, repo):
+    seen = []
+
+    def rank_group(group, criteria, context=""):
+        # Группа уже в журнале и еще не сыграна
+        stored = TournamentCheckpoint(repo, 1).round_matches(0)
+        seen.append([(m.member_ids, m.ranked_ids) for m in stored][-1])
+        return sorted(group, key=lambda lot: lot["quality"], reverse=True)
+
+    monkeypatch.setattr(tournament_service, "rank_group", rank_group)
+    early = EarlyRound("criteria", TournamentCheckpoint(repo, 1), group_size=3)
+    for lot in lots(range(1, 7)):
+        early.add(lot)
+    early.finish()
+
+    assert seen == [(["1", "2", "3"], None), (["4", "5", "6"], None)]
+    stored = TournamentCheckpoint(repo, 1).round_matches(0)
+    assert [m.ranked_ids for m in stored] == [["3", "2", "1"], ["6", "5", "4"]]
+
+
+def test_early_round_resumes_after_crash(monkeypatch, repo):
+    calls = []
+    monkeypatch.setattr(tournament_service, "rank_group", judge(calls))
+
+    # Задание упало после двух ранних групп
+    early = EarlyRound("criteria", TournamentCheckpoint(repo, 1), group_size=3)
+    for lot in lots(range(1, 8)):
+        early.add(lot)
+    assert len(calls) == 2
+
+    # Повтор: те же лоты снова идут в ранний раунд, играют только нераспределенные
+    calls.clear()
+    early = EarlyRound("criteria", TournamentCheckpoint(repo, 1), group_size=3)
+    for lot in lots(range(1, 10)):
+        early.add(lot)
+    early.finish()
+    assert calls == [[7, 8, 9]]
+
+    # Турнир берет первый раунд из чекпоинта и начинает со второго
+    calls.clear()
+    classic_tournament_ranking(lots(range(1, 10)), "criteria", num_rounds=2, group_size=3, checkpoint=TournamentCheckpoint(repo, 1))
+    assert len(calls) == 3
+    assert len(TournamentCheckpoint(repo, 1).round_matches(0)) == 3
@@ -0,0 +1,83 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List
+
+
+# Окончания для грубого стемминга (сначала длинные): "ноутбуки", "ноутбука" -> "ноутбук"
+RU_ENDINGS = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ах", "ях",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ов", "ев", "ей",
+    "ам", "ям", "ом", "ем", "ую", "юю", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь"
+], key=len, reverse=True)
+
+STOPWORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "для", "не", "от", "до", "из", "за", "к", "ко",
+    "о", "об", "у", "а", "но", "или", "что", "это", "как", "так", "же", "бы", "ли",
+    "мне", "меня", "нужно", "нужен", "нужна", "хочу", "ищу", "ищем", "пользователь",
+    "the", "a", "an", "and", "or", "for", "of", "to", "in", "with"
+}
+
+
+# Единицы измерения пишут и кириллицей, и латиницей
+UNIT_ALIASES = {"тб": "tb", "гб": "gb", "мб": "mb", "гц": "hz", "вт": "w", "мач": "mah"}
+
+
+def stem(word: str) -> str:
+    if not re.match(r"[а-яё]", word):
+        return word
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова и числа отдельно ("2Tb" -> "2", "tb"), без стоп-слов, со стеммингом"""
+    words = re.findall(r"\d+|[a-zа-яё]+", (text or "").lower())
+    return [stem(UNIT_ALIASES.get(word, word)) for word in words if word not in STOPWORDS]
+
+
+class BM25:
+    """Okapi BM25 по небольшой коллекции документов (лоты одной задачи)"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(doc) for doc in documents]
+        self.doc_lens = [len(doc) for doc in documents]
+        self.avg_len = sum(self.doc_lens) / len(documents) if documents else 0.0
+
+        doc_freq = Counter()
+        for freqs in self.term_freqs:
+            doc_freq.update(freqs.keys())
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def scores(self, query_weights: Dict[str, float]) -> List[float]:
+        """
+        :param query_weights: термин запроса -> вес (запрос важнее описания задачи)
+        :return: оценка каждого документа
+        """
+        result = []
+        for freqs, doc_len in zip(self.term_freqs, self.doc_lens):
+            norm = self.k1 * (1 - self.b + self.b * doc_len / self.avg_len) if self.avg_len else self.k1
+            score = 0.0
+            for term, weight in query_weights.items():
+                tf = freqs.get(term, 0)
+                if tf:
+                    score += weight * self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            result.append(score)
+        return result
+
+
+def weighted_query(parts: List[tuple]) -> Dict[str, float]:
+    """
+    Собирает взвешенный запрос из нескольких текстов
+    :param parts: список (текст, вес); у повторяющегося термина берется максимальный вес
+    """
+    weights: Dict[str, float] = {}
+    for text, weight in parts:
+        for term in tokenize(text):
+            weights[term] = max(weights.get(term, 0.0), weight)
+    return weights
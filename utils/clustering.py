@@ -0,0 +1,27 @@
+from typing import Dict, Iterable, List, Tuple
+
+
+def union_find_clusters(item_ids: Iterable[int], pairs: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    """
+    Объединяет элементы в кластеры по парам "похожих" (транзитивно, union-find)
+    :param item_ids: все элементы
+    :param pairs: пары элементов, которые нужно считать одним кластером
+    :return: список кластеров (включая одиночные)
+    """
+    parent = {item_id: item_id for item_id in item_ids}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    groups: Dict[int, List[int]] = {}
+    for item_id in parent:
+        groups.setdefault(find(item_id), []).append(item_id)
+    return list(groups.values())
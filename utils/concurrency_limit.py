@@ -0,0 +1,91 @@
+"""
+Адаптивный лимит одновременных запросов к серверу по наблюдаемой задержке.
+
+Градиентный алгоритм (по мотивам Gradient/Vegas из Netflix concurrency-limits):
+текущая задержка (короткая скользящая средняя) сравнивается с базовой -
+задержкой без очереди (минимум замеров, медленно подтягивается к текущей, чтобы
+следовать за сменой нагрузки). Пока текущая не выше базовой с допуском, лимит
+понемногу растет; когда на сервере копится очередь, задержка поднимается и лимит
+уменьшается пропорционально. Таймауты и 5xx - мультипликативное уменьшение (AIMD).
+
+Задержка нормируется на число токенов запроса: лот с фото и короткий текстовый
+запрос иначе выглядели бы как перегрузка и простой сервера.
+"""
+from typing import Dict, Optional
+
+
+class GradientLimit:
+    """
+    Лимит в диапазоне [min_limit, max_limit]. Не потокобезопасен:
+    вызывающий код (LLMRouter) обновляет его под своей блокировкой.
+    """
+
+    def __init__(
+        self,
+        initial_limit: float,
+        min_limit: float = 1,
+        max_limit: float = 8,
+        smoothing: float = 0.2,
+        short_alpha: float = 0.5,
+        base_drift: float = 0.01,
+        backoff_ratio: float = 0.5,
+        tolerance: float = 1.5
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = min(self.max_limit, max(min_limit, initial_limit))
+        self.smoothing = smoothing
+        self.short_alpha = short_alpha
+        self.base_drift = base_drift
+        self.backoff_ratio = backoff_ratio
+        # Во сколько раз текущая задержка может превышать базовую без уменьшения лимита
+        self.tolerance = tolerance
+        self.short_latency: Optional[float] = None
+        self.base_latency: Optional[float] = None
+        self.samples = 0
+        self.drops = 0
+
+    def on_sample(self, seconds: float, tokens: int, inflight: int) -> float:
+        """
+        Успешный запрос
+        :param tokens: токены запроса (prompt + completion), 0 - неизвестно
+        :param inflight: сколько запросов выполнялось на сервере вместе с этим
+        """
+        latency = seconds / tokens if tokens else seconds
+        self.samples += 1
+        if self.short_latency is None:
+            self.short_latency = self.base_latency = latency
+            return self.limit
+        self.short_latency += self.short_alpha * (latency - self.short_latency)
+        self.base_latency = min(latency, self.base_latency + self.base_drift * (self.short_latency - self.base_latency))
+        if self.short_latency <= 0:
+            return self.limit
+
+        # Сервер недогружен (запросов меньше половины лимита) - замер ничего не говорит о пределе
+        if inflight < self.limit / 2:
+            return self.limit
+
+        gradient = max(0.5, min(1.0, self.tolerance * self.base_latency / self.short_latency))
+        # Задержка не растет - пробуем еще один запрос сверху, растет - уменьшаем пропорционально
+        new_limit = self.limit + 1 if gradient >= 1 else self.limit * gradient
+        self.limit = self._clamp(self.limit * (1 - self.smoothing) + new_limit * self.smoothing)
+        return self.limit
+
+    def on_drop(self) -> float:
+        """Таймаут, обрыв соединения или 5xx - сервер перегружен или недоступен"""
+        self.drops += 1
+        self.limit = self._clamp(self.limit * self.backoff_ratio)
+        return self.limit
+
+    def _clamp(self, limit: float) -> float:
+        return min(self.max_limit, max(self.min_limit, limit))
+
+    def stats(self) -> Dict:
+        return {
+            "limit": round(self.limit, 2),
+            "max_limit": self.max_limit,
+            "short_latency_ms": round(self.short_latency * 1000, 2) if self.short_latency else None,
+            "base_latency_ms": round(self.base_latency * 1000, 2) if self.base_latency else None,
+            "samples": self.samples,
+            "drops": self.drops,
+        }
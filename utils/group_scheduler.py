@@ -0,0 +1,160 @@
+import math
+import random
+from typing import List, Optional
+import numpy as np
+from utils.logger import logger
+
+
+def balanced_group_sizes(n: int, group_size: int) -> List[int]:
+    """
+    Размеры групп для n лотов: групп ceil(n / group_size), размеры отличаются не больше чем на 1.
+    Например, 11 лотов по 5 -> [4, 4, 3] вместо [5, 5] и выброшенного одиночки.
+    """
+    if n < 2:
+        return []
+    num_groups = -(-n // group_size)
+    base, extra = divmod(n, num_groups)
+    return [base + 1 if i < extra else base for i in range(num_groups)]
+
+
+def target_group_size(items: List[int], group_size: int, item_tokens: Optional[List[int]], token_budget: Optional[int]) -> int:
+    """
+    Размер группы с учетом бюджета токенов: групп должно хватить, чтобы
+    уложить все лоты и по количеству (group_size), и по суммарным токенам
+    """
+    if not token_budget:
+        return group_size
+    total_tokens = sum(item_tokens[i] for i in items)
+    num_groups = max(math.ceil(len(items) / group_size), math.ceil(total_tokens / token_budget))
+    return max(2, math.ceil(len(items) / num_groups))
+
+
+def _fix_singleton(groups: List[List[int]], group_size: int, item_tokens: Optional[List[int]], token_budget: Optional[int]):
+    """
+    Одиночная группа ничего не сравнивает: подселяем лот в группу, где есть
+    место по размеру и токенам, иначе забираем к нему лот из группы побольше
+    """
+    if len(groups) < 2 or len(groups[-1]) != 1:
+        return
+    single = groups[-1][0]
+
+    for group in groups[:-1]:
+        fits = not token_budget or sum(item_tokens[i] for i in group) + item_tokens[single] <= token_budget
+        if len(group) < group_size and fits:
+            group.append(groups.pop()[0])
+            return
+
+    for group in groups[:-1]:
+        if len(group) >= 3:
+            groups[-1].insert(0, group.pop())
+            return
+
+    groups[-2].extend(groups.pop())
+
+
+def group_is_full(size: int, used: int, next_tokens: int, target: int, token_budget: Optional[int]) -> bool:
+    """
+    Закрывать ли группу перед следующим лотом: набран target или лот не влезает
+    по токенам. Пару формируем всегда: лот, не влезающий даже вдвоем, все равно должен сыграть
+    """
+    return size > 0 and (size >= target or bool(token_budget and size >= 2 and used + next_tokens > token_budget))
+
+
+def pack_sequential(items: List[int], group_size: int, item_tokens: Optional[List[int]] = None, token_budget: Optional[int] = None) -> List[List[int]]:
+    """
+    Режет упорядоченный список на группы соседей (для швейцарки).
+    Без бюджета - сбалансированные размеры, с бюджетом - жадное заполнение
+    до target_group_size или до исчерпания токенов.
+    """
+    if not token_budget:
+        groups = []
+        start = 0
+        for size in balanced_group_sizes(len(items), group_size):
+            groups.append(items[start:start + size])
+            start += size
+        return groups
+
+    target = target_group_size(items, group_size, item_tokens, token_budget)
+    groups = []
+    group, used = [], 0
+    for item in items:
+        if group_is_full(len(group), used, item_tokens[item], target, token_budget):
+            groups.append(group)
+            group, used = [], 0
+        group.append(item)
+        used += item_tokens[item]
+    if group:
+        groups.append(group)
+
+    _fix_singleton(groups, target, item_tokens, token_budget)
+    return [group for group in groups if len(group) >= 2]
+
+
+class GroupScheduler:
+    """
+    Жадное приближение сбалансированной неполной блочной схемы (BIBD).
+
+    Хранит матрицу встреч лотов и каждый раунд собирает группы так, чтобы
+    в них попадали пары, которые встречались реже всего. Это максимизирует
+    число различных сравненных пар на один вызов LLM.
+    """
+
+    def __init__(self, n_items: int, seed: int = None):
+        self.meetings = np.zeros((n_items, n_items), dtype=np.int32)
+        self.rng = random.Random(seed)
+
+    def record(self, group: List[int]):
+        idx = np.asarray(group)
+        self.meetings[np.ix_(idx, idx)] += 1
+        self.meetings[idx, idx] -= 1
+
+    def next_round(self, items: List[int], group_size: int, item_tokens: Optional[List[int]] = None, token_budget: Optional[int] = None) -> List[List[int]]:
+        """
+        Разбивает items на группы с минимальным числом повторных встреч
+        :param items: индексы лотов, участвующих в раунде
+        :param group_size: максимальный размер группы
+        :param item_tokens: оценка токенов каждого лота в промпте (по индексу лота)
+        :param token_budget: сколько токенов лотов помещается в один промпт (None - без ограничения)
+        :return: список групп (индексы лотов)
+        """
+        remaining = list(items)
+        # Случайный порядок разбивает ничьи между одинаково "свежими" кандидатами
+        self.rng.shuffle(remaining)
+        remaining = np.asarray(remaining)
+        available = np.ones(len(remaining), dtype=bool)
+        tokens = np.asarray([item_tokens[i] for i in remaining]) if token_budget else np.zeros(len(remaining))
+        never = np.iinfo(np.int32).max
+
+        sizes = balanced_group_sizes(len(remaining), target_group_size(items, group_size, item_tokens, token_budget))
+        groups = []
+        while available.any():
+            # Сначала сбалансированные размеры, остатки (не влезли по токенам) - дополнительными группами
+            size = sizes[len(groups)] if len(groups) < len(sizes) else group_size
+
+            # Начинаем группу с лота, у которого меньше всего встреч
+            total = self.meetings[remaining].sum(axis=1)
+            first = int(np.argmin(np.where(available, total, never)))
+            available[first] = False
+            group = [first]
+            used = tokens[first]
+
+            while len(group) < size:
+                fits = available if len(group) < 2 or not token_budget else available & (tokens + used <= token_budget)
+                if not fits.any():
+                    break
+                cost = self.meetings[np.ix_(remaining, remaining[group])].sum(axis=1)
+                pick = int(np.argmin(np.where(fits, cost, never)))
+                available[pick] = False
+                group.append(pick)
+                used += tokens[pick]
+
+            groups.append([int(remaining[i]) for i in group])
+
+        _fix_singleton(groups, group_size, item_tokens, token_budget)
+        if token_budget:
+            logger.info(f"Упаковка групп по токенам: {len(groups)} групп, размеры {[len(g) for g in groups]}")
+        return [group for group in groups if len(group) >= 2]
+
+    def distinct_pairs(self) -> int:
+        """Сколько различных пар уже сравнивалось"""
+        return int(np.count_nonzero(np.triu(self.meetings, 1)))
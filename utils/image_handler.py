@@ -1,10 +1,25 @@
 import hashlib
 import os
 from pathlib import Path
+from typing import Optional
 from config import IMAGE_STORAGE_PATH
 from utils.logger import logger
 
 
+def compute_file_hash(image_path: str) -> Optional[str]:
+    """
+    md5 содержимого файла изображения (тот же хеш, что в имени сохраненного файла)
+    :param image_path: путь к файлу
+    :return: hex-строка или None, если файл не читается
+    """
+    try:
+        with open(image_path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except OSError as e:
+        logger.error(f"Не удалось прочитать изображение {image_path}: {e}")
+        return None
+
+
 def save_image_from_base64(image_base64: str, filename_prefix: str = "") -> str:
     """
     Сохраняет изображение из base64 строки и возвращает путь к файлу
@@ -0,0 +1,85 @@
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from utils.logger import logger
+
+
+HASH_BITS = 64
+
+
+def compute_dhash(image_path: str, hash_size: int = 8) -> Optional[str]:
+    """
+    Вычисляет перцептивный dHash изображения
+    :param image_path: путь к файлу изображения
+    :param hash_size: сторона хеша (8 -> 64 бита)
+    :return: хеш в виде hex-строки или None, если файл не читается
+    """
+    try:
+        with Image.open(image_path) as img:
+            # Ширина на 1 больше: сравниваем соседние пиксели по горизонтали
+            small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = list(small.getdata())
+    except Exception as e:
+        logger.error(f"Не удалось вычислить dHash для {image_path}: {e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """Расстояние Хэмминга между двумя hex-хешами"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+class ImageHashIndex:
+    """
+    Индекс для поиска почти одинаковых изображений (multi-index hashing).
+
+    64-битный хеш делится на (max_distance + 1) блоков. По принципу Дирихле
+    два хеша на расстоянии <= max_distance совпадают хотя бы в одном блоке,
+    поэтому кандидатов ищем по точному совпадению блока, а затем проверяем
+    полное расстояние.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self.num_blocks = max_distance + 1
+        self.hashes: Dict[int, str] = {}
+        self.buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.num_blocks)]
+
+    def _blocks(self, phash: str) -> List[int]:
+        value = int(phash, 16)
+        block_bits = HASH_BITS // self.num_blocks
+        blocks = []
+        for i in range(self.num_blocks):
+            # Последний блок забирает остаток битов
+            width = block_bits if i < self.num_blocks - 1 else HASH_BITS - block_bits * i
+            blocks.append((value >> (block_bits * i)) & ((1 << width) - 1))
+        return blocks
+
+    def add(self, item_id: int, phash: str):
+        self.hashes[item_id] = phash
+        for i, block in enumerate(self._blocks(phash)):
+            self.buckets[i].setdefault(block, []).append(item_id)
+
+    def query(self, phash: str) -> List[int]:
+        """Возвращает id всех элементов на расстоянии <= max_distance"""
+        candidates = set()
+        for i, block in enumerate(self._blocks(phash)):
+            candidates.update(self.buckets[i].get(block, []))
+        return [c for c in candidates if hamming_distance(self.hashes[c], phash) <= self.max_distance]
+
+    def pairs(self) -> List[Tuple[int, int]]:
+        """Все пары почти одинаковых изображений"""
+        result = []
+        for item_id, phash in self.hashes.items():
+            for other in self.query(phash):
+                if other > item_id:
+                    result.append((item_id, other))
+        return result
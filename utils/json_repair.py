@@ -0,0 +1,148 @@
+"""
+Терпимый разбор JSON-ответов LLM: markdown-ограждения и текст вокруг объекта
+отбрасываются, оборванный на середине объект дозакрывается, значения
+проверяются по схеме задачи.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from utils.schema_compiler import compile_field, is_optional
+
+
+def _repair_candidates(text: str) -> List[str]:
+    """
+    Варианты восстановления оборванного JSON: сначала просто закрываем открытые
+    строку и скобки, затем отрезаем недописанную пару ключ-значение
+    """
+    stack = []
+    in_string = False
+    escape = False
+    # Позиция, до которой объект гарантированно корректен (после завершенного значения)
+    last_safe = 0
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return [text[:i + 1]]
+            last_safe = i + 1
+        elif ch == ",":
+            last_safe = i
+
+    if not stack:
+        return [text]
+    closed = text + ('"' if in_string else "") + "".join(reversed(stack))
+
+    # Обрезаем до последнего завершенного элемента и закрываем скобки, открытые к этому моменту
+    head = text[:last_safe].rstrip().rstrip(",")
+    depth = []
+    in_string = False
+    escape = False
+    for ch in head:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth.append("}" if ch == "{" else "]")
+        elif ch in "}]" and depth:
+            depth.pop()
+    return [closed, head + "".join(reversed(depth))]
+
+
+def parse_json_lenient(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Достает JSON-объект из ответа модели
+    :return: словарь или None, если объект восстановить не удалось
+    """
+    if not text:
+        return None
+
+    cleaned = re.sub(r"```(?:json)?", "", text)
+    start = cleaned.find("{")
+    if start == -1:
+        return None
+    cleaned = cleaned[start:]
+
+    for candidate in [cleaned] + _repair_candidates(cleaned):
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def _coerce(value: Any, prop: Dict[str, Any]) -> Tuple[bool, Any]:
+    """Проверяет значение по свойству JSON Schema, по возможности приводя тип"""
+    types = prop["type"] if isinstance(prop["type"], list) else [prop["type"]]
+    if value is None:
+        return "null" in types, None
+
+    if "boolean" in types:
+        if isinstance(value, bool):
+            return True, value
+        if str(value).strip().lower() in ("true", "да", "yes"):
+            return True, True
+        if str(value).strip().lower() in ("false", "нет", "no"):
+            return True, False
+    if "integer" in types or "number" in types:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return True, int(value) if "integer" in types and value == int(value) else value
+        match = re.fullmatch(r"\s*(-?\d+(?:[.,]\d+)?)\s*%?\s*", str(value))
+        if match:
+            number = float(match.group(1).replace(",", "."))
+            return True, int(number) if "integer" in types and number == int(number) else number
+    if "string" in types and not isinstance(value, (dict, list)):
+        value = str(value)
+        if "enum" not in prop:
+            return True, value
+        for option in prop["enum"]:
+            if option is not None and option.lower() == value.strip().lower():
+                return True, option
+    return False, value
+
+
+def validate_fields(data: Dict[str, Any], fields: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Проверяет извлеченные значения по схеме задачи
+    :param data: разобранный ответ модели
+    :param fields: поля схемы задачи
+    :return: (корректные значения, поля, которые отсутствуют или невалидны)
+    """
+    valid = {}
+    problems = []
+    for name, spec in fields.items():
+        if data.get(name) is None:
+            # null допустим в ответе для любого поля, но переспрашиваем только обязательные
+            if is_optional(spec):
+                valid[name] = None
+            else:
+                problems.append(name)
+            continue
+        ok, value = _coerce(data[name], compile_field(spec))
+        if ok:
+            valid[name] = value
+        else:
+            problems.append(name)
+    return valid, problems
@@ -1,50 +1,200 @@
+import httpx
 from openai import OpenAI
-from config import LOCAL_LLM_URL, LOCAL_LLM_API_KEY, LOCAL_LLM_MODEL
+from config import (
+    LOCAL_LLM_URL,
+    LOCAL_LLM_API_KEY,
+    LOCAL_LLM_MODEL,
+    LLM_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_MAX_RETRIES,
+    LLM_ENDPOINTS,
+    LLM_ENDPOINT_CONCURRENCY,
+    LLM_HEALTH_INTERVAL,
+    LLM_EJECT_AFTER_FAILURES,
+    LLM_EJECT_SECONDS,
+    LLM_ADAPTIVE_CONCURRENCY,
+    LLM_ADAPTIVE_MAX_CONCURRENCY,
+    LLM_SINGLE_FLIGHT_ENABLED,
+    LLM_STAGE_SETTINGS
+)
 from pydantic import BaseModel
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Union, Optional
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 import json
+import time
+import threading
 from utils.logger import logger
+from utils.metrics import JobMetrics
+from utils.llm_router import LLMRouter, parse_endpoints, is_endpoint_failure
+from utils.single_flight import SingleFlight, request_key
+
+
+def create_llm_client(base_url: str = LOCAL_LLM_URL, api_key: str = LOCAL_LLM_API_KEY) -> OpenAI:
+    """OpenAI-клиент с явно настроенным пулом соединений и таймаутами"""
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    )
+    return OpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=LLM_MAX_RETRIES)
+
+
+def _create_router(spec: str) -> LLMRouter:
+    return LLMRouter(
+        parse_endpoints(spec, LLM_ENDPOINT_CONCURRENCY),
+        create_llm_client,
+        eject_after=LLM_EJECT_AFTER_FAILURES,
+        eject_seconds=LLM_EJECT_SECONDS,
+        health_interval=LLM_HEALTH_INTERVAL,
+        probe_timeout=LLM_CONNECT_TIMEOUT,
+        adaptive_max=LLM_ADAPTIVE_MAX_CONCURRENCY if LLM_ADAPTIVE_CONCURRENCY else 0
+    )
+
+
+# Серверы LLM и их клиенты (пулы соединений) - один набор на процесс; закрывается ServiceContainer.shutdown()
+router = _create_router(LLM_ENDPOINTS)
+# Клиент первого сервера - для кода, которому нужен один конкретный клиент
+client = router.endpoints[0].client
+# Строка серверов -> балансировщик. Этапы со своими серверами (LLM_<ЭТАП>_ENDPOINTS) получают свой набор
+routers: Dict[str, LLMRouter] = {LLM_ENDPOINTS: router}
+_routers_lock = threading.Lock()
+
+# Этап -> ограничение одновременных запросов этапа (LLM_<ЭТАП>_CONCURRENCY)
+_stage_slots = {
+    stage: threading.BoundedSemaphore(settings["concurrency"])
+    for stage, settings in LLM_STAGE_SETTINGS.items()
+    if settings["concurrency"] > 0
+}
+
+# Одинаковые запросы, выполняющиеся одновременно (повторная отправка, два задания по одним лотам), склеиваются
+inflight = SingleFlight()
+
+# Клиент и метрики текущего задания. ContextVar изолирует их между потоками и asyncio-задачами,
+# поэтому параллельные задания не видят чужих счетчиков
+_scope_client: ContextVar[Optional[OpenAI]] = ContextVar("llm_scope_client", default=None)
+_scope_metrics: ContextVar[Optional[JobMetrics]] = ContextVar("llm_scope_metrics", default=None)
+
+
+@contextmanager
+def llm_scope(scope_client: Optional[OpenAI] = None, metrics: Optional[JobMetrics] = None):
+    """Все вызовы get_completion внутри блока идут через scope_client и учитываются в metrics"""
+    client_token = _scope_client.set(scope_client)
+    metrics_token = _scope_metrics.set(metrics)
+    try:
+        yield
+    finally:
+        _scope_client.reset(client_token)
+        _scope_metrics.reset(metrics_token)
+
+
+def current_metrics() -> Optional[JobMetrics]:
+    """Метрики текущего задания (None вне llm_scope)"""
+    return _scope_metrics.get()
+
+
+def stage_settings(stage: Optional[str]) -> Dict[str, Any]:
+    """Модель, серверы, таймаут и параллельность этапа (None - общие настройки)"""
+    if stage is None:
+        return {"model": LOCAL_LLM_MODEL, "endpoints": LLM_ENDPOINTS, "timeout": LLM_TIMEOUT, "concurrency": 0}
+    if stage not in LLM_STAGE_SETTINGS:
+        raise ValueError(f"Неизвестный этап LLM: {stage}")
+    return LLM_STAGE_SETTINGS[stage]
+
+
+def router_for(stage: Optional[str]) -> LLMRouter:
+    """Балансировщик серверов этапа (создается при первом обращении)"""
+    spec = stage_settings(stage)["endpoints"]
+    with _routers_lock:
+        if spec not in routers:
+            logger.info(f"Отдельные LLM-серверы для этапа {stage}")
+            routers[spec] = _create_router(spec)
+        return routers[spec]
+
+
+def parallel_capacity(stage: Optional[str] = None, current: bool = False) -> int:
+    """
+    Сколько запросов get_completion этапа имеет смысл выполнять параллельно в текущем контексте
+    :param current: текущие адаптивные лимиты серверов вместо их потолка
+    """
+    if _scope_client.get():
+        return 1
+    llm_router = router_for(stage)
+    capacity = llm_router.current_capacity() if current else llm_router.capacity
+    concurrency = stage_settings(stage)["concurrency"]
+    return min(capacity, concurrency) if concurrency > 0 else capacity
 
-client = OpenAI(base_url=LOCAL_LLM_URL, api_key=LOCAL_LLM_API_KEY)
 
 def get_completion(
     messages: List[Dict],
     response_format: Any = None,
     tools: List[Dict] = None,
-    tool_choice: Union[str, Dict] = None
+    tool_choice: Union[str, Dict] = None,
+    stage: Optional[str] = None
 ):
     """
     Получение ответа от LLM
     :param messages: список сообщений для модели
-    :param response_format: Pydantic модель для структурированного вывода
+    :param response_format: Pydantic модель для структурированного вывода или готовый словарь response_format
     :param tools: список инструментов для вызова
     :param tool_choice: выбор инструмента ('auto', 'required', 'none' или конкретный инструмент)
+    :param stage: этап (LLM_STAGES) - определяет модель, серверы, таймаут и параллельность
     :return: ответ модели
     """
-    logger.info(f"Отправляем запрос к LLM с {len(messages)} сообщениями")
+    settings = stage_settings(stage)
+    logger.info(f"Отправляем запрос к LLM с {len(messages)} сообщениями (этап {stage or '-'}, модель {settings['model']})")
 
+    scope_client = _scope_client.get()
+    metrics = _scope_metrics.get()
+    started = time.monotonic()
     try:
         # Подготовим параметры для вызова
         params = {
-            "model": LOCAL_LLM_MODEL,
-            "messages": messages
+            "model": settings["model"],
+            "messages": messages,
+            "timeout": settings["timeout"]
         }
 
         if response_format:
-            # Используем структурированный вывод
             params["response_format"] = response_format
-            completion = client.beta.chat.completions.parse(**params)
-        else:
+        elif tools:
             # Добавим параметры для инструментов, если они указаны
-            if tools:
-                params["tools"] = tools
-                if tool_choice:
-                    params["tool_choice"] = tool_choice
+            params["tools"] = tools
+            if tool_choice:
+                params["tool_choice"] = tool_choice
 
-            completion = client.chat.completions.create(**params)
+        def call():
+            with _stage_slots.get(stage) or nullcontext():
+                if scope_client:
+                    return _create_completion(scope_client, params)
+                return _routed_completion(router_for(stage), params)
+
+        shared = False
+        if LLM_SINGLE_FLIGHT_ENABLED:
+            target = f"scope:{id(scope_client)}" if scope_client else settings["endpoints"]
+            completion, shared = inflight.do(request_key(target, params), call)
+        else:
+            completion = call()
 
         response = completion.choices[0].message
 
+        # Ответ получен от такого же запроса, уже выполнявшегося, - токены потрачены не нами
+        usage = None if shared else getattr(completion, 'usage', None)
+        if shared:
+            logger.info(f"Ответ взят у такого же запроса, выполнявшегося одновременно ({inflight.stats()})")
+        if metrics:
+            metrics.record_llm(
+                time.monotonic() - started,
+                usage.prompt_tokens if usage else 0,
+                usage.completion_tokens if usage else 0
+            )
+
         # Логируем информацию о токенах, если она доступна
         if hasattr(completion, 'usage'):
             logger.info(f"Токены: prompt={completion.usage.prompt_tokens}, "
@@ -57,9 +207,44 @@ def get_completion(
         return response
     except Exception as e:
         logger.error(f"Ошибка при обращении к LLM: {e}")
+        if metrics:
+            metrics.record_llm(time.monotonic() - started, error=True)
         raise
 
 
+def _create_completion(llm: OpenAI, params: Dict[str, Any]):
+    response_format = params.get("response_format")
+    if response_format and not isinstance(response_format, dict):
+        # Pydantic-модель - структурированный вывод
+        return llm.beta.chat.completions.parse(**params)
+    # Готовый response_format (JSON Schema) сервер переводит в грамматику
+    return llm.chat.completions.create(**params)
+
+
+def _routed_completion(llm_router: LLMRouter, params: Dict[str, Any]):
+    """Запрос через балансировщик: если сервер не ответил, пробуем следующий"""
+    tried = []
+    while True:
+        endpoint = llm_router.acquire(exclude=tried)
+        ok = True
+        seconds, tokens = None, 0
+        started = time.monotonic()
+        try:
+            completion = _create_completion(endpoint.client, params)
+            seconds = time.monotonic() - started
+            usage = getattr(completion, "usage", None)
+            tokens = (usage.prompt_tokens + usage.completion_tokens) if usage else 0
+            return completion
+        except Exception as e:
+            ok = not is_endpoint_failure(e)
+            tried.append(endpoint)
+            if ok or len(tried) >= len(llm_router.endpoints):
+                raise
+            logger.warning(f"LLM-сервер {endpoint.url} не ответил ({e}), пробуем другой")
+        finally:
+            llm_router.release(endpoint, ok, seconds, tokens)
+
+
 def parse_tool_calls(tool_calls_str: str) -> List[Dict]:
     """
     Парсинг вызовов инструментов из текстового формата
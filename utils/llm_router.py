@@ -0,0 +1,257 @@
+"""
+Балансировка запросов между несколькими OpenAI-совместимыми серверами.
+
+Запрос уходит на сервер с наименьшей загрузкой (выполняющиеся запросы
+относительно его лимита). Лимит сервера либо фиксированный, либо подстраивается
+под наблюдаемую задержку (GradientLimit). Сервер, который несколько раз подряд
+не ответил, исключается из ротации, а фоновая проверка возвращает его, когда он
+снова отвечает. Лимиты действуют в пределах процесса.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import httpx
+from openai import OpenAI, APIConnectionError, InternalServerError
+from utils.concurrency_limit import GradientLimit
+from utils.logger import logger
+
+
+# Потолок времени вне ротации при повторных исключениях
+MAX_EJECT_SECONDS = 300
+
+
+def parse_endpoints(spec: str, default_concurrency: int) -> List[Tuple[str, int]]:
+    """ "url|N,url" -> [(url, N), (url, default_concurrency)] """
+    endpoints = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, limit = item.partition("|")
+        endpoints.append((url.strip().rstrip("/"), int(limit) if limit.strip() else default_concurrency))
+    return endpoints
+
+
+class Endpoint:
+    """Один сервер: клиент, лимит одновременных запросов и состояние здоровья"""
+
+    def __init__(self, url: str, client: OpenAI, max_concurrency: int, limiter: Optional[GradientLimit] = None):
+        self.url = url
+        self.client = client
+        self.max_concurrency = max(1, max_concurrency)
+        # Адаптивный лимит; None - всегда max_concurrency
+        self.limiter = limiter
+        self.outstanding = 0
+        self.dispatched = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until: Optional[float] = None  # None - в ротации
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until is not None
+
+    @property
+    def limit(self) -> int:
+        """Сколько запросов сейчас можно отправить на сервер одновременно"""
+        return max(1, int(self.limiter.limit)) if self.limiter else self.max_concurrency
+
+    @property
+    def capacity(self) -> int:
+        """Верхняя граница лимита"""
+        return int(self.limiter.max_limit) if self.limiter else self.max_concurrency
+
+    def load(self) -> float:
+        return self.outstanding / self.limit
+
+    def stats(self) -> Dict:
+        stats = {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "limit": self.limit,
+            "max_concurrency": self.capacity,
+            "dispatched": self.dispatched,
+            "failures": self.failures,
+            "ejected": self.ejected,
+        }
+        if self.limiter:
+            stats["adaptive"] = self.limiter.stats()
+        return stats
+
+
+class LLMRouter:
+    """
+    Выбор сервера для запроса: least outstanding requests с лимитом на сервер.
+
+    endpoint = router.acquire()
+    try:
+        endpoint.client.chat.completions.create(...)
+    finally:
+        router.release(endpoint, ok, seconds, tokens)
+
+    Если все серверы заняты, acquire() ждет освобождения. Если все исключены,
+    запрос все равно уходит на тот, что исключен раньше всех: ошибка
+    вернется вызывающему коду, а не зависнет в очереди.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Tuple[str, int]],
+        client_factory: Callable[[str], OpenAI],
+        eject_after: int = 3,
+        eject_seconds: float = 15,
+        health_interval: float = 10,
+        probe_timeout: float = 5,
+        adaptive_max: int = 0
+    ):
+        """
+        :param adaptive_max: потолок адаптивного лимита сервера (0 - лимиты фиксированные).
+            Заданный для сервера лимит становится начальным
+        """
+        if not endpoints:
+            raise ValueError("Не задан ни один адрес LLM")
+        self.endpoints = [
+            Endpoint(url, client_factory(url), limit, GradientLimit(limit, max_limit=max(limit, adaptive_max)) if adaptive_max > 0 else None)
+            for url, limit in endpoints
+        ]
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.probe_timeout = probe_timeout
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        logger.info(f"LLM-серверы: {[(e.url, e.limit, e.capacity) for e in self.endpoints]}")
+
+    @property
+    def capacity(self) -> int:
+        """Сколько запросов можно выполнять одновременно на всех серверах (при адаптивных лимитах - потолок)"""
+        return sum(endpoint.capacity for endpoint in self.endpoints)
+
+    def current_capacity(self) -> int:
+        """Сумма текущих лимитов серверов в ротации"""
+        with self._cond:
+            return sum(endpoint.limit for endpoint in self.endpoints if not endpoint.ejected) or 1
+
+    def _pick(self, exclude: List[Endpoint]) -> Optional[Endpoint]:
+        candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+        live = [e for e in candidates if not e.ejected]
+        if not live:
+            # Все исключены - пробуем тот, что исключен раньше всех
+            live = [min(candidates, key=lambda e: e.ejected_until)]
+        free = [e for e in live if e.outstanding < e.limit]
+        if not free:
+            return None
+        return min(free, key=lambda e: (e.load(), e.dispatched))
+
+    def acquire(self, exclude: Optional[List[Endpoint]] = None) -> Endpoint:
+        """
+        Занимает слот на наименее загруженном сервере
+        :param exclude: серверы, которые уже не ответили на этот запрос
+        """
+        self._ensure_health_checks()
+        with self._cond:
+            while True:
+                endpoint = self._pick(exclude or [])
+                if endpoint:
+                    endpoint.outstanding += 1
+                    endpoint.dispatched += 1
+                    return endpoint
+                self._cond.wait(timeout=1)
+
+    def release(self, endpoint: Endpoint, ok: bool = True, seconds: Optional[float] = None, tokens: int = 0):
+        """
+        Освобождает слот
+        :param ok: False - сервер не ответил (соединение, таймаут, 5xx)
+        :param seconds: задержка успешного запроса - замер для адаптивного лимита
+        :param tokens: токены запроса (prompt + completion)
+        """
+        with self._cond:
+            if endpoint.limiter:
+                self._adapt(endpoint, ok, seconds, tokens)
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.ejections = 0
+                if endpoint.ejected:
+                    # Исключенный сервер ответил (запрос ушел на него, потому что живых не было)
+                    self._readmit(endpoint)
+            else:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if not endpoint.ejected and endpoint.consecutive_failures >= self.eject_after:
+                    self._eject(endpoint, f"{endpoint.consecutive_failures} ошибок подряд")
+            self._cond.notify_all()
+
+    def _adapt(self, endpoint: Endpoint, ok: bool, seconds: Optional[float], tokens: int):
+        before = endpoint.limit
+        if not ok:
+            endpoint.limiter.on_drop()
+        elif seconds is not None:
+            endpoint.limiter.on_sample(seconds, tokens, endpoint.outstanding)
+        if endpoint.limit != before:
+            logger.info(f"LLM-сервер {endpoint.url}: лимит одновременных запросов {before} -> {endpoint.limit} ({endpoint.limiter.stats()})")
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        endpoint.ejections += 1
+        seconds = min(MAX_EJECT_SECONDS, self.eject_seconds * 2 ** (endpoint.ejections - 1))
+        endpoint.ejected_until = time.monotonic() + seconds
+        logger.warning(f"LLM-сервер {endpoint.url} исключен из ротации на {seconds:.0f} с: {reason}")
+
+    def _readmit(self, endpoint: Endpoint):
+        endpoint.ejected_until = None
+        endpoint.consecutive_failures = 0
+        logger.info(f"LLM-сервер {endpoint.url} снова в ротации")
+
+    def _ensure_health_checks(self):
+        # С одним сервером исключать некуда - проверки не нужны
+        if len(self.endpoints) < 2 or self._health_thread or self.health_interval <= 0:
+            return
+        with self._cond:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        with httpx.Client(timeout=self.probe_timeout) as http:
+            while not self._stop.wait(self.health_interval):
+                for endpoint in self.endpoints:
+                    self.check(endpoint, http)
+
+    def check(self, endpoint: Endpoint, http: httpx.Client) -> bool:
+        """
+        Проверка сервера запросом GET /models. Исключенный сервер возвращается
+        в ротацию после истечения срока и успешной проверки, недоступный - исключается.
+        """
+        if endpoint.ejected and time.monotonic() < endpoint.ejected_until:
+            return False
+        try:
+            healthy = http.get(f"{endpoint.url}/models").status_code < 500
+        except httpx.HTTPError:
+            healthy = False
+
+        with self._cond:
+            if healthy and endpoint.ejected:
+                self._readmit(endpoint)
+                self._cond.notify_all()
+            elif not healthy and not endpoint.ejected:
+                self._eject(endpoint, "не отвечает на проверку")
+            elif not healthy:
+                # Срок истек, но сервер все еще лежит - продлеваем исключение
+                self._eject(endpoint, "повторная проверка не прошла")
+        return healthy
+
+    def stats(self) -> List[Dict]:
+        with self._cond:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def close(self):
+        self._stop.set()
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Ошибка сервера (нет соединения, таймаут, 5xx), а не самого запроса"""
+    return isinstance(error, (APIConnectionError, InternalServerError, httpx.TransportError))
@@ -59,7 +59,7 @@ def process_llm_response_with_tools(messages: List[Dict]):
     logger.info("Обрабатываем ответ LLM с возможными вызовами инструментов")
     
     # Получаем ответ от LLM
-    response = get_completion(messages, tools=get_available_tools())
+    response = get_completion(messages, tools=get_available_tools(), stage="chat")
     
     # Проверяем, есть ли вызовы инструментов в ответе
     if hasattr(response, 'tool_calls') and response.tool_calls:
@@ -91,7 +91,7 @@ def process_llm_response_with_tools(messages: List[Dict]):
             })
         
         # После выполнения инструментов, снова обращаемся к LLM с результатами
-        final_response = get_completion(messages)
+        final_response = get_completion(messages, stage="chat")
         return final_response
     else:
         # Если нет вызовов инструментов, возвращаем обычный ответ
@@ -0,0 +1,37 @@
+import threading
+import time
+from typing import Any, Dict
+
+
+class JobMetrics:
+    """Счетчики одного задания: вызовы LLM, токены, время (потокобезопасно)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.monotonic()
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_llm(self, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0, error: bool = False):
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_errors += int(error)
+            self.prompt_tokens += prompt_tokens or 0
+            self.completion_tokens += completion_tokens or 0
+            self.llm_seconds += seconds
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job": self.name,
+                "elapsed_s": round(time.monotonic() - self.started_at, 1),
+                "llm_calls": self.llm_calls,
+                "llm_errors": self.llm_errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "llm_s": round(self.llm_seconds, 1),
+            }
@@ -0,0 +1,123 @@
+"""
+Стадии конвейера на потоках с ограниченными очередями между ними.
+
+Каждая стадия - поток, который берет элементы из входной очереди и кладет
+результат в выходную. Очереди ограничены, поэтому быстрая стадия не убегает
+вперед медленной больше чем на maxsize элементов. Поток запускается в копии
+контекста создателя: вызовы get_completion внутри стадии идут через клиент и
+метрики задания (llm_scope).
+"""
+import queue
+import threading
+import contextvars
+from typing import Any, Callable, Optional
+from utils.logger import logger
+
+
+# Маркер конца потока элементов
+DONE = object()
+
+
+class Stage:
+    """
+    Стадия конвейера.
+
+    func(item) -> результат для outbox (None - элемент дальше не передается).
+    workers > 1 - элементы обрабатывают несколько потоков (порядок на выходе не сохраняется).
+    on_done() вызывается после последнего элемента, до маркера конца в outbox.
+    Ошибка стадии не теряется: join() пробрасывает ее в вызывающий поток.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        inbox: queue.Queue,
+        outbox: Optional[queue.Queue] = None,
+        on_done: Optional[Callable[[], None]] = None,
+        workers: int = 1
+    ):
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_done = on_done
+        self.processed = 0
+        self.error: Optional[BaseException] = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._running = max(1, workers)
+        # У каждого потока своя копия контекста: один Context нельзя войти из двух потоков сразу
+        self._threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._run,), name=f"{name}#{i}", daemon=True)
+            for i in range(self._running)
+        ]
+
+    def start(self) -> "Stage":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while True:
+                item = self.inbox.get()
+                if item is DONE:
+                    # Маркер возвращаем в очередь для остальных потоков стадии
+                    self.inbox.put(DONE)
+                    break
+                if self.error or self._cancelled.is_set():
+                    # После ошибки или отмены дочитываем очередь, чтобы не заблокировать предыдущую стадию
+                    continue
+                try:
+                    result = self.func(item)
+                except Exception as e:
+                    logger.exception(f"Стадия {self.name}: ошибка обработки элемента: {e}")
+                    self.error = e
+                    continue
+                with self._lock:
+                    self.processed += 1
+                if result is not None and self.outbox is not None:
+                    self.outbox.put(result)
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last:
+                self._finish()
+
+    def _finish(self):
+        """Выполняется последним завершившимся потоком стадии"""
+        try:
+            if self.on_done and not self.error and not self._cancelled.is_set():
+                self.on_done()
+        except Exception as e:
+            logger.exception(f"Стадия {self.name}: ошибка завершения: {e}")
+            self.error = e
+        finally:
+            if self.outbox is not None:
+                self.outbox.put(DONE)
+            logger.info(f"Стадия {self.name} завершена, обработано элементов: {self.processed}")
+
+    def cancel(self):
+        """Оставшиеся элементы пропускаются без обработки (например, следующая стадия упала)"""
+        self._cancelled.set()
+
+    def join(self, raise_error: bool = True):
+        for thread in self._threads:
+            thread.join()
+        if self.error and raise_error:
+            raise self.error
+
+
+def bounded_queue(maxsize: int) -> queue.Queue:
+    return queue.Queue(maxsize=max(1, maxsize))
+
+
+def drain(source: queue.Queue):
+    """Элементы очереди до маркера DONE"""
+    while True:
+        item = source.get()
+        if item is DONE:
+            return
+        yield item
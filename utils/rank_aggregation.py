@@ -0,0 +1,77 @@
+from typing import List, Tuple
+import numpy as np
+
+
+def pairwise_wins(orderings: List[List[int]], n_items: int) -> np.ndarray:
+    """
+    Разбивает упорядоченные группы на попарные победы (full rank breaking)
+    :param orderings: группы в виде списков индексов лотов от лучшего к худшему
+    :param n_items: общее число лотов
+    :return: матрица W, где W[i, j] - сколько раз лот i оказался выше лота j
+    """
+    wins = np.zeros((n_items, n_items))
+    for ordering in orderings:
+        idx = np.asarray(ordering)
+        upper, lower = np.triu_indices(len(idx), 1)
+        np.add.at(wins, (idx[upper], idx[lower]), 1)
+    return wins
+
+
+def bradley_terry(wins: np.ndarray, prior: float = 0.5, iterations: int = 500, tol: float = 1e-8) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Оценка модели Брэдли-Терри MM-алгоритмом (Hunter, 2004).
+
+    Каждый лот дополнительно играет prior побед и prior поражений с виртуальным
+    "средним" лотом силы 1: это регуляризация, без которой у непобежденных
+    лотов сила уходит в бесконечность, и она же фиксирует масштаб.
+    :return: (theta - логарифм силы, cov - ковариационная матрица theta)
+    """
+    games = wins + wins.T
+    total_wins = wins.sum(axis=1)
+    strength = np.ones(len(wins))
+
+    for _ in range(iterations):
+        denom = (games / (strength[:, None] + strength[None, :])).sum(axis=1) + 2 * prior / (strength + 1)
+        new_strength = (total_wins + prior) / denom
+        converged = np.max(np.abs(np.log(new_strength) - np.log(strength))) < tol
+        strength = new_strength
+        if converged:
+            break
+
+    theta = np.log(strength)
+
+    # Информация Фишера по theta: I_ii = sum_j n_ij p_ij (1 - p_ij), I_ij = -n_ij p_ij (1 - p_ij)
+    p = strength[:, None] / (strength[:, None] + strength[None, :])
+    variance = games * p * (1 - p)
+    p_virtual = strength / (strength + 1)
+    information = np.diag(variance.sum(axis=1) + 2 * prior * p_virtual * (1 - p_virtual)) - variance
+    cov = np.linalg.inv(information)
+    return theta, cov
+
+
+def top_k_stability(theta: np.ndarray, cov: np.ndarray, k: int, samples: int = 2000, seed: int = 0) -> float:
+    """
+    Уверенность в текущем топ-K, оцененная сэмплированием theta из нормального
+    приближения апостериорного распределения. Берется меньшая из двух оценок:
+    - состав: доля текущего топ-K, остающаяся в топ-K сэмпла, нормированная на
+      случайный уровень k/n (0 - не лучше случайного судьи, 1 - состав не меняется);
+    - порядок: доля пар внутри топ-K, упорядоченных в сэмпле так же, как сейчас.
+    Вероятность полного совпадения состава не подходит: лоты у границы топ-K
+    почти равны, и она почти не растет с числом раундов.
+    """
+    n = len(theta)
+    k = min(k, n)
+    current = np.argsort(-theta)[:k]
+
+    rng = np.random.default_rng(seed)
+    draws = rng.multivariate_normal(theta, cov, size=samples, method="eigh")
+    # ranks[s, j] - место лота current[j] в сэмпле s
+    ranks = np.argsort(np.argsort(-draws, axis=1), axis=1)[:, current]
+
+    composition = ((ranks < k).mean() - k / n) / (1 - k / n) if k < n else 1.0
+    if k >= 2:
+        higher, lower = np.triu_indices(k, 1)
+        order = (ranks[:, higher] < ranks[:, lower]).mean()
+    else:
+        order = 1.0
+    return float(max(0.0, min(composition, order)))
@@ -0,0 +1,242 @@
+"""
+Детерминированное извлечение типовых характеристик из текста объявления.
+
+Экстрактор - функция (имя поля, описание поля из схемы, текст) -> значение или None.
+Поле выбирается по словам его имени (snake_case, имена полей схемы английские):
+ключевое слово должно начинать слово имени, поэтому frame_material не считается
+полем ram. Значение возвращается только при однозначном совпадении: если в тексте
+несколько разных кандидатов, поле остается LLM. Новые экстракторы
+подключаются декоратором @register_extractor.
+"""
+import re
+from typing import Any, Callable, Dict, List, Optional
+from utils.logger import logger
+
+
+RuleExtractor = Callable[[str, dict, str], Optional[Any]]
+
+_EXTRACTORS: List[RuleExtractor] = []
+
+
+def register_extractor(func: RuleExtractor) -> RuleExtractor:
+    _EXTRACTORS.append(func)
+    return func
+
+
+def _name_words(name: str) -> List[str]:
+    """Слова имени поля: storage_capacity / storageCapacity -> ["storage", "capacity"]"""
+    return re.findall(r"[a-zа-яё]+|\d+", re.sub(r"([a-z])([A-Z])", r"\1_\2", name).lower())
+
+
+def _mentions(name: str, keywords: List[str]) -> bool:
+    """Поле относится к характеристике, если одно из слов его имени начинается с ключевого слова"""
+    return any(word.startswith(keyword) for word in _name_words(name) for keyword in keywords)
+
+
+# Слова, по которым поле - качественная характеристика (тип, материал, состояние), а не число
+QUALITATIVE_WORDS = ["type", "kind", "material", "condition", "state", "status", "color", "colour",
+                     "brand", "model", "тип", "материал", "состояни", "цвет"]
+
+
+def _unique(values: List[Any]) -> Optional[Any]:
+    distinct = list(dict.fromkeys(values))
+    return distinct[0] if len(distinct) == 1 else None
+
+
+def _match_enum(spec: dict, value: str) -> Optional[str]:
+    """Приводит значение к варианту enum (сравнение без пробелов и регистра)"""
+    normalized = re.sub(r"\s+", "", value).lower()
+    for option in spec.get("enum", []):
+        if re.sub(r"\s+", "", str(option)).lower() == normalized:
+            return option
+    return None
+
+
+def _format_value(spec: dict, number: float, unit: str = "") -> Optional[Any]:
+    field_type = spec.get("type", "string")
+    if field_type == "integer":
+        return int(number) if number == int(number) else None
+    if field_type == "number":
+        return number
+    if field_type != "string":
+        return None
+
+    number_str = str(int(number)) if number == int(number) else str(number)
+    if spec.get("enum"):
+        return _match_enum(spec, f"{number_str}{unit}")
+    return f"{number_str} {unit}".strip()
+
+
+STORAGE_PATTERN = re.compile(r"(\d{1,4})\s*(gb|гб|tb|тб)\b", re.IGNORECASE)
+# Телефонная запись "8/256" - оперативная / встроенная память
+RAM_STORAGE_PATTERN = re.compile(r"\b(\d{1,2})\s*/\s*(\d{2,4})\s*(?:gb|гб)?\b", re.IGNORECASE)
+
+
+def _memory_typed(spec: dict) -> bool:
+    """Значения поля - объем памяти в ГБ/ТБ (по описанию или вариантам enum)"""
+    haystack = f"{spec.get('description', '')} {' '.join(str(o) for o in spec.get('enum', []))}".lower()
+    return any(unit in haystack for unit in ["gb", "гб", "tb", "тб", "памят"])
+
+
+def _memory_candidates(text: str) -> List[tuple]:
+    result = []
+    for number, unit in STORAGE_PATTERN.findall(text):
+        unit = "TB" if unit.lower() in ("tb", "тб") else "GB"
+        result.append((float(number), unit))
+    return result
+
+
+@register_extractor
+def extract_storage(name: str, spec: dict, text: str) -> Optional[Any]:
+    # "Объем"/"capacity" бывает у двигателя, аккумулятора, бака - такие поля берем, только если они в ГБ/ТБ
+    is_storage = _mentions(name, ["storage", "ssd", "hdd", "rom", "disk", "накопител"])
+    is_capacity = _mentions(name, ["capacity", "memory", "volume", "объем", "объём", "памят"]) and _memory_typed(spec)
+    if not (is_storage or is_capacity):
+        return None
+    if _mentions(name, ["ram", "оператив", "озу", "battery", "аккумулятор", "батаре", "mah", "engine"] + QUALITATIVE_WORDS):
+        return None
+
+    pairs = RAM_STORAGE_PATTERN.findall(text)
+    if pairs:
+        value = _unique([(float(storage), "GB") for _, storage in pairs])
+    else:
+        # Объем накопителя - наибольшее значение (в тексте может быть и оперативная память)
+        candidates = _memory_candidates(text)
+        if not candidates:
+            return None
+        value = max(candidates, key=lambda c: c[0] * (1024 if c[1] == "TB" else 1))
+        if len({c for c in candidates if c[0] * (1024 if c[1] == "TB" else 1) >= 64}) > 1:
+            return None
+    if value is None:
+        return None
+    return _format_value(spec, value[0], value[1])
+
+
+@register_extractor
+def extract_ram(name: str, spec: dict, text: str) -> Optional[Any]:
+    if not _mentions(name, ["ram", "оператив", "озу"]) or _mentions(name, QUALITATIVE_WORDS):
+        return None
+
+    # Явное упоминание важнее записи "8/256": "12/128" может оказаться чем-то другим.
+    # "16 ГБ ОЗУ" надежнее, чем "ОЗУ 16 ГБ": после слова может сразу идти объем накопителя
+    ram_mentions = re.findall(r"(\d{1,3})\s*(?:gb|гб)\s*(?:ram|озу|оперативн)", text, re.IGNORECASE)
+    if not ram_mentions:
+        ram_mentions = re.findall(r"(?:ram|озу|оперативн\w*(?:\s+памят\w*)?)[\s:-]{0,3}(\d{1,3})\s*(?:gb|гб)", text, re.IGNORECASE)
+    if ram_mentions:
+        value = _unique([float(v) for v in ram_mentions])
+    else:
+        value = _unique([float(ram) for ram, _ in RAM_STORAGE_PATTERN.findall(text)])
+    if value is None:
+        return None
+    return _format_value(spec, value, "GB")
+
+
+@register_extractor
+def extract_year(name: str, spec: dict, text: str) -> Optional[Any]:
+    # Только "year" целиком: years_of_use / warranty_years - не год выпуска
+    words = _name_words(name)
+    if not any(word in ("year", "год") for word in words) or _mentions(name, ["warranty", "гарант"] + QUALITATIVE_WORDS):
+        return None
+    # Год - только рядом с "г."/"год"/"выпуск": "2000 мАч" и "за 2010 рублей" годами не считаются
+    years = re.findall(r"\b((?:19[89]|20[0-4])\d)\s*(?:г\.|г\b|год)", text, re.IGNORECASE)
+    years += re.findall(r"(?:год\w*|выпуск\w*|year)\D{0,15}?\b((?:19[89]|20[0-4])\d)\b", text, re.IGNORECASE)
+    value = _unique(years)
+    if value is None:
+        return None
+    return _format_value(spec, float(value))
+
+
+@register_extractor
+def extract_screen_size(name: str, spec: dict, text: str) -> Optional[Any]:
+    # Нужен именно размер: screen_condition, screen_resolution, display_type - не диагональ
+    is_diagonal = _mentions(name, ["diagonal", "inch", "диагонал", "дюйм"])
+    is_screen_size = _mentions(name, ["screen", "display", "экран", "дисплей"]) and _mentions(name, ["size", "размер"])
+    if not (is_diagonal or is_screen_size) or _mentions(name, QUALITATIVE_WORDS):
+        return None
+    values = re.findall(r"(\d{1,2}(?:[.,]\d{1,2})?)\s*(?:\"|''|”|дюйм\w*|inch\w*)", text, re.IGNORECASE)
+    value = _unique([float(v.replace(",", ".")) for v in values])
+    if value is None:
+        return None
+    return _format_value(spec, value, "\"" if spec.get("type") == "string" and not spec.get("enum") else "")
+
+
+@register_extractor
+def extract_battery_percent(name: str, spec: dict, text: str) -> Optional[Any]:
+    if not _mentions(name, ["battery", "аккумулятор", "акб", "батаре"]):
+        return None
+    # Процент здоровья, а не емкость в мАч или время работы
+    if spec.get("type") not in ("integer", "number") or _mentions(name, ["mah", "life", "hour", "time", "cycle", "цикл"]):
+        return None
+    values = re.findall(r"(?:battery|аккумулятор\w*|акб|батаре\w*|емкост\w*|ёмкост\w*)\D{0,20}?(\d{2,3})\s*%", text, re.IGNORECASE)
+    value = _unique([float(v) for v in values if float(v) <= 100])
+    if value is None:
+        return None
+    return _format_value(spec, value)
+
+
+NEW_PATTERN = re.compile(r"\b(?:новый|новая|новое|новые|в упаковке|запечатан\w*|не вскрыт\w*)\b", re.IGNORECASE)
+USED_PATTERN = re.compile(r"(?:\bб\s*/\s*у\b|\bб\.у\.?|\bбу\b|\bбыв\w* в употреблении|\bпользован\w*)", re.IGNORECASE)
+
+
+@register_extractor
+def extract_condition(name: str, spec: dict, text: str) -> Optional[Any]:
+    keywords = ["new", "used", "condition", "state", "нов", "состояни"]
+    if not _mentions(name, keywords):
+        return None
+    # Состояние товара целиком: screen_condition, battery_state - состояние детали, а не новый/б/у
+    filler = {"is", "item", "product", "overall", "general", "товар"}
+    if any(word not in filler and not any(word.startswith(k) for k in keywords) for word in _name_words(name)):
+        return None
+    is_new = bool(NEW_PATTERN.search(text))
+    is_used = bool(USED_PATTERN.search(text))
+    if is_new == is_used:
+        return None
+
+    if spec.get("type") == "boolean":
+        # Поле вида is_new / "новый ли товар" или is_used / "б/у ли товар"
+        asks_used = _mentions(name, ["used"])
+        return is_used if asks_used else is_new
+    if spec.get("type") == "string" and spec.get("enum"):
+        for option in spec["enum"]:
+            option_text = str(option).lower()
+            if is_new and ("нов" in option_text or option_text == "new"):
+                return option
+            if is_used and ("б/у" in option_text or "used" in option_text or "бу" == option_text):
+                return option
+    return None
+
+
+def _fits(spec: dict, value: Any) -> bool:
+    """Значение экстрактора соответствует типу поля (и enum, если он задан)"""
+    field_type = spec.get("type", "string")
+    if field_type == "boolean":
+        return isinstance(value, bool)
+    if field_type == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if field_type == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if not isinstance(value, str):
+        return False
+    return not spec.get("enum") or value in spec["enum"]
+
+
+def extract_known_fields(json_schema: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """
+    Заполняет поля схемы, которые удается надежно извлечь правилами
+    :param json_schema: плоская схема задачи (поле -> описание)
+    :param text: заголовок и описание объявления
+    :return: поле -> значение только для однозначно найденных полей
+    """
+    result = {}
+    for name, spec in json_schema.items():
+        if not isinstance(spec, dict):
+            spec = {"type": spec}
+        for extractor in _EXTRACTORS:
+            value = extractor(name, spec, text)
+            if value is not None and _fits(spec, value):
+                result[name] = value
+                break
+
+    if result:
+        logger.info(f"Правилами извлечено {len(result)}/{len(json_schema)} полей: {result}")
+    return result
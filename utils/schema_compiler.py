@@ -0,0 +1,109 @@
+"""
+Компиляция плоской схемы задачи (Schema.json_schema) в JSON Schema для
+ограниченной генерации: llama.cpp строит по ней грамматику (GBNF), и модель
+физически не может выдать невалидный JSON или значение вне enum.
+"""
+from typing import Any, Dict, Iterable, List
+
+
+JSON_TYPES = {"string", "integer", "number", "boolean"}
+
+# Служебные поля извлечения, которых нет в схеме задачи
+NOTE_FIELDS = {
+    "relevance_note": {"type": "string", "maxLength": 400},
+    "image_description_and_notes": {"type": "string", "maxLength": 600},
+}
+
+
+# Признаки полей, которые обычно определяются по фото, а не по тексту
+VISUAL_KEYWORDS = [
+    "фото", "визуал", "внешн", "цвет", "царапин", "скол", "потерт", "потёрт", "трещин", "вмятин",
+    "дефект", "корпус", "photo", "visual", "color", "colour", "scratch", "dent", "crack"
+]
+
+
+def is_visual_field(name: str, spec: Any) -> bool:
+    """Поле зависит от фото: явный флаг "visual" в схеме или характерные слова в имени/описании"""
+    if isinstance(spec, dict) and "visual" in spec:
+        return bool(spec["visual"])
+    description = spec.get("description", "") if isinstance(spec, dict) else ""
+    haystack = f"{name} {description}".lower()
+    return any(keyword in haystack for keyword in VISUAL_KEYWORDS)
+
+
+def is_optional(spec: Any) -> bool:
+    """null - допустимый ответ для поля (иначе поле переспрашивается)"""
+    return isinstance(spec, dict) and bool(spec.get("optional"))
+
+
+def as_optional(spec: Any) -> Dict[str, Any]:
+    """Копия поля, для которого null - допустимый ответ, без переспроса"""
+    if not isinstance(spec, dict):
+        spec = {"type": spec}
+    return {**spec, "optional": True}
+
+
+def changed_fields(old_schema: Dict[str, Any], new_schema: Dict[str, Any]) -> List[str]:
+    """
+    Поля новой схемы, которые нужно извлечь заново: добавленные и измененные
+    (тип, enum, описание, обязательность). Удаленные поля просто не переносятся.
+    """
+    return [
+        name for name, spec in new_schema.items()
+        if name not in old_schema
+        or compile_field(old_schema[name]) != compile_field(spec)
+        or is_optional(old_schema[name]) != is_optional(spec)
+    ]
+
+
+def compile_field(spec: Any) -> Dict[str, Any]:
+    """
+    Одно поле схемы задачи -> свойство JSON Schema.
+    Любое поле допускает null: иначе грамматика заставила бы модель выдумать
+    значение, которого нет в объявлении. "optional" на схему ответа не влияет -
+    он решает только, переспрашивать ли поле, оставшееся null (validate_fields)
+    """
+    if not isinstance(spec, dict):
+        spec = {"type": spec}
+
+    field_type = spec.get("type", "string")
+    if field_type not in JSON_TYPES:
+        field_type = "string"
+
+    prop: Dict[str, Any] = {"type": field_type}
+    if field_type == "string" and spec.get("enum"):
+        prop["enum"] = [str(option) for option in spec["enum"]]
+    if spec.get("description"):
+        prop["description"] = spec["description"]
+
+    prop["type"] = [field_type, "null"]
+    if "enum" in prop:
+        prop["enum"] = prop["enum"] + [None]
+    return prop
+
+
+def compile_extraction_schema(fields: Dict[str, Any], notes: Iterable[str] = tuple(NOTE_FIELDS)) -> Dict[str, Any]:
+    """
+    Собирает JSON Schema ответа извлечения
+    :param fields: поля схемы задачи, которые нужно извлечь
+    :param notes: какие служебные заметки добавить (relevance_note, image_description_and_notes)
+    :return: JSON Schema объекта
+    """
+    properties = {name: compile_field(spec) for name, spec in fields.items()}
+    for note in notes:
+        properties[note] = NOTE_FIELDS[note]
+
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties.keys()),
+        "additionalProperties": False,
+    }
+
+
+def response_format_for(json_schema: Dict[str, Any], name: str = "lot_extraction") -> Dict[str, Any]:
+    """Параметр response_format OpenAI-совместимого API (llama.cpp переводит его в грамматику)"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": json_schema},
+    }
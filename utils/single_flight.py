@@ -0,0 +1,75 @@
+"""
+Склейка одинаковых запросов, выполняющихся одновременно (single-flight).
+
+Первый запрос с данным ключом выполняется, остальные с тем же ключом ждут
+его результата (или его ошибки) вместо повторного вызова. Кэша нет:
+после завершения запроса следующий такой же выполняется заново.
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        :return: (результат, True - получен от уже выполнявшегося запроса)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+def request_key(*parts: Any) -> str:
+    """Хеш параметров запроса. Классы (Pydantic-модели response_format) - по имени и схеме"""
+    def default(value: Any) -> Any:
+        if isinstance(value, type):
+            schema = value.model_json_schema() if hasattr(value, "model_json_schema") else None
+            return {"class": f"{value.__module__}.{value.__qualname__}", "schema": schema}
+        return repr(value)
+
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,71 @@
+import re
+import zlib
+from typing import Dict, List, Set, Tuple
+import numpy as np
+
+
+# Простое число Мерсенна 2^31 - 1: произведение a * x помещается в uint64
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, k: int = 5) -> Set[int]:
+    """
+    Символьные k-граммы нормализованного текста, захешированные в 31 бит
+    :param text: заголовок + описание объявления
+    :param k: длина шингла
+    :return: множество хешей шинглов
+    """
+    normalized = re.sub(r"[^\w]+", " ", text.lower()).strip()
+    if len(normalized) <= k:
+        return {zlib.crc32(normalized.encode("utf-8")) % MERSENNE_PRIME}
+    return {
+        zlib.crc32(normalized[i:i + k].encode("utf-8")) % MERSENNE_PRIME
+        for i in range(len(normalized) - k + 1)
+    }
+
+
+class MinHashLSH:
+    """
+    MinHash-сигнатуры + LSH по полосам (bands) для поиска почти одинаковых текстов.
+
+    Кандидаты - пары, совпавшие хотя бы в одной полосе сигнатуры. Затем
+    пара подтверждается оценкой сходства Жаккара по полной сигнатуре.
+    """
+
+    def __init__(self, threshold: float, num_perm: int = 64, bands: int = 16, seed: int = 42):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.RandomState(seed)
+        # Семейство хеш-функций h(x) = (a * x + b) mod p
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.signatures: Dict[int, np.ndarray] = {}
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def signature(self, shingle_hashes: Set[int]) -> np.ndarray:
+        x = np.fromiter(shingle_hashes, dtype=np.uint64, count=len(shingle_hashes))
+        hashed = (self.a[:, None] * x[None, :] + self.b[:, None]) % MERSENNE_PRIME
+        return hashed.min(axis=1)
+
+    def add(self, item_id: int, text: str):
+        sig = self.signature(shingles(text))
+        self.signatures[item_id] = sig
+        for band in range(self.bands):
+            key = sig[band * self.rows:(band + 1) * self.rows].tobytes()
+            self.buckets[band].setdefault(key, []).append(item_id)
+
+    def similarity(self, id_a: int, id_b: int) -> float:
+        """Оценка сходства Жаккара по MinHash-сигнатурам"""
+        return float(np.mean(self.signatures[id_a] == self.signatures[id_b]))
+
+    def pairs(self) -> List[Tuple[int, int]]:
+        """Все пары почти одинаковых текстов (сходство >= threshold)"""
+        candidates = set()
+        for bucket in self.buckets:
+            for members in bucket.values():
+                for i in range(len(members)):
+                    for j in range(i + 1, len(members)):
+                        candidates.add((min(members[i], members[j]), max(members[i], members[j])))
+        return [pair for pair in candidates if self.similarity(*pair) >= self.threshold]
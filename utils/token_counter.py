@@ -0,0 +1,56 @@
+import math
+import re
+from typing import Dict, List
+
+
+# Запас на неточность оценки (реальный токенизатор модели локально недоступен)
+SAFETY_FACTOR = 1.1
+# Служебные токены шаблона чата на одно сообщение (<|im_start|>role ... <|im_end|>)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Грубая оценка токенов одного изображения для VL-модели
+IMAGE_TOKEN_ESTIMATE = 768
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|[А-Яа-яЁё]+|\d|[^\w\s]|\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Локальная оценка числа токенов без токенизатора модели.
+    BPE-словари Qwen/LLaMA: латиница ~4 символа на токен, кириллица ~3,
+    каждая цифра - отдельный токен, пунктуация - по токену.
+    """
+    if not text:
+        return 0
+
+    tokens = 0
+    for piece in TOKEN_PATTERN.findall(text):
+        if piece.isspace():
+            # Пробел обычно склеивается со следующим словом, переносы строк - отдельные токены
+            tokens += piece.count("\n")
+        elif piece.isdigit():
+            tokens += 1
+        elif piece[0].isascii() and piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 4)
+        elif piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+
+    return math.ceil(tokens * SAFETY_FACTOR)
+
+
+def estimate_messages_tokens(messages: List[Dict]) -> int:
+    """Оценка размера промпта для списка сообщений в формате OpenAI (включая мультимодальные)"""
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += estimate_tokens(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    total += IMAGE_TOKEN_ESTIMATE
+    return total